@@ -5,6 +5,7 @@ import threading
 import RPi.GPIO as GPIO
 from functools import wraps
 from MQTTComms import MQTTComms
+import profiling
 import Adafruit_DHT
 
 
@@ -72,6 +73,8 @@ def message_callback(callback):
         #decode and log the message and return the payload values
         message.payload = message.payload.decode("utf-8")
         logger.debug('Received Message: %s (%s)'%(message.payload,message.topic))
+        if profiling.enabled:
+            return profiling.timed(callback.__qualname__, callback, client, userdata, message)
         return callback(client,userdata,message)
     return message_handler
     
@@ -2,8 +2,18 @@
 import time
 import logging
 import threading
+import collections
+import concurrent.futures
 import paho.mqtt.client as mqtt
 from functools import wraps
+from backoff import Backoff
+from stats import RunningStats
+from publish_queue import PublishQueue, OVERFLOW_BLOCK
+from dispatcher import MessageDispatcher
+from topic_trie import TopicTrie, covering_filters
+from publish_policy import LastValueCache
+from telemetry import REGISTRY
+import profiling
 
 CONNECT_RESPONSE = {0: 'Connection successful',
                     1: 'Connection refused - incorrect protocol version',
@@ -13,6 +23,9 @@ CONNECT_RESPONSE = {0: 'Connection successful',
                     5: 'Connection refused - not authorised',
                     }
 
+LOOP_TIMEOUT = 1.0      # seconds the network thread blocks in paho's loop()
+CLOSE_TIMEOUT = 2.0     # max seconds close() waits for the DISCONNECT to be written
+
 _LOGGER = logging.getLogger("MQTT_Callback")
 
 def message_callback(callback):
@@ -22,8 +35,11 @@ def message_callback(callback):
     @wraps(callback)    #update attribute data for decorator
     def message_handler(inst,client,userdata,message):
         #decode and log the message and return the payload values
-        message.payload = message.payload.decode("utf-8")
-        _LOGGER.debug('Received Message: %s (%s)'%(message.payload,message.topic))
+        if isinstance(message.payload, bytes):
+            message.payload = message.payload.decode("utf-8")
+        _LOGGER.debug('Received Message: %s (%s)', message.payload, message.topic)
+        if profiling.enabled:
+            return profiling.timed(callback.__qualname__, callback, inst, client, userdata, message)
         return callback(inst,client,userdata,message)
     return message_handler
 
@@ -48,19 +64,92 @@ class MQTTComms:
             
         Keyword Args:
             message_callback: handle to function to handle message callbacks
+            publish_queue_size (int): size of the outbound publish queue.  When non-zero publish()
+                queues messages for a dedicated sender thread and returns right away (default 0)
+            overflow_policy (str): policy applied when the publish queue is full (default 'block')
+            offline_buffer (OfflineBuffer): buffer for messages published while the broker is
+                not connected.  Buffered messages are replayed on the next connection, the
+                buffer is closed by close().
+            dispatch_workers (int): number of worker threads used to run message callbacks.
+                When 0 callbacks run on paho's network thread (default 0)
+            dispatch_queue_size (int): max messages waiting for a dispatch worker (default 100)
+            port (int): broker port (default 1883)
+            keepalive (int): keepalive interval in seconds (default 60)
+            will_topic (str): availability topic.  A retained Last Will sets it to will_payload
+                if the connection drops, online_payload is published on every connection.
+            will_payload (str): payload published by the broker when the connection drops
+                (default 'offline')
+            online_payload (str): payload published on connection (default 'online')
+            reconnect_delay (float): first reconnect delay in seconds (default 1)
+            reconnect_max_delay (float): largest reconnect delay in seconds (default 60)
+            metrics (telemetry.Registry): registry the client records its metrics into
+                (default telemetry.REGISTRY)
+            publish_policy (PublishPolicy): default policy for topics without their own policy
+                (see set_publish_policy).  None sends every message (default None)
         
         """
         self.logger = logging.getLogger(self.__class__.__name__) #add a new logger handle
         self.lock = threading.RLock()
         self.broker = broker
         self.name = name
-        self.topics = topics
+        self.topics = topics if topics is not None else []
         self._username = username
         self._password = password
         self._connected = False
+        self._ready = threading.Event()     # set once the broker accepted the connection
+        self._ready_futures = []
         
         self.logger.info("Initialzing MQTT Client")
         self._message_callback = kwargs.pop('message_callback', None)
+        queue_size = kwargs.pop('publish_queue_size', 0)
+        overflow = kwargs.pop('overflow_policy', OVERFLOW_BLOCK)
+        self._publish_queue = PublishQueue(queue_size, overflow) if queue_size else None
+        self._sender_thread = None
+        self._offline_buffer = kwargs.pop('offline_buffer', None)
+        workers = kwargs.pop('dispatch_workers', 0)
+        dispatch_size = kwargs.pop('dispatch_queue_size', 100)
+        self._dispatcher = MessageDispatcher(workers, dispatch_size) if workers else None
+        self._router = TopicTrie()              # topic filter -> message callbacks
+        self._subscriptions = set(self.topics)  # filters requested through subscribe()
+        self._broker_filters = set()            # filters currently subscribed on the broker
+        self._sub_lock = threading.Lock()
+        self.port = kwargs.pop('port', 1883)
+        self.keepalive = kwargs.pop('keepalive', 60)
+        self._will_topic = kwargs.pop('will_topic', None)
+        self._will_payload = kwargs.pop('will_payload', 'offline')
+        self._online_payload = kwargs.pop('online_payload', 'online')
+        self._backoff = Backoff(kwargs.pop('reconnect_delay', 1.0), kwargs.pop('reconnect_max_delay', 60.0))
+        self._network_thread = None
+        self._stop_event = threading.Event()
+        self._stop_deadline = None
+        self._disconnected_at = None        # monotonic time the current outage started
+        self._outage_missed = 0             # messages not sent live during the current outage
+        self.reconnect_time = RunningStats()
+        self.outages = collections.deque(maxlen=20)
+        self._cache = LastValueCache(kwargs.pop('publish_policy', None))
+        self._publish_listeners = []
+        metrics = kwargs.pop('metrics', REGISTRY)
+        self._m_published = metrics.counter('mqtt_published_total', 'Messages passed to publish()',
+                                            client=name)
+        self._m_suppressed = metrics.counter('mqtt_suppressed_total',
+                                             'Messages suppressed by a publish policy', client=name)
+        self._m_sent = metrics.counter('mqtt_sent_total', 'Messages handed to the broker connection',
+                                       client=name)
+        self._m_unsent = metrics.counter('mqtt_unsent_total', 'Messages published while disconnected',
+                                         client=name)
+        self._m_received = metrics.counter('mqtt_received_total', 'Messages received', client=name)
+        self._m_handler = metrics.histogram('mqtt_handler_seconds', 'Message callback run time',
+                                            client=name)
+        self._m_reconnects = metrics.counter('mqtt_reconnects_total', 'Connections after an outage',
+                                             client=name)
+        metrics.gauge('mqtt_connected', 'Broker connection state',
+                      lambda: int(self._connected), client=name)
+        metrics.gauge('mqtt_publish_queue_depth', 'Messages waiting for the sender thread',
+                      lambda: self._publish_queue.depth if self._publish_queue else 0, client=name)
+        metrics.gauge('mqtt_dispatch_queue_depth', 'Messages waiting for a dispatch worker',
+                      lambda: self._dispatcher.depth if self._dispatcher else 0, client=name)
+        metrics.gauge('mqtt_offline_buffer_depth', 'Messages buffered for replay',
+                      lambda: len(self._offline_buffer) if self._offline_buffer else 0, client=name)
         #Argument checking
         if broker is None or type(broker) != type(str()):
             ErrorString = "broker is None type, a valid broker in string format must be provided"
@@ -71,111 +160,496 @@ class MQTTComms:
         self.client.username_pw_set(self._username,self._password)      #configure client credentials
         
         #register call_backs
-        self.client.on_log = self._on_log_callback
-        # self.client.on_message = self._on_message_callback
+        # paho formats its log lines lazily through a logger, an on_log callback would format
+        # every line on the network thread even with DEBUG disabled
+        self.client.enable_logger(logging.getLogger(self.logger.name + '.paho'))
+        self.client.on_message = self._on_message_callback
         self.client.on_connect = self._on_connect_callback
+        self.client.on_disconnect = self._on_disconnect_callback
+        if self._will_topic is not None:
+            self.client.will_set(self._will_topic, self._will_payload, qos=1, retain=True)
 
     def connect(self):
         """
-        Connect the MQTT client
+        Connect the MQTT client and start the network thread.  If the broker cannot be reached
+        the network thread keeps retrying with a jittered exponential backoff.
         """
-        self.logger.info("Connecting to broker: %s"%self.broker)
-        status = self.client.connect(self.broker)
-        self.client.loop_start()
-        
-        #subscribe to topics
-        for topic in self.topics:
-            self.logger.debug("Suscribing to topic: %s"%topic)
-            self.client.subscribe(topic)        
+        self.logger.info("Connecting to broker: %s", self.broker)
+        self._stop_event.clear()
+        try:
+            self.client.connect(self.broker, self.port, self.keepalive)
+        except OSError as e:
+            self.logger.error("Unable to connect to broker %s: %s", self.broker, e)
+            self._disconnected_at = time.monotonic()
+        self._network_thread = threading.Thread(target=self._network_loop, name="MQTT_Network")
+        self._network_thread.daemon = True
+        self._network_thread.start()
+        self._start_sender()
+        # topics are subscribed from _on_connect_callback once the broker accepts the connection
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Block until the broker has accepted the connection and subscriptions were sent
+
+        Args:
+            timeout (float): max seconds to wait, None waits forever
+
+        Returns:
+            ready (bool): True if the client is connected, False if the timeout expired
+        """
+        return self._ready.wait(timeout)
+
+    def ready_future(self):
+        """
+        Get a future that resolves once the broker has accepted the connection.  Async callers
+        can await it through asyncio.wrap_future().
+
+        Returns:
+            future (concurrent.futures.Future)
+        """
+        future = concurrent.futures.Future()
+        with self._sub_lock:
+            if self._ready.is_set():
+                future.set_result(True)
+            else:
+                self._ready_futures.append(future)
+        return future
 
     def subscribe(self, topic):
         """
-        Subscribe to an MQTT topic
+        Subscribe to an MQTT topic.  The broker is only sent the filters needed to cover all
+        requested topics, a topic already covered by a wildcard subscription is not sent.
 
         Args:
             topic (str): MQTT topic string
         """
-        self.client.subscribe(topic)
+        with self._sub_lock:
+            self._subscriptions.add(topic)
+            if self._connected:
+                self._update_subscriptions()
+
+    def _update_subscriptions(self):
+        """
+        Bring the broker subscriptions in line with the smallest set of filters covering the
+        requested topics.  Must be called with _sub_lock held.
+        """
+        wanted = set(covering_filters(self._subscriptions))
+        new = sorted(wanted - self._broker_filters)
+        stale = sorted(self._broker_filters - wanted)
+        if new:
+            self.logger.debug("Subscribing to topics: %s", new)
+            rc = self.client.subscribe([(topic, 0) for topic in new])[0]
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self._broker_filters.update(new)
+        if stale:
+            self.logger.debug("Unsubscribing from covered topics: %s", stale)
+            rc = self.client.unsubscribe(stale)[0]
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self._broker_filters.difference_update(stale)
 
     def close(self):
         """
         Close MQTT client connection
         """
-        self.client.loop_stop()
+        self._stop_sender()
+        if self._connected and self._will_topic is not None:
+            # a clean disconnect does not trigger the Last Will
+            self.client.publish(self._will_topic, self._will_payload, qos=1, retain=True)
+        self._stop_deadline = time.monotonic() + CLOSE_TIMEOUT
+        self._stop_event.set()
         self.client.disconnect()
+        if self._network_thread is not None:
+            self._network_thread.join()
+            self._network_thread = None
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        if self._offline_buffer is not None:
+            self._offline_buffer.close()
         
     def add_message_callback(self,topic,callback):
         """
-        Register a callback function for a given callback
+        Register a callback function for a given callback.  If dispatch workers are configured
+        the callback runs on the worker pool instead of paho's network thread.
         
         Args:
             topic (str): topic to bind callback to
             callback (obj): handle to callback function
         """
-        self.client.message_callback_add(topic, callback)
+        callback = self._timed(callback)
+        if self._dispatcher is not None:
+            callback = self._dispatched(callback)
+        self._router.add(topic, callback)
+
+    def add_publish_listener(self, callback):
+        """
+        Register a function that sees every message passed to publish(), including messages
+        the publish policy suppresses.  Used to keep a local history of published readings.
+
+        Args:
+            callback (obj): called as callback(topic, msg) from the publishing thread
+        """
+        self._publish_listeners.append(callback)
+
+    def _timed(self, callback):
+        """
+        Wrap a message callback to record its run time
+        """
+        @wraps(callback)
+        def handler(client, userdata, message):
+            start = time.monotonic()
+            try:
+                return callback(client, userdata, message)
+            finally:
+                self._m_handler.observe(time.monotonic() - start)
+        return handler
+
+    def _dispatched(self, callback):
+        """
+        Wrap a message callback so paho's network thread only hands the message to the
+        dispatcher
+        """
+        @wraps(callback)
+        def handler(client, userdata, message):
+            self._dispatcher.submit(message.topic, callback, client, userdata, message)
+        return handler
+
+    def dispatch_stats(self):
+        """
+        Get per topic handler run time and queue wait statistics
+
+        Returns:
+            stats (dict): topic -> statistics, or None if callbacks are not dispatched
+        """
+        if self._dispatcher is None:
+            return None
+        return self._dispatcher.stats()
         
-    def publish(self,topic, msg):
+    def publish(self,topic, msg, **kwargs):
         """
-        Publish a message on a given topic
+        Publish a message on a given topic.  If a publish queue is configured the message is
+        queued for the sender thread and this returns right away.
         
         Args:
             topic (str): topic to publish to
             msg (int,str): msg to publish
+
+        Keyword Args:
+            force (bool): send the message even if the topic's publish policy would suppress it
+            other keyword args are passed through to paho's publish (qos, retain)
         """
-        #self.logger.debug("Attempting to publish")
-        if self._connected:
-            self._get_mutex()
-            self.logger.debug("Publish {%s: %s}"%(topic,msg))
-            self.client.publish(topic,msg)
+        for listener in self._publish_listeners:
+            try:
+                listener(topic, msg)
+            except Exception as e:
+                self.logger.error("Publish listener for %s raised: %s", topic, e)
+        self._m_published.inc()
+        if self._cache.should_publish(topic, msg, force=kwargs.pop('force', False)):
+            self._enqueue(topic, msg, **kwargs)
+        else:
+            self._m_suppressed.inc()
+
+    def set_publish_policy(self, topic, policy):
+        """
+        Set the policy deciding when messages published on a topic are sent (duplicate
+        suppression, numeric deadband, minimum interval, heartbeat)
+
+        Args:
+            topic (str): topic the policy applies to
+            policy (PublishPolicy): policy, None sends every message
+        """
+        self._cache.set_policy(topic, policy)
+
+    def last_value(self, topic):
+        """
+        Get the last value sent on a topic
+
+        Args:
+            topic (str): topic
+
+        Returns:
+            value: last value sent, None if nothing was sent yet
+        """
+        return self._cache.get(topic)
+
+    def suppressed_stats(self):
+        """
+        Get the number of messages suppressed by publish policies
+
+        Returns:
+            stats (dict): topic -> suppressed message count
+        """
+        return self._cache.stats()
+
+    def _enqueue(self, topic, msg, **kwargs):
+        """
+        Queue a message for the sender thread, or send it right away if publishing is not queued
+        """
+        if self._publish_queue is not None:
+            self._publish_queue.put(topic, msg, **kwargs)
+        else:
+            self._send(topic, msg, **kwargs)
+
+    def publish_stats(self):
+        """
+        Get statistics for the publish queue
+
+        Returns:
+            stats (dict): queue depth, dropped messages and enqueue-to-send latency, or None if
+                publishing is not queued
+        """
+        if self._publish_queue is None:
+            return None
+        return self._publish_queue.stats()
+
+    def _send(self, topic, msg, **kwargs):
+        """
+        Hand a message to the paho client
+        """
+        self._get_mutex()
+        try:
+            if self._connected:
+                self.logger.debug("Publish {%s: %s}", topic, msg)
+                info = self.client.publish(topic, msg, **kwargs)
+                if info.rc != mqtt.MQTT_ERR_NO_CONN:
+                    self._m_sent.inc()
+                    return
+            self._buffer_message(topic, msg)
+        finally:
             self._release_lock()
+
+    def _buffer_message(self, topic, msg):
+        """
+        Handle a message that could not be sent because the broker is not connected
+        """
+        self._outage_missed += 1
+        self._m_unsent.inc()
+        if self._offline_buffer is None:
+            self.logger.debug("Broker not connected - published message not sent {%s: %s}", topic, msg)
         else:
-            self.logger.debug("Broker not connected - published message not sent {%s: %s}"%(topic,msg))
+            self.logger.debug("Broker not connected - buffering message {%s: %s}", topic, msg)
+            self._offline_buffer.append(topic, msg)
+
+    def _replay_offline_buffer(self):
+        """
+        Publish the messages buffered while the broker was not connected.  Superseded state
+        messages are collapsed so only the latest value per topic is sent.
+        """
+        if self._offline_buffer is None or not len(self._offline_buffer):
+            return
+        messages = self._offline_buffer.peek()
+        self.logger.info("Replaying %d buffered messages (%d collapsed)",
+                         len(messages), len(self._offline_buffer) - len(messages))
+        for topic, payload, _ in messages:
+            self.logger.debug("Replay {%s: %s}", topic, payload)
+            if self.client.publish(topic, payload).rc == mqtt.MQTT_ERR_NO_CONN:
+                self.logger.info("Connection lost during replay - keeping buffered messages")
+                return
+        self._offline_buffer.clear()
+
+    def _start_sender(self):
+        """
+        Start the thread that drains the publish queue
+        """
+        if self._publish_queue is None or self._sender_thread is not None:
+            return
+        self._sender_thread = threading.Thread(target=self._sender_loop, name="MQTT_Sender")
+        self._sender_thread.daemon = True
+        self._sender_thread.start()
+
+    def _stop_sender(self):
+        """
+        Flush the publish queue and stop the sender thread
+        """
+        if self._sender_thread is None:
+            return
+        self._publish_queue.close()
+        self._sender_thread.join()
+        self._sender_thread = None
+
+    def _sender_loop(self):
+        """
+        Sender thread body.  Publishes queued messages until the queue is closed.
+        """
+        while True:
+            item = self._publish_queue.get()
+            if item is None:
+                break
+            topic, msg, kwargs = item[:3]
+            try:
+                self._send(topic, msg, **kwargs)
+            except Exception as e:
+                self.logger.error("Error publishing {%s: %s}: %s", topic, msg, e)
+            self._publish_queue.task_done(item)
+
     def _get_mutex(self):
         """
-        Blocking method to wait for the thread lock to clear.  Keeps track of
-        how many attempts are made
+        Blocking method to wait for the publish lock.  Logs how long the wait took if the
+        lock was contended.
         """
-        attempts = 0
-        wait_time = 0.5     #seconds
-        lock_status = self.lock.acquire(0)  #attempt to get the lock
-        if lock_status:
+        if self.lock.acquire(False):
             return  #return if we got the lock
-        else:
-            #wait until we get the lock
-            while lock_status == False:
-                time.sleep(0.5)
-                attempts += 1
-                lock_status = self.lock.acquire(0)
-            
-            self.logger.debug('mutex acquired after %d attempts (%.2f sec)'%(attempts,attempts*wait_time))
+
+        start = time.monotonic()
+        self.lock.acquire()
+        self.logger.debug('mutex acquired after %.3f sec', time.monotonic() - start)
     
     def _release_lock(self):  
         self.lock.release()
         
-    def _on_log_callback(self, client, userdata, level, buf):
+    def connection_stats(self):
         """
-        logging callback
+        Get reconnect statistics
+
+        Returns:
+            stats (dict): connection state, reconnect time statistics and the duration and
+                number of messages missed for recent outages
         """
-        self.logger.debug(buf)
-        
+        return {'connected': self._connected,
+                'reconnect_time': self.reconnect_time.snapshot(),
+                'outages': list(self.outages),
+                }
+
+    def _network_loop(self):
+        """
+        Network thread body.  Runs paho's loop and reconnects with a jittered exponential
+        backoff whenever the connection is lost.  An unexpected error is logged and retried
+        after a backoff delay, the thread only ends on stop().
+        """
+        while True:
+            try:
+                if self._network_step():
+                    break
+            except Exception as e:
+                delay = self._backoff.next_delay()
+                self.logger.error("Network loop failed: %s - retrying in %.1f sec", e, delay)
+                if self._stop_event.wait(delay):
+                    break
+
+    def _network_step(self):
+        """
+        One pass of the network loop
+
+        Returns:
+            done (bool): True once the client was stopped
+        """
+        rc = self.client.loop(timeout=LOOP_TIMEOUT)
+        if self._stop_event.is_set():
+            # keep looping until the DISCONNECT packet has been written
+            return rc != mqtt.MQTT_ERR_SUCCESS or time.monotonic() > self._stop_deadline
+        self._flush_offline_buffer()
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            self._publish_due()
+            return False
+
+        delay = self._backoff.next_delay()
+        self.logger.info("Broker connection lost (%s) - reconnecting in %.1f sec",
+                         mqtt.error_string(rc), delay)
+        # wait in steps so messages buffered meanwhile are still synced in time
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._stop_event.wait(min(remaining, LOOP_TIMEOUT)):
+                return True
+            self._flush_offline_buffer()
+        try:
+            self.client.reconnect()
+        except OSError as e:
+            self.logger.error("Unable to reconnect to broker %s: %s", self.broker, e)
+        return False
+
+    def _flush_offline_buffer(self):
+        """
+        Sync messages buffered since the last sync once the buffer's flush interval passed
+        """
+        if self._offline_buffer is not None:
+            self._offline_buffer.flush(due=True)
+
+    def _publish_due(self):
+        """
+        Send values held back by a min_interval policy and heartbeats of quiet topics
+        """
+        for topic, msg in self._cache.due():
+            self._enqueue(topic, msg)
+
+    def _on_disconnect_callback(self, client, userdata, rc):
+        """
+        This callback gets called when the connection to the broker is closed
+        """
+        self._connected = False
+        self._ready.clear()
+        if rc == 0:
+            self.logger.info("Disconnected from broker")
+        else:
+            self.logger.info("Unexpected disconnect from broker: %s (%d)", mqtt.error_string(rc), rc)
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+            self._outage_missed = 0
+
     def _on_connect_callback(self, client, userdata, flags, rc):
         """
         This callback gets called during a client connection
         """
         if rc > 5:
-            self.logger.info("Unsuccessful client connection - Error code unknown (%d)"%rc)
+            self.logger.info("Unsuccessful client connection - Error code unknown (%d)", rc)
             self.client.bad_connection_flag=True
         else:
-            self.logger.info("MQTT Client Connection Response: %s (%d)"%(CONNECT_RESPONSE[rc],rc))
+            self.logger.info("MQTT Client Connection Response: %s (%d)", CONNECT_RESPONSE[rc], rc)
             self.client.connected_flag=True #Flag to indicate success  
-            self._connected = True
+            # replay under the publish lock so new messages cannot overtake buffered ones
+            self._get_mutex()
+            try:
+                if rc == 0:
+                    self._replay_offline_buffer()
+                    self._connected = True
+            finally:
+                self._release_lock()
+            if rc == 0:
+                self._backoff.reset()
+                self._record_outage()
+                if self._will_topic is not None:
+                    self.client.publish(self._will_topic, self._online_payload, qos=1, retain=True)
+                # the broker does not keep subscriptions for a clean session
+                with self._sub_lock:
+                    self._broker_filters = set()
+                    self._update_subscriptions()
+                    self._ready.set()
+                    futures, self._ready_futures = self._ready_futures, []
+                for future in futures:
+                    future.set_result(True)
            
+    def _record_outage(self):
+        """
+        Record the length of the outage that just ended and how many messages were missed
+        """
+        if self._disconnected_at is None:
+            return
+        duration = time.monotonic() - self._disconnected_at
+        self.reconnect_time.add(duration)
+        self._m_reconnects.inc()
+        self.outages.append({'end': time.time(), 'duration': duration, 'missed': self._outage_missed})
+        self.logger.info("Connected after %.1f sec, %d messages missed", duration, self._outage_missed)
+        self._disconnected_at = None
+        self._outage_missed = 0
+
     def _on_message_callback(self, client,userdata,message):
         """
-        This callback gets called when messages are received
+        This callback gets called when messages are received.  The message is routed to the
+        callbacks whose topic filter matches, messages with no matching callback go to the
+        message_callback passed to the constructor.
         """
-        msg = message.payload.decode("utf-8")
-        self.logger.info('Received Message: %s'%msg)
-        self._message_callback(msg)
+        message.timestamp = time.monotonic()    # receive time for command latency tracing
+        self._m_received.inc()
+        handlers = self._router.match(message.topic)
+        for handler in handlers:
+            try:
+                handler(client, userdata, message)
+            except Exception as e:
+                self.logger.error("Message callback for %s raised: %s", message.topic, e)
+        if not handlers and self._message_callback is not None:
+            msg = message.payload.decode("utf-8")
+            self.logger.info('Received Message: %s', msg)
+            self._message_callback(msg)
         
 #        
\ No newline at end of file
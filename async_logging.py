@@ -0,0 +1,160 @@
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+
+QUEUE_SIZE = 10000      # records waiting for the writer thread, further records are dropped
+BATCH_SIZE = 256        # max records written between two flushes
+FLUSH_INTERVAL = 1.0    # max seconds a written record waits in the file buffer
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record as is.  The stock handler formats every record on
+    the calling thread, this leaves formatting to the writer thread.  The record arguments are
+    formatted later, so callers must not mutate objects passed as logging arguments.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1       # never block a GPIO or MQTT thread on log I/O
+
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that does not flush after every record.  The writer thread calls
+    flush_batch() once per batch, so the file sees a few large writes.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class AsyncLogWriter:
+    """
+    Background thread that takes records off the queue, hands them to the real handlers in
+    batches and flushes the handlers once per batch or at least every flush interval.
+    """
+
+    def __init__(self, log_queue, handlers, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        """
+        Args:
+            log_queue (queue.Queue): queue filled by a DeferredQueueHandler
+            handlers (list): handlers writing the records
+            batch_size (int): max records written between two flushes
+            flush_interval (float): max seconds a written record waits in the file buffer
+        """
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread = threading.Thread(target=self._run, name="Log_Writer")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Write the queued records and stop the thread
+
+        Args:
+            timeout (float): max seconds to wait for the thread, also bounds the wait for room
+                in a full queue
+        """
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass        # the writer died or is stuck, the join below gives up after the timeout
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and time.monotonic() < deadline:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write(record for record in batch if record is not None)
+            if stop:
+                return
+
+    def _write(self, records):
+        for record in records:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        for handler in self.handlers:
+            if isinstance(handler, BufferedRotatingFileHandler):
+                handler.flush_batch()
+            else:
+                handler.flush()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per logger for high volume sources.  Records at or below the level from a
+    limited logger are dropped once its bucket is empty, higher levels always pass.
+    """
+
+    def __init__(self, limits, level=logging.DEBUG):
+        """
+        Args:
+            limits (dict): logger name -> (records per second, burst).  A name also limits its
+                child loggers.
+            level (int): highest level that is rate limited
+        """
+        super().__init__()
+        self.limits = limits
+        self.level = level
+        self.dropped = {}
+        self._buckets = {}          # logger name -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        limit = self._limit(record.name)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [burst, now]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.dropped[record.name] = self.dropped.get(record.name, 0) + 1
+                return False
+            bucket[0] -= 1
+        return True
+
+    def _limit(self, name):
+        while name:
+            limit = self.limits.get(name)
+            if limit is not None:
+                return limit
+            name = name.rpartition('.')[0]
+        return None
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import RPi.GPIO as GPIO
+from async_mqtt import AsyncMQTTComms
+from publish_policy import PublishPolicy
+from dht22_sensor import dht_sensor
+from garage_controller import GarageDoor
+from utils import init_logger, import_credentials
+from led import RGBLed
+from config import (LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL, MQTT_CREDENTIALS, BROKER_HOST,
+                    CONNECT_TIMEOUT, PUBLISH_HEARTBEAT, DHT_POLL_INTERVAL, HEARTBEAT_INTERVAL,
+                    CMD_1, STATE_1, TEMP, HUMIDITY, DOOR1_CTRL, DOOR1_STATE, DHT22_DATA, LED_RED,
+                    LED_GREEN, LED_BLUE)
+
+_LOGGER = logging.getLogger("Main")
+
+
+async def poll(target, interval):
+    """
+    Run a blocking function periodically without blocking the event loop
+
+    Args:
+        target (obj): function to run
+        interval (float): seconds between runs
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await loop.run_in_executor(None, target)
+        await asyncio.sleep(interval)
+
+
+async def heartbeat(interval):
+    """
+    Log a heart beat periodically
+
+    Args:
+        interval (float): seconds between heart beats
+    """
+    while True:
+        _LOGGER.debug("Main Loop Heart Beat")
+        await asyncio.sleep(interval)
+
+
+async def main():
+    """
+    asyncio entry point.  MQTT I/O, sensor polling and the heart beat run on one event loop.
+
+    The door is not driven from the loop: its EdgePipeline and RelayScheduler keep their timer
+    threads for debouncing the state pin and pulsing the relay, and RPi.GPIO reports edges on
+    its own thread.  Its command callback runs in the loop's executor.
+    """
+    username, password = import_credentials(MQTT_CREDENTIALS)   # get broker credentials
+    mqttClient = AsyncMQTTComms(BROKER_HOST, 'GaragePi', [], username, password,
+                                publish_policy=PublishPolicy(dedupe=True, heartbeat=PUBLISH_HEARTBEAT))
+    if not await mqttClient.connect(CONNECT_TIMEOUT):
+        _LOGGER.error("Broker did not accept the connection within %d sec", CONNECT_TIMEOUT)
+
+    GPIO.setmode(GPIO.BCM)
+
+    dht = dht_sensor(DHT22_DATA, mqttClient, TEMP, HUMIDITY, heartbeat=PUBLISH_HEARTBEAT)
+
+    led = RGBLed(LED_RED, LED_GREEN, LED_BLUE)
+    led.set_color(RGBLed.BLUE)
+
+    # kept alive by the command callback it registers on the client
+    GarageDoor(1, DOOR1_CTRL, DOOR1_STATE, mqttClient, CMD_1, STATE_1, led)
+
+    try:
+        await asyncio.gather(poll(dht.read_sensor, DHT_POLL_INTERVAL),
+                             heartbeat(HEARTBEAT_INTERVAL))
+    finally:
+        _LOGGER.debug("Disconnecting MQTT Client")
+        await mqttClient.close()
+
+
+if __name__ == "__main__":
+    init_logger(LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL)  # initialize logger
+    _LOGGER.info("Initializing GaragePi (asyncio)")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _LOGGER.debug("Cleaning up GPIO")
+        GPIO.cleanup()
+        _LOGGER.debug("Ending Main")
@@ -0,0 +1,419 @@
+import asyncio
+import logging
+import threading
+import paho.mqtt.client as mqtt
+from backoff import Backoff
+from MQTTComms import CONNECT_RESPONSE
+from topic_trie import TopicTrie, covering_filters
+from publish_policy import LastValueCache
+
+MISC_LOOP_INTERVAL = 1.0    # seconds between paho housekeeping calls (keepalive pings)
+
+
+class MessageStream:
+    """
+    Async iterator over the messages received on a topic filter
+
+        async for message in client.messages('hass/+/set'):
+            ...
+    """
+
+    def __init__(self, comms, topic, maxsize=0):
+        self._comms = comms
+        self.topic = topic
+        self._queue = asyncio.Queue(maxsize)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    def close(self):
+        """
+        Stop delivering messages to this stream and end the iteration
+        """
+        self._comms._router.remove(self.topic, self._put)
+        self._queue.put_nowait(None)
+
+    def _put(self, client, userdata, message):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._comms.logger.error("Message stream for %s full - dropping message", self.topic)
+
+
+class AsyncMQTTComms:
+    """
+    asyncio counterpart of MQTTComms.  The paho client is driven from the event loop through
+    its socket callbacks, so no network thread is started.
+
+    connect() is a coroutine.  publish() and subscribe() return futures that may be awaited or
+    ignored, which lets device classes written for MQTTComms use this client unchanged.  Both
+    may be called from other threads (e.g. RPi.GPIO callbacks).
+
+    A lost connection is re-established from the housekeeping task with a jittered exponential
+    backoff.  Publish and subscribe futures still waiting for the broker resolve to False when
+    the connection drops.
+    """
+
+    def __init__(self, broker, name="MQTT Client", topics=None, username=None, password=None, port=1883,
+                 publish_policy=None, reconnect_delay=1.0, reconnect_max_delay=60.0):
+        """
+        Args:
+            broker (str): broker host name or address
+            name (str): MQTT client id
+            topics (list): list of topics to subscribe to in string format
+            username (str): username
+            password (str): password
+            port (int): broker port
+            publish_policy (PublishPolicy): default policy for topics without their own policy
+            reconnect_delay (float): first reconnect delay in seconds
+            reconnect_max_delay (float): largest reconnect delay in seconds
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if broker is None or type(broker) != type(str()):
+            ErrorString = "broker is None type, a valid broker in string format must be provided"
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+
+        self.broker = broker
+        self.port = port
+        self.name = name
+        self._loop = None
+        self._loop_thread = None
+        self._connected = False
+        self._ready = asyncio.Event()       # set once the broker accepted the connection
+        self._misc_task = None
+        self._backoff = Backoff(reconnect_delay, reconnect_max_delay)
+        self._reconnect_at = None   # loop time of the next reconnect attempt
+        self._router = TopicTrie()
+        self._subscriptions = set(topics or [])    # filters requested through subscribe()
+        self._broker_filters = set()                # filters currently subscribed on the broker
+        self._pending = {}          # mid -> future waiting for PUBACK/SUBACK
+        self._chains = {}           # topic -> last executor job, keeps per topic ordering
+        self._cache = LastValueCache(publish_policy)
+
+        self.client = mqtt.Client(name)
+        self.client.username_pw_set(username, password)
+        self.client.enable_logger(logging.getLogger(self.logger.name + '.paho'))
+        self.client.on_connect = self._on_connect_callback
+        self.client.on_disconnect = self._on_disconnect_callback
+        self.client.on_message = self._on_message_callback
+        self.client.on_publish = self._on_ack_callback
+        self.client.on_subscribe = self._on_subscribe_callback
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    async def connect(self, timeout=None):
+        """
+        Connect to the broker and wait for it to accept the connection
+
+        Args:
+            timeout (float): max seconds to wait for the broker, None waits forever
+
+        Returns:
+            ready (bool): True if the broker accepted the connection within the timeout
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.logger.info("Connecting to broker: %s", self.broker)
+        # the TCP connect blocks, keep it off the event loop
+        try:
+            await self._loop.run_in_executor(None, self.client.connect, self.broker, self.port)
+        except OSError as e:
+            self.logger.error("Unable to connect to broker %s: %s", self.broker, e)
+            self._schedule_reconnect()
+        self._misc_task = self._loop.create_task(self._misc_loop())
+        return await self.wait_until_ready(timeout)
+
+    async def wait_until_ready(self, timeout=None):
+        """
+        Wait until the broker has accepted the connection
+
+        Args:
+            timeout (float): max seconds to wait, None waits forever
+
+        Returns:
+            ready (bool): True if the client is connected, False if the timeout expired
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def close(self):
+        """
+        Disconnect from the broker
+        """
+        self.client.disconnect()
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+        self._reconnect_at = None
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+
+    def publish(self, topic, msg, qos=0, retain=False, force=False):
+        """
+        Publish a message on a given topic
+
+        Args:
+            topic (str): topic to publish to
+            msg (int,str): msg to publish
+            qos (int): quality of service
+            retain (bool): broker retains the message
+            force (bool): send the message even if the topic's publish policy would suppress it
+
+        Returns:
+            future: resolves once the message was written (qos 0) or acknowledged (qos 1/2),
+                resolves to False if the message was not sent
+        """
+        return self._call(self._publish, topic, msg, qos, retain, force)
+
+    def set_publish_policy(self, topic, policy):
+        """
+        Set the policy deciding when messages published on a topic are sent
+
+        Args:
+            topic (str): topic the policy applies to
+            policy (PublishPolicy): policy, None sends every message
+        """
+        self._cache.set_policy(topic, policy)
+
+    def last_value(self, topic):
+        """
+        Get the last value sent on a topic
+
+        Args:
+            topic (str): topic
+
+        Returns:
+            value: last value sent, None if nothing was sent yet
+        """
+        return self._cache.get(topic)
+
+    def subscribe(self, topic):
+        """
+        Subscribe to an MQTT topic.  Topics already covered by a wildcard subscription are not
+        sent to the broker.
+
+        Args:
+            topic (str): MQTT topic string
+
+        Returns:
+            future: resolves once the broker acknowledges the subscription
+        """
+        return self._call(self._subscribe, topic)
+
+    def add_message_callback(self, topic, callback):
+        """
+        Register a callback for a topic filter.  Coroutine functions run as tasks on the event
+        loop, plain functions run in the default executor, one at a time per topic.
+
+        Args:
+            topic (str): topic to bind callback to
+            callback (obj): handle to callback function
+        """
+        if asyncio.iscoroutinefunction(callback):
+            def handler(client, userdata, message):
+                self._loop.create_task(callback(client, userdata, message))
+        else:
+            def handler(client, userdata, message):
+                self._run_in_executor(message.topic, callback, client, userdata, message)
+        self._router.add(topic, handler)
+
+    def messages(self, topic, maxsize=0):
+        """
+        Get an async iterator over the messages received on a topic filter.  The filter is
+        subscribed if needed.
+
+        Args:
+            topic (str): MQTT topic filter
+            maxsize (int): max messages buffered for the consumer, 0 for unbounded
+
+        Returns:
+            stream (MessageStream)
+        """
+        stream = MessageStream(self, topic, maxsize)
+        self._router.add(topic, stream._put)
+        self.subscribe(topic)
+        return stream
+
+    def _call(self, func, *args):
+        """
+        Run func on the event loop.  Returns an asyncio future on the loop thread, a
+        concurrent.futures.Future from any other thread.
+        """
+        if self._loop is None:
+            ErrorString = "connect() must be awaited before using the client"
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+        if self._on_loop_thread():
+            return func(*args)
+
+        async def call():
+            return await func(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self._loop)
+
+    def _on_loop_thread(self):
+        return self._loop_thread == threading.get_ident()
+
+    def _publish(self, topic, msg, qos, retain, force=False):
+        future = self._loop.create_future()
+        if not self._cache.should_publish(topic, msg, force=force):
+            future.set_result(False)
+            return future
+        return self._send(topic, msg, qos, retain, future)
+
+    def _send(self, topic, msg, qos=0, retain=False, future=None):
+        if future is None:
+            future = self._loop.create_future()
+        if not self._connected:
+            self.logger.debug("Broker not connected - published message not sent {%s: %s}", topic, msg)
+            future.set_result(False)
+            return future
+        self.logger.debug("Publish {%s: %s}", topic, msg)
+        info = self.client.publish(topic, msg, qos, retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            future.set_result(False)
+        else:
+            self._pending[info.mid] = future
+        return future
+
+    def _subscribe(self, topic):
+        self._subscriptions.add(topic)
+        return self._update_subscriptions()
+
+    def _update_subscriptions(self):
+        future = self._loop.create_future()
+        wanted = covering_filters(self._subscriptions)
+        new = [topic for topic in wanted if topic not in self._broker_filters]
+        if not self._connected or not new:
+            future.set_result(True)
+            return future
+        self.logger.debug("Subscribing to topics: %s", new)
+        rc, mid = self.client.subscribe([(topic, 0) for topic in new])
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            future.set_result(False)
+        else:
+            self._broker_filters.update(new)
+            self._pending[mid] = future
+        return future
+
+    def _run_in_executor(self, topic, callback, *args):
+        previous = self._chains.get(topic)
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await self._loop.run_in_executor(None, callback, *args)
+            except Exception as e:
+                self.logger.error("Message callback for %s raised: %s", topic, e)
+            finally:
+                if self._chains.get(topic) is task:
+                    del self._chains[topic]
+
+        task = self._loop.create_task(run())
+        self._chains[topic] = task
+
+    async def _misc_loop(self):
+        while True:
+            await asyncio.sleep(MISC_LOOP_INTERVAL)
+            try:
+                if self._reconnect_at is not None and self._loop.time() >= self._reconnect_at:
+                    await self._reconnect()
+                self.client.loop_misc()
+                for topic, msg in self._cache.due():
+                    self._send(topic, msg)
+            except Exception as e:
+                self.logger.error("MQTT housekeeping failed: %s", e)
+
+    async def _reconnect(self):
+        self._reconnect_at = None
+        self.logger.info("Reconnecting to broker: %s", self.broker)
+        try:
+            await self._loop.run_in_executor(None, self.client.reconnect)
+        except OSError as e:
+            self.logger.error("Unable to reconnect to broker %s: %s", self.broker, e)
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        delay = self._backoff.next_delay()
+        self.logger.info("Reconnecting in %.1f sec", delay)
+        self._reconnect_at = self._loop.time() + delay
+
+    def _connection_lost(self, rc):
+        # nothing in flight will be acknowledged on a new connection
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_result(False)
+        if rc != 0 and self._misc_task is not None:
+            self._schedule_reconnect()      # rc 0 is a disconnect asked for by close()
+
+    # paho socket callbacks.  Paho calls these from the executor during connect(), so off the
+    # loop thread the event loop is updated through call_soon_threadsafe.
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop_call(self._loop.add_reader, sock, self.client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop_call(self._loop.remove_reader, sock)
+        self._loop_call(self._loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop_call(self._loop.add_writer, sock, self.client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop_call(self._loop.remove_writer, sock)
+
+    def _loop_call(self, func, *args):
+        if self._on_loop_thread():
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_connect_callback(self, client, userdata, flags, rc):
+        if rc != 0:
+            self.logger.info("MQTT Client Connection Response: %s (%d)",
+                             CONNECT_RESPONSE.get(rc, 'Error code unknown'), rc)
+            return
+        self.logger.info("MQTT Client Connection Response: %s (%d)", CONNECT_RESPONSE[rc], rc)
+        self._backoff.reset()
+        self._connected = True
+        self._broker_filters = set()
+        self._update_subscriptions()
+        self._ready.set()
+
+    def _on_disconnect_callback(self, client, userdata, rc):
+        self.logger.info("Disconnected from broker (%d)", rc)
+        self._connected = False
+        self._loop_call(self._ready.clear)
+        self._loop_call(self._connection_lost, rc)
+
+    def _on_ack_callback(self, client, userdata, mid):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    def _on_subscribe_callback(self, client, userdata, mid, granted_qos):
+        self._on_ack_callback(client, userdata, mid)
+
+    def _on_message_callback(self, client, userdata, message):
+        handlers = self._router.match(message.topic)
+        if not handlers:
+            self.logger.debug("No callback for message on %s", message.topic)
+        for handler in handlers:
+            try:
+                handler(client, userdata, message)
+            except Exception as e:
+                self.logger.error("Message callback for %s raised: %s", message.topic, e)
@@ -0,0 +1,40 @@
+import random
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter.  Each delay is drawn uniformly from the upper half of the
+    current exponential step so clients that lost the broker at the same time do not all
+    reconnect in lock step.
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0):
+        """
+        Args:
+            initial (float): first delay in seconds
+            maximum (float): largest delay in seconds
+            factor (float): growth factor between attempts
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        Get the delay before the next attempt
+
+        Returns:
+            delay (float): seconds to wait
+        """
+        step = min(self.maximum, self.initial * self.factor ** self.attempts)
+        if step < self.maximum:
+            # stop growing at the maximum, a long outage would overflow the power
+            self.attempts += 1
+        return random.uniform(step / 2, step)
+
+    def reset(self):
+        """
+        Start over from the initial delay, call after a successful attempt
+        """
+        self.attempts = 0
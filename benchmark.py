@@ -0,0 +1,249 @@
+"""
+MQTTComms benchmark suite.  Starts a LoopbackBroker and measures publish throughput, command
+round trip latency through add_message_callback handlers and publish lock contention.
+
+Results are written as JSON so runs from different versions can be compared:
+
+    python benchmark.py --output bench_output.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from MQTTComms import MQTTComms
+from loopback_broker import LoopbackBroker
+from stats import summarize
+
+READY_TIMEOUT = 5       # seconds to wait for a client to connect
+DRAIN_TIMEOUT = 30      # seconds to wait for published messages to arrive
+
+
+class _Counter:
+    """
+    Counts received messages and signals when an expected number arrived
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, client, userdata, message):
+        with self._lock:
+            self.count += 1
+            if self.count >= self.expected:
+                self.done.set()
+
+
+def _client(broker, name, **kwargs):
+    client = MQTTComms(broker.host, name, [], port=broker.port, **kwargs)
+    client.connect()
+    if not client.wait_until_ready(READY_TIMEOUT):
+        raise Exception("Benchmark client %s did not connect" % name)
+    return client
+
+
+def bench_throughput(broker, messages, **kwargs):
+    """
+    Publish messages from one thread and time how long the calls take and how long it takes
+    until a subscriber received all of them
+
+    Args:
+        broker (LoopbackBroker): broker to use
+        messages (int): number of messages to publish
+
+    Keyword Args:
+        passed to the publishing MQTTComms
+
+    Returns:
+        results (dict)
+    """
+    counter = _Counter(messages)
+    subscriber = _client(broker, 'bench_sub')
+    subscriber.subscribe('bench/throughput')
+    subscriber.add_message_callback('bench/throughput', counter)
+    publisher = _client(broker, 'bench_pub', **kwargs)
+    time.sleep(0.1)     # let the SUBACK settle
+
+    start = time.perf_counter()
+    for i in range(messages):
+        publisher.publish('bench/throughput', i)
+    call_time = time.perf_counter() - start
+    received = counter.done.wait(DRAIN_TIMEOUT)
+    total_time = time.perf_counter() - start
+
+    results = {'messages': messages,
+               'received': counter.count,
+               'complete': received,
+               'publish_calls_per_sec': messages / call_time,
+               'end_to_end_per_sec': counter.count / total_time,
+               'queue': publisher.publish_stats(),
+               }
+    publisher.close()
+    subscriber.close()
+    return results
+
+
+def bench_round_trip(broker, commands, **kwargs):
+    """
+    Time commands sent to a handler registered with add_message_callback that replies on a
+    state topic, the same path a GarageDoor command takes
+
+    Args:
+        broker (LoopbackBroker): broker to use
+        commands (int): number of commands to send
+
+    Keyword Args:
+        passed to the device MQTTComms
+
+    Returns:
+        results (dict)
+    """
+    device = _client(broker, 'bench_device', **kwargs)
+    controller = _client(broker, 'bench_controller')
+    reply = threading.Event()
+    latencies = []
+
+    def handle_command(client, userdata, message):
+        device.publish('bench/state', message.payload.decode('utf-8'))
+
+    def handle_state(client, userdata, message):
+        reply.set()
+
+    device.subscribe('bench/cmd')
+    device.add_message_callback('bench/cmd', handle_command)
+    controller.subscribe('bench/state')
+    controller.add_message_callback('bench/state', handle_state)
+    time.sleep(0.1)
+
+    lost = 0
+    for i in range(commands):
+        reply.clear()
+        start = time.perf_counter()
+        controller.publish('bench/cmd', i)
+        if reply.wait(1.0):
+            latencies.append(time.perf_counter() - start)
+        else:
+            lost += 1
+
+    results = {'commands': commands,
+               'lost': lost,
+               'latency': summarize(latencies),
+               'dispatch': device.dispatch_stats(),
+               }
+    controller.close()
+    device.close()
+    return results
+
+
+def bench_contention(broker, threads, messages, **kwargs):
+    """
+    Publish from several threads at once and time every publish call
+
+    Args:
+        broker (LoopbackBroker): broker to use
+        threads (int): number of publisher threads
+        messages (int): messages published by each thread
+
+    Keyword Args:
+        passed to the publishing MQTTComms
+
+    Returns:
+        results (dict)
+    """
+    counter = _Counter(threads * messages)
+    subscriber = _client(broker, 'bench_sub')
+    subscriber.subscribe('bench/contention/#')
+    subscriber.add_message_callback('bench/contention/#', counter)
+    publisher = _client(broker, 'bench_pub', **kwargs)
+    time.sleep(0.1)
+
+    call_times = [[] for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def run(index):
+        topic = 'bench/contention/%d' % index
+        times = call_times[index]
+        barrier.wait()
+        for i in range(messages):
+            start = time.perf_counter()
+            publisher.publish(topic, i)
+            times.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    call_time = time.perf_counter() - start
+    counter.done.wait(DRAIN_TIMEOUT)
+    total_time = time.perf_counter() - start
+
+    results = {'threads': threads,
+               'messages': threads * messages,
+               'received': counter.count,
+               'publish_call': summarize([t for times in call_times for t in times]),
+               'publish_calls_per_sec': threads * messages / call_time,
+               'end_to_end_per_sec': counter.count / total_time,
+               }
+    publisher.close()
+    subscriber.close()
+    return results
+
+
+def run(messages=5000, commands=200, threads=4):
+    """
+    Run the full benchmark suite
+
+    Args:
+        messages (int): messages per throughput / contention run
+        commands (int): commands per round trip run
+        threads (int): publisher threads for the contention runs
+
+    Returns:
+        results (dict)
+    """
+    broker = LoopbackBroker().start()
+    try:
+        results = {'timestamp': time.time(),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'throughput': {
+                       'direct': bench_throughput(broker, messages),
+                       'queued': bench_throughput(broker, messages, publish_queue_size=1000),
+                   },
+                   'round_trip': {
+                       'network_thread': bench_round_trip(broker, commands),
+                       'dispatched': bench_round_trip(broker, commands, dispatch_workers=2),
+                   },
+                   'contention': {
+                       'direct': bench_contention(broker, threads, messages // threads),
+                       'queued': bench_contention(broker, threads, messages // threads,
+                                                  publish_queue_size=1000),
+                   },
+                   }
+    finally:
+        broker.stop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MQTTComms benchmark suite")
+    parser.add_argument('--messages', type=int, default=5000, help="messages per throughput run")
+    parser.add_argument('--commands', type=int, default=200, help="commands per round trip run")
+    parser.add_argument('--threads', type=int, default=4, help="publisher threads for contention runs")
+    parser.add_argument('--output', help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = run(args.messages, args.commands, args.threads)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -0,0 +1,84 @@
+import logging
+
+# LOGGER
+LOG_FILE_PATH = "garagePi.log"
+CONSOLE_LEVEL = logging.DEBUG
+LOG_LEVEL = logging.DEBUG
+LOG_ASYNC = True                                # write log records from a background thread
+LOG_MAX_BYTES = 1024 * 1024                     # log file size that triggers a rotation
+LOG_BACKUP_COUNT = 5                            # rotated log files kept
+LOG_RATE_LIMITS = {'MQTTComms': (20, 100),      # logger -> (DEBUG records per sec, burst)
+                   'MQTTComms.paho': (5, 20)}
+
+# MQTT
+MQTT_CREDENTIALS = 'credentials.txt'
+
+BROKER_HOST = '192.168.1.120'
+CONNECT_TIMEOUT = 10                            # max seconds to wait for the broker at startup
+PUBLISH_QUEUE_SIZE = 100                        # outbound messages buffered for the sender thread
+OFFLINE_BUFFER_PATH = 'garagePi.buf'            # messages published while the broker is down
+PUBLISH_HEARTBEAT = 300                         # max seconds a state topic stays silent
+DISPATCH_WORKERS = 2                            # threads running MQTT message callbacks
+
+# HISTORY
+HISTORY_PATH = 'history'                        # directory of the local time-series store
+HISTORY_RETENTION = 30 * 86400                  # seconds of readings kept
+HISTORY_FLUSH_INTERVAL = 60                     # max seconds readings wait in memory
+
+# JOURNAL
+JOURNAL_PATH = 'journal'                        # directory of the door command and state journal
+JOURNAL_RETENTION = 365 * 86400                 # seconds of door events kept
+
+# PERIODIC TASKS
+DHT_POLL_INTERVAL = 5                           # min seconds between DHT22 readings
+DHT_POLL_MAX_INTERVAL = 60                      # max seconds between DHT22 readings while steady
+DHT_MAX_AGE = 30                                # max age of a cached reading answering a get
+DHT_WORKER_TIMEOUT = 10                         # max seconds per DHT22 read in the worker process
+DHT_SUMMARY_INTERVAL = 300                      # seconds between DHT22 window summaries
+PIR_HOLD_TIME = 120                             # seconds occupied after the last motion
+PIR_MIN_PUBLISH_INTERVAL = 10                   # min seconds between occupancy publishes
+PIR_COUNT_INTERVAL = 60                         # seconds per published motion event count
+LED_FPS = 30                                    # LED animation frames per second
+HEARTBEAT_INTERVAL = 10                         # seconds between main loop heart beats
+DOOR_TRAVEL_TIME = 15                           # seconds a door takes to fully open or close
+DOOR_CONFIRM_TIMEOUT = 30                       # seconds for the state pin to confirm a command
+LATENCY_PUBLISH_INTERVAL = 300                  # seconds between command latency publishes
+LATENCY_STATS_PATH_1 = 'door1_latency.json'     # Door1 command latency histograms
+METRICS_HOST = '127.0.0.1'                      # address the Prometheus metrics endpoint binds
+METRICS_PORT = 9100                             # metrics endpoint port, None disables it
+METRICS_PUBLISH_INTERVAL = 60                   # seconds between MQTT metrics publishes, None disables
+PROFILE_PATH = 'profiles'                       # directory the profiler writes stack files to
+PROFILE_TOP = 15                                # functions listed in a profiling summary
+PROCESS_HEARTBEAT_INTERVAL = 5                  # seconds between worker process heart beats
+PROCESS_WATCHDOG_TIMEOUT = 30                   # seconds without a heart beat before a worker is restarted
+PROCESS_INBOUND_QUEUE_SIZE = 100                # received messages waiting for a worker process
+
+# MQTT Topics
+CMD_1 = 'hass/cover1/set'                       # Door1 Cmd topic
+CMD_2 = 'hass/cover2/set'                       # Door2 Cmd topic
+STATE_1 = 'hass/cover1/state'                   # Door1 State topic
+STATE_2 = 'hass/cover2/state'                   # Door2 state topic
+AVAILABILITY_1 = 'hass/cover1/availability'     # Door1 availability topic
+AVAILABILITY_2 = 'hass/cover2/availability'     # Door2 availability topic
+LATENCY_1 = 'garagepi/cover1/latency'           # Door1 command latency histograms
+EVENTS_1 = 'garagepi/cover1/event'              # Door1 failure events
+TEMP = 'hass/heat/val'                          # Temperature sensor topic
+HUMIDITY = 'hass/humidty/val'                   # Humidity sensor topic
+PIR = 'hass/pir/state'                          # PIR sensor topic
+PIR_COUNT = 'garagepi/pir/motion_count'         # PIR motion events per count interval
+DHT_SUMMARY = 'garagepi/dht22/summary'          # Temperature / humidity window statistics
+DHT_GET = 'garagepi/dht22/get'                  # Request a fresh temperature / humidity reading
+METRICS = 'garagepi/metrics'                    # Runtime metrics snapshot
+PROFILE_SET = 'garagepi/profile/set'            # Start ('<seconds>' or JSON) or 'stop' a profiling run
+PROFILE_RESULT = 'garagepi/profile/result'      # Profiling run summary
+
+# GPIO CONSTANTS
+DOOR1_CTRL      = 24            # output pin controlling door 1
+DOOR2_CTRL      = 8             # output pin controlling door 2
+DOOR1_STATE     = 23            # input pin for determining state of door 1
+DOOR2_STATE     = 25            # input pin for determining state of door 2
+PIR_STATE       = 26            # input pin for determining state of PIR sensor
+DHT22_DATA      = 27            # data pin for DHT22 Temp/Humidity sensor
+LED_RED         = 0             # output pin for Red RGB LED pin
+LED_GREEN       = 5             # output pin for Green RGB LED pin
+LED_BLUE        = 6             # output pin for Blue RGB LED pin
@@ -1,19 +1,45 @@
+import json
 import time
 import logging
 import Adafruit_DHT
 import RPi.GPIO as GPIO
+from publish_policy import PublishPolicy
+from dht_worker import DHTWorker
+from signal_filter import SignalFilter
+from scheduler import AdaptivePeriod
+from MQTTComms import message_callback
+from telemetry import REGISTRY
+
+TEMP_RANGE = (-40.0, 176.0)     # DHT22 measuring range in F
+HUMIDITY_RANGE = (0.0, 100.0)
+TEMP_RATE = 0.5                 # F per minute that needs the fastest polling
+HUMIDITY_RATE = 2.0             # % per minute that needs the fastest polling
+MAX_AGE = 30                    # seconds a cached reading answers a get request
 
 class dht_sensor:
     """
     Class to model dht22 temperature and humidity sensor
     """
-    def __init__(self, data_pin, client, temp_topic, hum_topic):
+    def __init__(self, data_pin, client, temp_topic, hum_topic, deadband=0.1, heartbeat=None,
+                 worker_timeout=None, summary_topic=None, get_topic=None, max_age=MAX_AGE,
+                 metrics=REGISTRY):
         """
         Args:
             data_pin (int): RPI pin number connected to dht22 data pin
             client (MQTTComms): Handle to MQTTComms client object
             temp_topic (str): Temperature state MQTT topic
             hum_topic (str): Humidity state MQTT topic
+            deadband (float): minimum change in a reading before it is published
+            heartbeat (float): max seconds a steady reading goes unpublished, the topic
+                policies replace the client's default policy and its heartbeat
+            worker_timeout (float): if given the sensor is read in a worker process and a read
+                taking longer than this many seconds restarts the worker.  None reads the sensor
+                in the calling thread.
+            summary_topic (str): topic publish_summary() publishes the window statistics on
+            get_topic (str): topic that requests the current reading.  The cached reading is
+                republished if it is at most max_age seconds old, otherwise the sensor is read.
+            max_age (float): max age in seconds of a cached reading answering a get request
+            metrics (telemetry.Registry): registry the sensor records its metrics into
 
         """
         self.pin = data_pin
@@ -21,42 +47,145 @@ class dht_sensor:
 
         self._temp_topic = temp_topic
         self._hum_topic = hum_topic
+        self._summary_topic = summary_topic
         self._temp = None
         self._humidity = None
-
-        self._last_temp = None
-        self._last_humidity = None
+        # readings are median / EMA filtered with outlier rejection before they are published
+        self._temp_filter = SignalFilter(valid_range=TEMP_RANGE)
+        self._hum_filter = SignalFilter(valid_range=HUMIDITY_RANGE)
+        self._last_summary = time.monotonic()
+        self._max_age = max_age
+        self._read_time = None      # time of the last successful reading
+        self._get_pending = False   # a get request waits for the next reading
+        self._task = None
+        self._period = None
+        self._last_reading = None   # (time, temperature, humidity) for the rate of change
+        self._m_read = metrics.histogram('dht_read_seconds', 'Sensor read duration', pin=data_pin)
+        self._m_failures = metrics.counter('dht_read_failures_total', 'Reads without a value',
+                                           pin=data_pin)
+        self._m_outliers = {quantity: metrics.counter('dht_outliers_total', 'Rejected readings',
+                                                      pin=data_pin, quantity=quantity)
+                            for quantity in ('temperature', 'humidity')}
+        metrics.gauge('dht_poll_period_seconds', 'Current polling period',
+                      lambda: self._task.period if self._task is not None else 0, pin=data_pin)
 
         GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)  # set data pin to be an input
         self._sensor = Adafruit_DHT.DHT22
         self.logger = logging.getLogger(self.__class__.__name__)
+        self._worker = None
+        if worker_timeout is not None:
+            self._worker = DHTWorker(self._sensor, self.pin, timeout=worker_timeout)
 
         self._client.subscribe(self._temp_topic)
         self._client.subscribe(self._hum_topic)
+        # only publish readings that moved by more than the deadband, or the heartbeat is due
+        policy = PublishPolicy(deadband=deadband, heartbeat=heartbeat)
+        self._client.set_publish_policy(self._temp_topic, policy)
+        self._client.set_publish_policy(self._hum_topic, policy)
+        if summary_topic is not None:
+            # every summary covers a new window, never drop or repeat one
+            self._client.set_publish_policy(summary_topic, None)
+        if get_topic is not None:
+            self._client.subscribe(get_topic)
+            self._client.add_message_callback(get_topic, self.process_get)
+
+    def schedule(self, scheduler, minimum, maximum):
+        """
+        Poll the sensor from a scheduler.  The period adapts to how fast the readings change:
+        it drops to the minimum when they move fast and grows towards the maximum while they
+        are steady.
+
+        Args:
+            scheduler (PeriodicScheduler): scheduler running the readings
+            minimum (float): shortest seconds between readings
+            maximum (float): longest seconds between readings
+
+        Returns:
+            task (PeriodicTask)
+        """
+        self._period = AdaptivePeriod(minimum, maximum)
+        # a read can take up to the worker timeout, keep it off the scheduler thread
+        self._task = scheduler.every(self._period.period, self.read_sensor, name="DHT_Sensor",
+                                     blocking=True)
+        return self._task
+
+    @message_callback
+    def process_get(self, client, userdata, message):
+        """
+        Answer a request for the current reading
+        """
+        if self._read_time is not None and time.monotonic() - self._read_time <= self._max_age:
+            self.logger.debug("Get request - republishing cached reading")
+            self._client.publish(self._temp_topic, self._temp, force=True)
+            self._client.publish(self._hum_topic, self._humidity, force=True)
+            return
+        self.logger.debug("Get request - cached reading is stale, reading sensor")
+        self._get_pending = True
+        if self._task is not None:
+            self._task.run_now()
+        else:
+            self.read_sensor()
 
-    def update_temp(self, temp):
+    def update_temp(self, temp, force=False):
         """
-        Update the temp topic with the latest temp value.
+        Update the temp topic with the latest temp value.  The value is filtered first, rejected
+        outliers are not published.
 
         Args:
             temp (float): Latest temperature value from sensor
+            force (bool): publish even if the value did not change, the last filtered value is
+                published if this one is rejected
         """
-        self._temp = round(temp, 1)
-        if self._temp != self._last_temp:
-            self._last_temp = self._temp    # update last temp with the latest
-            self._client.publish(self._temp_topic, self._temp)
+        temp = self._temp_filter.add(temp)
+        if temp is None:
+            self.logger.debug("Rejected temperature outlier")
+            self._m_outliers['temperature'].inc()
+        else:
+            self._temp = round(temp, 1)
+        if self._temp is not None and (temp is not None or force):
+            self._client.publish(self._temp_topic, self._temp, force=force)
 
-    def update_humidity(self, humidity):
+    def update_humidity(self, humidity, force=False):
         """
-        Update the Humidity topic with the latest humidity value
+        Update the Humidity topic with the latest humidity value.  The value is filtered first,
+        rejected outliers are not published.
 
         Args:
             humidity (float): Latest humidity value from the sensor
+            force (bool): publish even if the value did not change, the last filtered value is
+                published if this one is rejected
         """
-        self._humidity = round(humidity, 1)
-        if self._humidity != self._last_humidity:
-            self._last_humidity = self._humidity
-            self._client.publish(self._hum_topic, self._humidity)
+        humidity = self._hum_filter.add(humidity)
+        if humidity is None:
+            self.logger.debug("Rejected humidity outlier")
+            self._m_outliers['humidity'].inc()
+        else:
+            self._humidity = round(humidity, 1)
+        if self._humidity is not None and (humidity is not None or force):
+            self._client.publish(self._hum_topic, self._humidity, force=force)
+
+    def summary(self, since=None):
+        """
+        Get window statistics of the raw readings
+
+        Args:
+            since (float): only include readings taken at or after this time.monotonic() time
+
+        Returns:
+            summary (dict): temperature and humidity window statistics
+        """
+        return {'temperature': self._temp_filter.stats(since),
+                'humidity': self._hum_filter.stats(since)}
+
+    def publish_summary(self):
+        """
+        Publish the statistics of the readings taken since the previous summary
+        """
+        now = time.monotonic()
+        summary = self.summary(self._last_summary)
+        self._last_summary = now
+        if self._summary_topic is not None:
+            self._client.publish(self._summary_topic, json.dumps(summary))
 
     #def start_polling(self, poll_time=60):
     def read_sensor(self):
@@ -69,16 +198,50 @@ class dht_sensor:
 
         #while True:
         try:
-            humidity, temperature = Adafruit_DHT.read_retry(self._sensor, self.pin, 1)
+            start = time.monotonic()
+            if self._worker is not None:
+                humidity, temperature = self._worker.read()
+            else:
+                humidity, temperature = Adafruit_DHT.read_retry(self._sensor, self.pin, 1)
+            self._m_read.observe(time.monotonic() - start)
             if temperature is not None and humidity is not None:
                 temperature = temperature * (9 / 5.0) + 32
-                self.logger.debug("Temp: %.1f F | Humidity: %.1f" %(temperature,humidity))
-                self.update_temp(temperature)
-                self.update_humidity(humidity)
+                self.logger.debug("Temp: %.1f F | Humidity: %.1f", temperature, humidity)
+                force, self._get_pending = self._get_pending, False
+                self.update_temp(temperature, force)
+                self.update_humidity(humidity, force)
+                self._read_time = time.monotonic()
+                self._adapt_period()
             else:
                 self.logger.debug("Unable to get sensor reading")
+                self._m_failures.inc()
                 
         except Exception as e:
-            self.logger.error("Caught exception: %s" % e)
+            self.logger.error("Caught exception: %s", e)
 
         #time.sleep(poll_time)
+
+    def _adapt_period(self):
+        """
+        Set the polling period from the rate of change of the filtered readings
+        """
+        if self._task is None or self._temp is None or self._humidity is None:
+            return
+        now = self._read_time
+        last, self._last_reading = self._last_reading, (now, self._temp, self._humidity)
+        if last is None or now <= last[0]:
+            return
+        minutes = (now - last[0]) / 60.0
+        activity = max(abs(self._temp - last[1]) / minutes / TEMP_RATE,
+                       abs(self._humidity - last[2]) / minutes / HUMIDITY_RATE)
+        period = self._period.update(activity)
+        if period != self._task.period:
+            self.logger.debug("Polling every %.1f sec", period)
+            self._task.set_period(period)
+
+    def close(self):
+        """
+        Stop the sensor worker process, if any
+        """
+        if self._worker is not None:
+            self._worker.close()
@@ -0,0 +1,147 @@
+import time
+import logging
+import multiprocessing
+from stats import RunningStats
+
+READ_TIMEOUT = 10.0     # max seconds a read may take before the worker is restarted
+READ_RETRIES = 1        # read_retry attempts per read
+
+
+def _worker_main(conn, parent_conn, sensor, pin, retries):
+    """
+    Worker process loop.  Waits for a read request, reads the sensor and sends back the
+    (humidity, temperature) pair.  Does not log, the worker is forked from a threaded process.
+    """
+    # close the inherited parent end so the worker sees EOF when the parent dies
+    parent_conn.close()
+    import Adafruit_DHT
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        try:
+            conn.send(Adafruit_DHT.read_retry(sensor, pin, retries))
+        except Exception as e:
+            conn.send(e)
+
+
+class DHTWorker:
+    """
+    Reads a DHT sensor in a separate process.
+
+    Adafruit_DHT bit-bangs the sensor and busy-waits on the CPU for the whole read, retries
+    included.  Running it in a worker process keeps it from starving the MQTT and GPIO threads
+    of the GIL.  Each read has a hard timeout, a worker that does not answer in time is killed
+    and a fresh one is started on the next read.
+    """
+
+    def __init__(self, sensor, pin, timeout=READ_TIMEOUT, retries=READ_RETRIES):
+        """
+        Args:
+            sensor (int): Adafruit_DHT sensor type
+            pin (int): GPIO pin connected to the sensor data pin
+            timeout (float): max seconds a read may take
+            retries (int): read_retry attempts per read
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.sensor = sensor
+        self.pin = pin
+        self.timeout = timeout
+        self.retries = retries
+        self.reads = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.read_time = RunningStats()     # seconds each successful read took
+        # fork so the worker does not re-import the main script
+        self._ctx = multiprocessing.get_context('fork')
+        self._process = None
+        self._conn = None
+        self._started = False
+
+    def read(self):
+        """
+        Read the sensor
+
+        Returns:
+            humidity (float): None if the read failed or timed out
+            temperature (float): None if the read failed or timed out
+        """
+        if self._process is not None and not self._process.is_alive():
+            self.logger.error("DHT worker exited with code %s", self._process.exitcode)
+            self._kill()
+        if self._process is None:
+            self._start()
+        start = time.monotonic()
+        self.reads += 1
+        try:
+            self._conn.send(True)
+            ready = self._conn.poll(self.timeout)
+            result = self._conn.recv() if ready else None
+        except (OSError, EOFError) as e:
+            self.logger.error("DHT worker connection failed: %s", e)
+            self._kill()
+            return None, None
+        if not ready:
+            self.timeouts += 1
+            self.logger.error("DHT read timed out after %.1f sec - restarting worker", self.timeout)
+            self._kill()
+            return None, None
+        if isinstance(result, Exception):
+            self.logger.error("DHT worker raised: %s", result)
+            return None, None
+        self.read_time.add(time.monotonic() - start)
+        return result
+
+    def stats(self):
+        """
+        Get worker statistics
+
+        Returns:
+            stats (dict): reads, timeouts, restarts and read time statistics
+        """
+        return {'reads': self.reads,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+                'read_time': self.read_time.snapshot(),
+                }
+
+    def close(self):
+        """
+        Stop the worker process
+        """
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(1)
+        self._kill()
+
+    def _start(self):
+        if self._started:
+            self.restarts += 1
+        self._started = True
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_worker_main, name="DHT_Worker",
+                                          args=(child_conn, self._conn, self.sensor, self.pin,
+                                                self.retries))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        self.logger.debug("Started DHT worker pid %d", self._process.pid)
+
+    def _kill(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        if process.is_alive():
+            process.terminate()
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self._conn.close()
@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+import collections
+from stats import RunningStats
+
+
+class TopicStats:
+    """
+    Handler statistics for a single topic
+    """
+
+    def __init__(self):
+        self.wait = RunningStats()      # seconds between submit and handler start
+        self.run = RunningStats()       # seconds spent in the handler
+        self.errors = 0
+
+    def snapshot(self):
+        return {'wait': self.wait.snapshot(),
+                'run': self.run.snapshot(),
+                'errors': self.errors,
+                }
+
+
+class MessageDispatcher:
+    """
+    Runs MQTT message handlers on a bounded pool of worker threads so slow handlers do not
+    stall paho's network thread.
+
+    Messages on the same topic are handled one at a time in the order they arrived, messages
+    on different topics are handled concurrently.
+    """
+
+    def __init__(self, workers=4, maxsize=100, name="MQTT_Worker"):
+        """
+        Args:
+            workers (int): number of worker threads
+            maxsize (int): maximum number of messages waiting for a worker.  Messages submitted
+                while the dispatcher is full are dropped.
+            name (str): base name of the worker threads
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+        self._cond = threading.Condition()
+        self._pending = {}                      # topic -> deque of jobs
+        self._ready = collections.deque()       # topics with jobs and no active worker
+        self._active = set()                    # topics currently being handled
+        self._count = 0                         # total jobs waiting
+        self._stats = {}                        # topic -> TopicStats
+        self._stopping = False
+
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name="%s-%d" % (name, i + 1))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def depth(self):
+        return self._count
+
+    def submit(self, topic, callback, *args):
+        """
+        Queue a handler call
+
+        Args:
+            topic (str): topic the message arrived on, used to order handler calls
+            callback (obj): handler to call
+            args: arguments passed to the handler
+
+        Returns:
+            queued (bool): False if the dispatcher was full or stopped and the message was dropped
+        """
+        with self._cond:
+            if self._stopping or self._count >= self.maxsize:
+                self.dropped += 1
+                self.logger.error("Dispatcher full - dropping message on %s", topic)
+                return False
+            jobs = self._pending.get(topic)
+            if jobs is None:
+                jobs = self._pending[topic] = collections.deque()
+            jobs.append((callback, args, time.monotonic()))
+            self._count += 1
+            if topic not in self._active and len(jobs) == 1:
+                self._ready.append(topic)
+                self._cond.notify()
+            return True
+
+    def stop(self, timeout=None):
+        """
+        Stop accepting messages, let the workers finish queued messages and join them
+
+        Args:
+            timeout (float): max seconds to wait for each worker
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def stats(self):
+        """
+        Get per topic handler statistics
+
+        Returns:
+            stats (dict): topic -> {'wait': ..., 'run': ..., 'errors': ...}
+        """
+        with self._cond:
+            topics = list(self._stats.items())
+        return {topic: s.snapshot() for topic, s in topics}
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    if self._stopping and not self._count:
+                        return
+                    self._cond.wait()
+                topic = self._ready.popleft()
+                callback, args, submitted = self._pending[topic].popleft()
+                self._count -= 1
+                self._active.add(topic)
+                stats = self._stats.get(topic)
+                if stats is None:
+                    stats = self._stats[topic] = TopicStats()
+
+            start = time.monotonic()
+            stats.wait.add(start - submitted)
+            try:
+                callback(*args)
+            except Exception as e:
+                stats.errors += 1
+                self.logger.error("Handler for %s raised: %s", topic, e)
+            stats.run.add(time.monotonic() - start)
+
+            with self._cond:
+                self._active.discard(topic)
+                if self._pending[topic]:
+                    self._ready.append(topic)
+                    self._cond.notify()
+                else:
+                    del self._pending[topic]
+                if self._stopping and not self._count:
+                    self._cond.notify_all()
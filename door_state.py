@@ -0,0 +1,186 @@
+import logging
+import threading
+
+# Door states, published as is on the door state topic
+OPEN        = 'open'
+CLOSED      = 'closed'
+OPENING     = 'opening'
+CLOSING     = 'closing'
+UNKNOWN     = 'unknown'
+
+# Numeric codes of the states, used where a state is stored as a number
+STATE_CODES = {CLOSED: 0, OPEN: 1, OPENING: 2, CLOSING: 3, UNKNOWN: -1}
+
+# Command intents
+INTENT_OPEN     = 'open'
+INTENT_CLOSE    = 'close'
+
+TRAVEL_TIME = 15.0      # seconds a door takes to fully open or close
+RETRY_DELAY = 1.0       # seconds before retrying a pulse rejected by the relay lockout
+
+
+class DoorStateMachine:
+    """
+    Tracks a garage door with a single closed-position sensor and decides when the opener
+    button must be pushed.
+
+    The sensor only tells closed from not closed, so opening and closing are timed with the
+    expected travel time, and a close that never reaches the sensor leaves the door unknown.
+    Commands set the desired end position (the intent).  The button is only pushed when the
+    door is at rest and not already where the intent wants it, so repeated commands are no-ops
+    and a burst of commands collapses to the latest one.  The button is pushed at most once per
+    command.
+    """
+
+    def __init__(self, closed, pulse, timers, on_state=None, travel_time=TRAVEL_TIME, name="Door"):
+        """
+        Args:
+            closed (bool): current reading of the closed-position sensor
+            pulse (obj): function pushing the opener button, returns False if the push was rejected
+            timers (TimerQueue): timer thread used for travel timeouts
+            on_state (obj): called as on_state(state) whenever the state changes
+            travel_time (float): seconds a door takes to fully open or close
+            name (str): name used in log messages
+        """
+        self.logger = logging.getLogger("%s_SM" % name)
+        self.state = CLOSED if closed else OPEN
+        self.intent = None
+        self.travel_time = travel_time
+        self.actuations = 0
+        self.collapsed = 0          # commands that did not need a button push of their own
+
+        self._pulse = pulse
+        self._timers = timers
+        self._on_state = on_state
+        self._travel_timer = None
+        self._retry_timer = None
+        self._lock = threading.RLock()
+
+    def command(self, intent):
+        """
+        Request a door position
+
+        Args:
+            intent (str): INTENT_OPEN or INTENT_CLOSE
+
+        Returns:
+            pushed (bool): True if the button was pushed, False if the door already is in
+                position, None if the command waits for the door to settle
+        """
+        with self._lock:
+            if self.intent is not None:
+                self.collapsed += 1     # replaces a command that was still waiting
+            self.intent = intent
+            actuations = self.actuations
+            self._evaluate()
+            if self.actuations != actuations:
+                return True
+            return None if self.intent is not None else False
+
+    def restore(self, state, elapsed):
+        """
+        Resume a state recorded before a restart, if the sensor reading allows it.  A door that
+        was moving keeps moving for what is left of the travel time.  Call before any command.
+
+        Args:
+            state (str): recorded state
+            elapsed (float): seconds since the state was recorded
+
+        Returns:
+            restored (bool): False if the sensor contradicts the recorded state
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return state == CLOSED
+            if state in (OPENING, CLOSING) and elapsed < self.travel_time:
+                self.state = state
+                self._start_travel(self.travel_time - elapsed)
+            elif state == UNKNOWN or state == CLOSING:
+                # stopped part-way, or a close that never reached the sensor
+                self.state = UNKNOWN
+            else:
+                return state != CLOSED
+            return True
+
+    def sensor(self, closed):
+        """
+        New reading of the closed-position sensor
+
+        Args:
+            closed (bool): True if the door is in the closed position
+        """
+        with self._lock:
+            if closed:
+                self._cancel_travel()
+                self._set_state(CLOSED)
+            elif self.state == CLOSED:
+                # left the closed position, time the travel to fully open
+                self._set_state(OPENING)
+                self._start_travel()
+            else:
+                return
+            self._evaluate()
+
+    def _evaluate(self):
+        """
+        Push the button if the door is at rest and not where the intent wants it
+        """
+        if self.intent is None:
+            return
+        if self.state in (OPENING, CLOSING) or self._retry_timer is not None:
+            return      # re-evaluated once the door settles
+        if (self.intent == INTENT_OPEN and self.state == OPEN) or \
+           (self.intent == INTENT_CLOSE and self.state == CLOSED):
+            self.logger.debug("Already %s - ignoring command", self.state)
+            self.intent = None
+            self.collapsed += 1
+            return
+
+        if not self._pulse():
+            self._retry_timer = self._timers.call_later(RETRY_DELAY, self._retry)
+            return
+        self.actuations += 1
+        if self.state == UNKNOWN:
+            # stopped part-way, the opener direction can't be known from the sensor
+            moving = OPENING if self.intent == INTENT_OPEN else CLOSING
+        else:
+            moving = OPENING if self.state == CLOSED else CLOSING
+        self.intent = None
+        self._set_state(moving)
+        self._start_travel()
+
+    def _retry(self):
+        with self._lock:
+            self._retry_timer = None
+            self._evaluate()
+
+    def _travel_done(self, handle):
+        with self._lock:
+            if handle is not self._travel_timer:
+                return
+            self._travel_timer = None
+            if self.state == OPENING:
+                self._set_state(OPEN)
+            elif self.state == CLOSING:
+                # the sensor never reported closed, the door stopped or reversed
+                self.logger.warning("Door did not close within %.1f sec", self.travel_time)
+                self._set_state(UNKNOWN)
+            self._evaluate()
+
+    def _start_travel(self, duration=None):
+        self._cancel_travel()
+        duration = self.travel_time if duration is None else duration
+        handle = self._travel_timer = self._timers.call_later(duration, lambda: self._travel_done(handle))
+
+    def _cancel_travel(self):
+        if self._travel_timer is not None:
+            self._travel_timer.cancel()
+            self._travel_timer = None
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.logger.debug("%s -> %s", self.state, state)
+        self.state = state
+        if self._on_state is not None:
+            self._on_state(state)
@@ -1,19 +1,33 @@
+import json
 import time
 import logging
 import RPi.GPIO as GPIO
 from led import RGBLed
+from gpio_edges import EdgePipeline
+from relay import RelayScheduler
+from door_state import (DoorStateMachine, INTENT_OPEN, INTENT_CLOSE, TRAVEL_TIME, OPEN, CLOSED,
+                        OPENING, CLOSING, UNKNOWN, STATE_CODES)
+from latency import LatencyTracker, CONFIRM_TIMEOUT
 from MQTTComms import message_callback
+from telemetry import REGISTRY
+from journal import EVENT_DONE, EVENT_FAILED, EVENT_IGNORED
 
 CMD_OPEN        = 'OPEN'
 CMD_CLOSE       = 'CLOSE'
 CMD_STOP        = 'STOP'
 
+CLOSED_LEVEL    = GPIO.HIGH     # state pin level with the door in the closed position
+FAILURE_BLINKS  = 20            # fast orange blinks after a command was not confirmed
+
 class GarageDoor:
     """
     Class that models a physical garage door bay
     """
 
-    def __init__(self, door, ctrl_pin, state_pin, client, ctrl_topic, state_topic, led):
+    def __init__(self, door, ctrl_pin, state_pin, client, ctrl_topic, state_topic, led, edges=None,
+                 debounce=0.2, relay=None, travel_time=TRAVEL_TIME, confirm_timeout=CONFIRM_TIMEOUT,
+                 latency_path=None, latency_topic=None, event_topic=None, animator=None,
+                 journal=None, metrics=REGISTRY):
         """
         Constructor for GarageDoor
 
@@ -22,6 +36,22 @@ class GarageDoor:
             ctrl_pin (int): GPIO pin number that controls door
             state_pin (int): GPIO pin number that monitors the state of the door
             client (MQTTComms): MQTT comms object
+            edges (EdgePipeline): edge pipeline debouncing the state pin, a private one is
+                created if not given
+            debounce (float): seconds the state pin must be quiet before a change is accepted
+            relay (RelayScheduler): scheduler pulsing the control pin, a private one is created
+                if not given
+            travel_time (float): seconds the door takes to fully open or close
+            confirm_timeout (float): seconds from the relay pulse for the state pin to confirm a
+                command before a failure event is raised
+            latency_path (str): JSON file the command latency histograms are kept in
+            latency_topic (str): topic publish_latency() publishes the histograms on
+            event_topic (str): topic failure events are published on
+            animator (LedAnimator): if given the LED shows the door state, blinking while the
+                door moves and after a failed command
+            journal (Journal): if given commands, relay pulses and state changes are journaled
+                and the door state and an unfinished command are recovered from it on start
+            metrics (telemetry.Registry): registry the door records its metrics into
         """
         self.door = door
         self.ctrl_pin = ctrl_pin
@@ -30,64 +60,243 @@ class GarageDoor:
         self.ctrl_topic = ctrl_topic
         self.state_topic = state_topic
         self.led = led
+        self._animator = animator
+        self._edges = edges if edges is not None else EdgePipeline()
+        self._relay = relay if relay is not None else RelayScheduler()
+        self.latency_topic = latency_topic
+        self.event_topic = event_topic
+        self._journal = journal
+        self._in_flight = None      # (command id, intent) of the journaled command not ended yet
         self.logger = logging.getLogger("DOOR%s" % door)
-        self.state = False
 
         self.logger.debug("Initializing Garage Door")
+        self._m_commands = {cmd: metrics.counter('door_commands_total', 'Commands received',
+                                                 door=door, command=cmd)
+                            for cmd in (CMD_OPEN, CMD_CLOSE)}
+        self._m_pulses = metrics.counter('door_relay_pulses_total', 'Relay pulses fired', door=door)
+        self._m_lockouts = metrics.counter('door_relay_lockouts_total',
+                                           'Button pushes ignored inside the relay lockout', door=door)
+        self._m_edges = metrics.counter('door_state_edges_total', 'Raw state pin edges', door=door)
+        self._m_failures = metrics.counter('door_confirm_failures_total',
+                                           'Commands the state pin did not confirm in time', door=door)
+        metrics.gauge('door_state', 'Door state (closed 0, open 1, opening 2, closing 3, unknown -1)',
+                      lambda: STATE_CODES.get(self.state, -1), door=door)
 
         # initialize GPIO pin
         GPIO.setup(self.ctrl_pin, GPIO.OUT)
         GPIO.setup(self.state_pin, GPIO.IN)
-        GPIO.add_event_detect(self.state_pin, GPIO.BOTH, callback=self.get_state)
+        self.latency = LatencyTracker(self._edges.timers, confirm_timeout, self._on_confirm_failure,
+                                      latency_path, name="DOOR%s" % door)
+        level = self._edges.add_pin(self.state_pin, self._on_state_change, debounce,
+                                    on_edge=self._on_raw_edge)
 
-        self.state = self.get_state()
+        self._machine = DoorStateMachine(level == CLOSED_LEVEL, self.push_button, self._edges.timers,
+                                         on_state=self._on_machine_state, travel_time=travel_time,
+                                         name="DOOR%s" % door)
+        if self._journal is not None:
+            self._recover(confirm_timeout)
+        self.state = self._machine.state
+        self.update_state()
+        self._show_state()
 
         self._client.subscribe(self.ctrl_topic)
         self._client.subscribe(self.state_topic)
         self._client.add_message_callback(self.ctrl_topic, self.process_cmd)
+        if self.event_topic is not None:
+            self._client.set_publish_policy(self.event_topic, None)    # never suppress events
+        if self.latency_topic is not None:
+            # every report is a new snapshot, never drop or repeat one
+            self._client.set_publish_policy(self.latency_topic, None)
 
     def push_button(self):
         """
-        Method to toggle the garage door button.  This will open or close the door depending on the
-        current state of the door.
+        Method to toggle the garage door button.  This will open, close or stop the door depending on
+        what it is doing.  The relay pulse is scheduled and this returns right away.  Commands go
+        through the door state machine, which decides when the button needs pushing.
+
+        Returns:
+            accepted (bool): False if the button was pushed again inside the lockout window
         """
         self.logger.debug("push_button() called")
-        GPIO.output(self.ctrl_pin, GPIO.HIGH)
-        time.sleep(0.5)
-        GPIO.output(self.ctrl_pin, GPIO.LOW)
-        time.sleep(1)
-        
-        if self.state:
-            self.state = False
-        else:
-            self.state = True
-            
+        if not self._relay.pulse(self.ctrl_pin):
+            self.logger.debug("push_button() ignored - relay locked out")
+            self._m_lockouts.inc()
+            return False
+        self._m_pulses.inc()
+        self.latency.pulse()
+        if self._journal is not None:
+            in_flight = self._in_flight
+            self._journal.pulse(self.door, in_flight[0] if in_flight else 0)
+        return True
+
+    def _on_machine_state(self, state):
+        """
+        Door state machine changed state
+        """
+        self.state = state
         self.update_state()
+        self._show_state()
+        if self._journal is not None:
+            in_flight = self._in_flight
+            self._journal.state(self.door, state, in_flight[0] if in_flight else 0)
+            if in_flight is None:
+                return
+            if (state == OPEN and in_flight[1] == INTENT_OPEN) or \
+               (state == CLOSED and in_flight[1] == INTENT_CLOSE):
+                self._end_command(EVENT_DONE)
+            elif state == UNKNOWN:
+                self._end_command(EVENT_FAILED)
+
+    def _recover(self, confirm_timeout):
+        """
+        Restore the door state and the command in flight recorded in the journal before the
+        last stop.  A command the relay never fired for is issued again if it is still recent,
+        one the door can no longer finish is recorded as failed.
+        """
+        start = time.perf_counter()
+        record = self._journal.recover(self.door, confirm_timeout + self._machine.travel_time)
+        if record is None:
+            self._journal.state(self.door, self._machine.state)
+            return
+        now = time.time()
+        if not self._machine.restore(record.state, now - record.state_time):
+            self.logger.info("Door is %s, was %s before the restart", self._machine.state,
+                             record.state)
+        if self._machine.state != record.state:
+            self._journal.state(self.door, self._machine.state)
+        if record.command_id is not None:
+            self._in_flight = (record.command_id, record.intent)
+            moving = OPENING if record.intent == INTENT_OPEN else CLOSING
+            if not record.pulsed and now - record.command_time < confirm_timeout:
+                self.logger.info("Resuming %s command %s", record.intent, record.command_id)
+                self.latency.start(record.intent)
+                if self._machine.command(record.intent) is False:
+                    self._end_command(EVENT_IGNORED)
+            elif self._machine.state != moving:
+                reached = OPEN if record.intent == INTENT_OPEN else CLOSED
+                self._end_command(EVENT_DONE if self._machine.state == reached else EVENT_FAILED)
+        self.logger.info("Recovered state %s from the journal in %.1f ms", self._machine.state,
+                         (time.perf_counter() - start) * 1000)
+
+    def _end_command(self, event):
+        """
+        Journal the end of the command in flight
+        """
+        in_flight, self._in_flight = self._in_flight, None
+        if in_flight is not None:
+            self._journal.end(self.door, in_flight[0], event)
+
+    def _show_state(self):
+        """
+        Show the door state on the LED
+        """
+        if self._animator is None:
+            return
+        if self.state == OPENING:
+            self._animator.blink(self.led, RGBLed.GREEN, period=0.5)
+        elif self.state == CLOSING:
+            self._animator.blink(self.led, RGBLed.RED, period=0.5)
+        elif self.state == OPEN:
+            self._animator.fade(self.led, RGBLed.GREEN, duration=0.3)
+        elif self.state == CLOSED:
+            self._animator.fade(self.led, RGBLed.RED, duration=0.3)
+        else:
+            # static, an unknown door can stay unknown for hours
+            self._animator.fade(self.led, RGBLed.ORANGE, duration=0.3)
 
     def update_state(self):
         """
         Update state of garage door
         """
-        state_str = 'closed' if self.state else 'open'
-        self.logger.debug('Door State: %s' % state_str)
-        self._client.publish(self.state_topic, state_str)
+        self.logger.debug('Door State: %s', self.state)
+        self._client.publish(self.state_topic, self.state)
+
+    def publish_latency(self):
+        """
+        Publish the command latency histograms on the latency topic
+        """
+        if self.latency_topic is not None:
+            self._client.publish(self.latency_topic, json.dumps(self.latency.stats()))
         
     def get_state(self):
-        self.state = GPIO.input(self.state_pin)
+        """
+        Read the state pin and publish the door state
+
+        Returns:
+            state (str): door state, one of open, closed, opening, closing or unknown
+        """
+        self._machine.sensor(GPIO.input(self.state_pin) == CLOSED_LEVEL)
         self.update_state()
+        return self.state
+
+    def _on_state_change(self, pin, level):
+        """
+        Debounced state pin transition from the edge pipeline
+        """
+        closed = level == CLOSED_LEVEL
+        self.latency.confirm(INTENT_CLOSE if closed else INTENT_OPEN)
+        self._machine.sensor(closed)
+
+    def _on_raw_edge(self, pin):
+        """
+        Raw state pin edge, before debouncing
+        """
+        self._m_edges.inc()
+        self.latency.edge()
+
+    def _on_confirm_failure(self, trace):
+        """
+        A command fired the relay but the state pin did not confirm it in time
+        """
+        self.logger.error("%s command not confirmed - door state is %s", trace.intent, self.state)
+        self._m_failures.inc()
+        if self._journal is not None:
+            self._end_command(EVENT_FAILED)
+        if self._animator is not None:
+            self._animator.blink(self.led, RGBLed.ORANGE, period=0.25, count=FAILURE_BLINKS,
+                                 done=lambda led: self._show_state())
+        if self.event_topic is not None:
+            event = {'door': self.door,
+                     'event': 'confirm_timeout',
+                     'intent': trace.intent,
+                     'state': self.state,
+                     'timeout': self.latency.timeout,
+                     }
+            self._client.publish(self.event_topic, json.dumps(event))
         
     @message_callback
     def process_cmd(self, client, userdata, message):
         """
         Process commands
         """
+        received = message.timestamp or None
         message = message.payload
         self.logger.debug("Processing command")
+        counter = self._m_commands.get(message)
+        if counter is not None:
+            counter.inc()
         if message == CMD_OPEN:
-            self.led.set_color(RGBLed.GREEN)
-            self.push_button()            
+            self.latency.start(INTENT_OPEN, received)
+            if self._animator is None:      # otherwise the LED follows the door state
+                self.led.set_color(RGBLed.GREEN)
+            self._command(INTENT_OPEN)
         elif message == CMD_CLOSE:
-            self.led.set_color(RGBLed.RED)
-            self.push_button()            
+            self.latency.start(INTENT_CLOSE, received)
+            if self._animator is None:
+                self.led.set_color(RGBLed.RED)
+            self._command(INTENT_CLOSE)
         else:
-            self.logger.debug('Invalid command: %s' % message)
+            self.logger.debug('Invalid command: %s', message)
+
+    def _command(self, intent):
+        """
+        Pass a command to the door state machine, journaling it
+        """
+        if self._journal is not None:
+            if self._in_flight is not None:
+                self._end_command(EVENT_IGNORED)    # replaced by this command
+            self._in_flight = (self._journal.command(self.door, intent), intent)
+        if self._machine.command(intent) is False:
+            self.latency.cancel()
+            if self._journal is not None:
+                self._end_command(EVENT_IGNORED)
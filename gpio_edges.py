@@ -0,0 +1,163 @@
+import time
+import logging
+import threading
+import RPi.GPIO as GPIO
+from timers import TimerQueue
+
+DEBOUNCE = 0.05     # seconds without edges before a pin is considered settled
+CONFIRM = 0.02      # seconds between the two reads that confirm a settled level
+
+
+class _PinState:
+    __slots__ = ('callback', 'on_edge', 'debounce', 'confirm', 'level', 'candidate', 'last_edge',
+                 'timer', 'raw', 'emitted')
+
+    def __init__(self, callback, on_edge, debounce, confirm, level):
+        self.callback = callback
+        self.on_edge = on_edge
+        self.debounce = debounce
+        self.confirm = confirm
+        self.level = level          # last level passed to the callback
+        self.candidate = None       # level read once the pin settled, waiting for confirmation
+        self.last_edge = None
+        self.timer = None
+        self.raw = 0                # edges reported by RPi.GPIO
+        self.emitted = 0            # transitions passed to the callback
+
+
+class EdgePipeline:
+    """
+    Debounces and coalesces RPi.GPIO edge callbacks before they reach a device.
+
+    Every raw edge restarts the pin's debounce window.  Once a pin has been quiet for the whole
+    window its level is read, then read again after a short confirmation delay.  The device
+    callback only runs if both reads agree and the level differs from the last one reported,
+    so a burst of switch chatter produces at most one transition and a bounce that returns to
+    the previous level produces none.
+    """
+
+    def __init__(self, timers=None):
+        """
+        Args:
+            timers (TimerQueue): timer thread used for the debounce windows, a private one is
+                created if not given
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._timers = timers if timers is not None else TimerQueue("GPIO_Edges")
+        self._pins = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timers(self):
+        """
+        Timer thread running the debounce windows and edge callbacks
+        """
+        return self._timers
+
+    def add_pin(self, pin, callback, debounce=DEBOUNCE, confirm=CONFIRM, on_edge=None):
+        """
+        Watch an input pin.  The pin must already be set up as an input.
+
+        Args:
+            pin (int): GPIO pin number
+            callback (obj): called as callback(pin, level) once per confirmed transition
+            debounce (float): seconds without edges before the pin is considered settled
+            confirm (float): seconds between the two confirmation reads
+            on_edge (obj): called as on_edge(pin) from the RPi.GPIO thread for every raw edge,
+                before debouncing.  Must be short.
+
+        Returns:
+            level (int): current level of the pin
+        """
+        level = GPIO.input(pin)
+        with self._lock:
+            self._pins[pin] = _PinState(callback, on_edge, debounce, confirm, level)
+        GPIO.add_event_detect(pin, GPIO.BOTH, callback=self._on_edge)
+        return level
+
+    def remove_pin(self, pin):
+        """
+        Stop watching a pin
+
+        Args:
+            pin (int): GPIO pin number
+        """
+        GPIO.remove_event_detect(pin)
+        with self._lock:
+            state = self._pins.pop(pin, None)
+            if state is not None and state.timer is not None:
+                state.timer.cancel()
+
+    def stats(self):
+        """
+        Get raw and emitted edge counts
+
+        Returns:
+            stats (dict): pin -> {'raw': ..., 'emitted': ...}
+        """
+        with self._lock:
+            return {pin: {'raw': state.raw, 'emitted': state.emitted}
+                    for pin, state in self._pins.items()}
+
+    def _on_edge(self, channel):
+        """
+        RPi.GPIO edge callback.  Only records the edge, all work happens on the timer thread.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._pins.get(channel)
+            if state is None:
+                return
+            state.raw += 1
+            state.last_edge = now
+            state.candidate = None
+            if state.timer is None:
+                state.timer = self._timers.schedule(now + state.debounce, self._settle, channel)
+            on_edge = state.on_edge
+        if on_edge is not None:
+            on_edge(channel)
+
+    def _settle(self, pin):
+        """
+        Debounce window expired.  Restart it if more edges came in, otherwise take the first read.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._pins.get(pin)
+            if state is None:
+                return
+            quiet_until = state.last_edge + state.debounce
+            if now < quiet_until:
+                state.timer = self._timers.schedule(quiet_until, self._settle, pin)
+                return
+            state.candidate = GPIO.input(pin)
+            state.timer = self._timers.schedule(now + state.confirm, self._confirm, pin)
+
+    def _confirm(self, pin):
+        """
+        Second read.  Emit the transition if the level is stable and changed.
+        """
+        with self._lock:
+            state = self._pins.get(pin)
+            if state is None:
+                return
+            state.timer = None
+            if state.candidate is None:
+                # an edge arrived during the confirmation delay, start over
+                state.timer = self._timers.call_later(state.debounce, self._settle, pin)
+                return
+            level = GPIO.input(pin)
+            candidate, state.candidate = state.candidate, None
+            if level != candidate:
+                # level moved without an edge being reported, wait for it to settle again
+                state.timer = self._timers.call_later(state.debounce, self._settle, pin)
+                return
+            if level == state.level:
+                return
+            state.level = level
+            state.emitted += 1
+            callback = state.callback
+        try:
+            callback(pin, level)
+        except Exception as e:
+            self.logger.error("Edge callback for pin %d raised: %s", pin, e)
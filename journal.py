@@ -0,0 +1,212 @@
+import time
+import struct
+import logging
+import threading
+from tsdb import SegmentLog
+from door_state import STATE_CODES, INTENT_OPEN, INTENT_CLOSE
+
+JOURNAL_RECORDS = 4096          # records per segment file
+JOURNAL_DURATION = 7 * 86400    # max seconds of events per segment file
+RETENTION = 365 * 86400         # seconds of events kept
+
+# time, door, event, value, command id
+RECORD = struct.Struct('<dBBbxI')
+
+# Event types
+EVENT_COMMAND   = 1     # command received, value is the intent code
+EVENT_PULSE     = 2     # relay pulsed for the command
+EVENT_STATE     = 3     # door state changed, value is the state code
+EVENT_DONE      = 4     # the door reached the position the command asked for
+EVENT_FAILED    = 5     # the command was not confirmed in time, or abandoned by a restart
+EVENT_IGNORED   = 6     # no push needed, the door was in position or a later command replaced it
+
+EVENT_NAMES = {EVENT_COMMAND: 'command', EVENT_PULSE: 'pulse', EVENT_STATE: 'state',
+               EVENT_DONE: 'done', EVENT_FAILED: 'failed', EVENT_IGNORED: 'ignored'}
+INTENT_CODES = {INTENT_CLOSE: 0, INTENT_OPEN: 1}
+
+_STATES = {code: state for state, code in STATE_CODES.items()}
+_INTENTS = {code: intent for intent, code in INTENT_CODES.items()}
+_ENDS = (EVENT_DONE, EVENT_FAILED, EVENT_IGNORED)
+
+
+class DoorRecord:
+    """
+    Last known situation of a door, recovered from the journal
+    """
+    __slots__ = ('state', 'state_time', 'command_id', 'intent', 'command_time', 'pulsed')
+
+    def __init__(self):
+        self.state = None           # last recorded state
+        self.state_time = None      # time.time() of the last state change
+        self.command_id = None      # command still in flight, None if every command ended
+        self.intent = None
+        self.command_time = None
+        self.pulsed = False         # the relay was pulsed for the command in flight
+
+
+class Journal:
+    """
+    Append-only journal of door commands, relay pulses and state transitions.
+
+    Events are 16 byte records in memory mapped tsdb segments, every event is written through
+    to the file so a crash loses nothing already recorded.  The segment headers hold the first
+    and last event time, so a time range query skips whole segments from the headers and finds
+    the range start in a segment by binary search.  Recovery reads backwards from the newest
+    event and stops as soon as the door's last state is known, so startup does not depend on
+    the length of the history.
+
+    Commands get increasing ids, the pulse, the end event and the state changes a command
+    causes carry its id.  The last id is kept as the mark of the segment headers, so opening
+    the journal reads it from the newest header instead of searching back for a command.
+    """
+
+    def __init__(self, directory, capacity=JOURNAL_RECORDS, duration=JOURNAL_DURATION,
+                 retention=RETENTION):
+        """
+        Args:
+            directory (str): directory holding the journal segments
+            capacity (int): events per segment
+            duration (float): max seconds of events per segment
+            retention (float): seconds of events kept, None keeps everything
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._log = SegmentLog(directory, RECORD, 'journal', b'GPJL', capacity=capacity,
+                               duration=duration, retention=retention)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._last_time = self._log.last_time or 0.0
+        self._last_id = self._log.mark
+
+    def command(self, door, intent):
+        """
+        Record a received command
+
+        Args:
+            door (int): door number
+            intent (str): INTENT_OPEN or INTENT_CLOSE
+
+        Returns:
+            command_id (int): id of the command, passed to the events it causes
+        """
+        with self._lock:
+            self._last_id += 1
+            command_id = self._last_id
+            self._append(door, EVENT_COMMAND, INTENT_CODES[intent], command_id, mark=command_id)
+        return command_id
+
+    def pulse(self, door, command_id=0):
+        """
+        Record a relay pulse, command_id 0 if no command asked for it
+        """
+        with self._lock:
+            self._append(door, EVENT_PULSE, 0, command_id)
+
+    def state(self, door, state, command_id=0):
+        """
+        Record a door state change
+
+        Args:
+            door (int): door number
+            state (str): new door state
+            command_id (int): command that caused the change, 0 if none
+        """
+        with self._lock:
+            self._append(door, EVENT_STATE, STATE_CODES[state], command_id)
+
+    def end(self, door, command_id, event):
+        """
+        Record the end of a command
+
+        Args:
+            door (int): door number
+            command_id (int): command id
+            event (int): EVENT_DONE, EVENT_FAILED or EVENT_IGNORED
+        """
+        with self._lock:
+            self._append(door, event, 0, command_id)
+
+    def recover(self, door, horizon=None):
+        """
+        Get the last known state of a door and the command it had in flight
+
+        Args:
+            door (int): door number
+            horizon (float): seconds after which an unfinished command is no longer in flight,
+                None looks back as far as the last command
+
+        Returns:
+            record (DoorRecord): None if the journal has no state for the door
+        """
+        start = time.perf_counter()
+        cutoff = None if horizon is None else time.time() - horizon
+        result = DoorRecord()
+        ended = set()           # ids of commands with an end event
+        pulsed = set()          # ids of commands the relay was pulsed for
+        commanded = False
+        with self._lock:
+            for when, record_door, event, value, command_id in self._log.reversed():
+                if result.state is not None and (commanded or cutoff is not None and when < cutoff):
+                    break       # older commands can't be in flight
+                if record_door != door:
+                    continue
+                if event in _ENDS:
+                    ended.add(command_id)
+                elif event == EVENT_PULSE:
+                    pulsed.add(command_id)
+                elif event == EVENT_COMMAND and not commanded:
+                    # only the newest command can be in flight, a later one replaces it
+                    commanded = True
+                    if command_id not in ended and (cutoff is None or when >= cutoff):
+                        result.command_id = command_id
+                        result.intent = _INTENTS.get(value)
+                        result.command_time = when
+                        result.pulsed = command_id in pulsed
+                elif event == EVENT_STATE and result.state is None:
+                    result.state = _STATES.get(value)
+                    result.state_time = when
+        self.logger.debug("Recovered door %s in %.1f ms", door,
+                          (time.perf_counter() - start) * 1000)
+        if result.state is None:
+            return None
+        return result
+
+    def query(self, door=None, start=None, end=None):
+        """
+        Get the events of a time range
+
+        Args:
+            door (int): door number, None returns every door
+            start (float): first time.time() to include
+            end (float): first time.time() to exclude
+
+        Returns:
+            events (list): dicts with the time, door, event name, state or intent and command id
+        """
+        with self._lock:
+            records = [r for r in self._log.range(start, end) if door is None or r[1] == door]
+        events = []
+        for when, record_door, event, value, command_id in records:
+            entry = {'time': when, 'door': record_door, 'event': EVENT_NAMES.get(event, event),
+                     'command': command_id}
+            if event == EVENT_STATE:
+                entry['state'] = _STATES.get(value)
+            elif event == EVENT_COMMAND:
+                entry['intent'] = _INTENTS.get(value)
+            events.append(entry)
+        return events
+
+    def close(self):
+        """
+        Close the segments, events recorded afterwards are dropped
+        """
+        with self._lock:
+            self._closed = True
+            self._log.close()
+
+    def _append(self, door, event, value, command_id, mark=None):
+        if self._closed:
+            return      # a timer fired during shutdown
+        # segments are searched by time, keep the times ordered if the clock steps back
+        now = max(time.time(), self._last_time)
+        self._last_time = now
+        self._log.append([(now, door, event, value, command_id)], mark)
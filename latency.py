@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import logging
+import threading
+from stats import Histogram
+
+# Trace stages, in the order a command goes through them
+STAGE_RECEIVE   = 'receive'     # MQTT message read off the socket
+STAGE_HANDLER   = 'handler'     # command handler started
+STAGE_PULSE     = 'pulse'       # relay pulse fired
+STAGE_EDGE      = 'edge'        # first raw edge on the state pin
+STAGE_CONFIRM   = 'confirm'     # debounced state pin reached the commanded position
+
+# Histogram names and the stages they measure between
+INTERVALS = (('dispatch', STAGE_RECEIVE, STAGE_HANDLER),
+             ('actuate', STAGE_HANDLER, STAGE_PULSE),
+             ('response', STAGE_PULSE, STAGE_EDGE),
+             ('settle', STAGE_EDGE, STAGE_CONFIRM),
+             ('travel', STAGE_PULSE, STAGE_CONFIRM),
+             ('total', STAGE_RECEIVE, STAGE_CONFIRM),
+             )
+
+CONFIRM_TIMEOUT = 30.0      # seconds from the pulse for the door to reach the commanded position
+
+
+class CommandTrace:
+    """
+    Stage timestamps of a single command
+    """
+    __slots__ = ('intent', 'stages', 'timer')
+
+    def __init__(self, intent, received=None):
+        self.intent = intent
+        self.stages = {}
+        self.timer = None
+        if received is not None:
+            self.stages[STAGE_RECEIVE] = received
+        self.stages[STAGE_HANDLER] = time.monotonic()
+
+    def intervals(self):
+        """
+        Returns:
+            intervals (dict): histogram name -> seconds, for every interval with both stages set
+        """
+        return {name: self.stages[end] - self.stages[start]
+                for name, start, end in INTERVALS
+                if start in self.stages and end in self.stages}
+
+
+class LatencyTracker:
+    """
+    Traces door commands from the MQTT receive to the debounced state pin confirming the new
+    position and keeps a histogram per command intent and interval.
+
+    One command is traced at a time.  A new command replaces one that has not fired the relay
+    yet, if the relay already fired the new command waits until the current trace ends.  Once
+    the relay fired the command must confirm within the timeout or it counts as a failure and
+    on_failure is called.  Histograms are saved to a JSON file after every completed command
+    and loaded back on start, so they survive restarts.
+    """
+
+    def __init__(self, timers, timeout=CONFIRM_TIMEOUT, on_failure=None, path=None, name="Door"):
+        """
+        Args:
+            timers (TimerQueue): timer thread used for confirmation timeouts
+            timeout (float): seconds from the relay pulse for the command to confirm
+            on_failure (obj): called as on_failure(trace) from the timer thread when a command
+                does not confirm in time
+            path (str): JSON file the histograms are kept in, None keeps them in memory only
+            name (str): name used in log messages
+        """
+        self.logger = logging.getLogger("%s_Latency" % name)
+        self.timeout = timeout
+        self.completed = 0
+        self.failures = 0
+        self._timers = timers
+        self._on_failure = on_failure
+        self._path = path
+        self._trace = None
+        self._next = None       # command received while the current one waits to confirm
+        self._histograms = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def start(self, intent, received=None):
+        """
+        Start tracing a command, called when the command handler starts
+
+        Args:
+            intent (str): commanded position
+            received (float): time.monotonic() time the MQTT message was received
+        """
+        trace = CommandTrace(intent, received)
+        with self._lock:
+            if self._trace is not None and self._trace.timer is not None:
+                self._next = trace      # started once the fired command confirms or expires
+            else:
+                self._trace = trace
+
+    def cancel(self):
+        """
+        Drop the current trace if the relay has not fired for it, e.g. the command was a no-op
+        """
+        with self._lock:
+            if self._next is not None:
+                self._next = None
+            elif self._trace is not None and STAGE_PULSE not in self._trace.stages:
+                self._trace = None
+
+    def pulse(self):
+        """
+        The relay fired for the current command
+        """
+        with self._lock:
+            trace = self._trace
+            if trace is None or STAGE_PULSE in trace.stages:
+                return
+            trace.stages[STAGE_PULSE] = time.monotonic()
+            trace.timer = self._timers.call_later(self.timeout, self._expired, trace)
+
+    def edge(self):
+        """
+        Raw edge seen on the state pin.  Only the first edge after the pulse is recorded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            trace = self._trace
+            if trace is not None and STAGE_PULSE in trace.stages and STAGE_EDGE not in trace.stages:
+                trace.stages[STAGE_EDGE] = now
+
+    def confirm(self, position):
+        """
+        Debounced state pin transition
+
+        Args:
+            position (str): position the door reached, completes the trace if it matches the intent
+        """
+        with self._lock:
+            trace = self._trace
+            if trace is None or STAGE_PULSE not in trace.stages or position != trace.intent:
+                return
+            trace.stages[STAGE_CONFIRM] = time.monotonic()
+            trace.timer.cancel()
+            self._trace, self._next = self._next, None
+            self.completed += 1
+            histograms = self._histograms.setdefault(trace.intent, {})
+            for name, value in trace.intervals().items():
+                hist = histograms.get(name)
+                if hist is None:
+                    hist = histograms[name] = Histogram()
+                hist.add(value)
+        self.logger.debug("%s confirmed in %.3f sec", trace.intent,
+                          trace.stages[STAGE_CONFIRM] - trace.stages[STAGE_HANDLER])
+        self.save()
+
+    def stats(self):
+        """
+        Get the latency histograms
+
+        Returns:
+            stats (dict): completed and failed command counts and intent -> interval -> histogram
+        """
+        with self._lock:
+            return {'completed': self.completed,
+                    'failures': self.failures,
+                    'histograms': {intent: {name: hist.snapshot() for name, hist in hists.items()}
+                                   for intent, hists in self._histograms.items()},
+                    }
+
+    def save(self):
+        """
+        Write the histograms to the JSON file given to the constructor
+        """
+        if self._path is None:
+            return
+        tmp = self._path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.stats(), f)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            self.logger.error("Unable to save latency stats to %s: %s", self._path, e)
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.error("Unable to load latency stats from %s: %s", self._path, e)
+            return
+        self.completed = saved.get('completed', 0)
+        self.failures = saved.get('failures', 0)
+        for intent, hists in saved.get('histograms', {}).items():
+            self._histograms[intent] = {name: Histogram.from_snapshot(snapshot)
+                                        for name, snapshot in hists.items()}
+
+    def _expired(self, trace):
+        with self._lock:
+            if self._trace is not trace:
+                return
+            self._trace, self._next = self._next, None
+            self.failures += 1
+        self.logger.error("%s command did not confirm within %.1f sec", trace.intent, self.timeout)
+        self.save()
+        if self._on_failure is not None:
+            self._on_failure(trace)
@@ -1,6 +1,22 @@
+import threading
 import RPi.GPIO as GPIO
+from telemetry import REGISTRY
 
 FREQ = 50
+GAMMA = 2.2         # perceived brightness correction
+
+
+def duty_table(gamma=GAMMA):
+    """
+    Precompute the duty cycle of every 0-255 color component
+
+    Args:
+        gamma (float): gamma correction exponent, 1 for a linear mapping
+
+    Returns:
+        table (tuple): 256 duty cycles in the range 0-100
+    """
+    return tuple(round(100.0 * (level / 255.0) ** gamma, 2) for level in range(256))
 
 class RGBLed:
     """
@@ -17,7 +33,7 @@ class RGBLed:
     CYAN            = (0,255,0)
     LED_OFF         = (0,0,0)    
 
-    def __init__(self, r, g, b):
+    def __init__(self, r, g, b, gamma=GAMMA, metrics=REGISTRY):
         """
         This classes uses RPi.GPIO objects
 
@@ -25,6 +41,8 @@ class RGBLed:
             r (int): GPIO pin number for red LED
             g (int): GPIO pin number for green LED
             b (int): GPIO pin number for blue LED
+            gamma (float): gamma correction exponent, 1 for a linear mapping
+            metrics (telemetry.Registry): registry the LED records its PWM writes into
         """
         self._red_io = r
         self._green_io = g
@@ -41,6 +59,15 @@ class RGBLed:
         self.r.start(0)
         self.g.start(0)
         self.b.start(0)
+        self._channels = (self.r, self.g, self.b)
+        self._table = duty_table(gamma)
+        self._duty = [0, 0, 0]          # duty cycle last written to each channel
+        self.color = self.LED_OFF
+        self.writes = 0                 # ChangeDutyCycle calls
+        led = '%d,%d,%d' % (r, g, b)
+        self._m_writes = metrics.counter('led_pwm_writes_total', 'PWM duty cycle writes', led=led)
+        self._m_colors = metrics.counter('led_set_color_total', 'set_color calls', led=led)
+        self._lock = threading.Lock()
 
     def set_color(self, color_code):
         """
@@ -49,11 +76,15 @@ class RGBLed:
         Args:
             color_code (tuple): desired color in the form (red,green,blue) and in the range 0-255 per component
         """
-        # scale the RGB codes to be 0-100
-        r = (color_code[0] / 255) * 100
-        g = (color_code[1] / 255) * 100
-        b = (color_code[2] / 255) * 100
-        # update the duty cycles for each leg of the LED        
-        self.r.ChangeDutyCycle(r)
-        self.g.ChangeDutyCycle(g)
-        self.b.ChangeDutyCycle(b)
+        table = self._table
+        self._m_colors.inc()
+        with self._lock:
+            self.color = color_code
+            # only touch the PWM channels whose duty cycle changes
+            for i, channel in enumerate(self._channels):
+                duty = table[color_code[i]]
+                if duty != self._duty[i]:
+                    channel.ChangeDutyCycle(duty)
+                    self._duty[i] = duty
+                    self.writes += 1
+                    self._m_writes.inc()
@@ -0,0 +1,212 @@
+import math
+import time
+import logging
+import threading
+from timers import TimerQueue
+from led import RGBLed
+
+FPS = 30            # animation frames per second
+
+
+class Animation:
+    """
+    Base class of LED animations.  frame() maps the time since the animation started to a
+    color, the animator only writes it to the LED if a duty cycle changed.
+    """
+    final = None        # color left on the LED when the animation ends, None keeps the last frame
+
+    def frame(self, elapsed):
+        """
+        Args:
+            elapsed (float): seconds since the animation started
+
+        Returns:
+            color (tuple): (red, green, blue) 0-255, None once the animation is over
+        """
+        raise NotImplementedError
+
+
+class Blink(Animation):
+    """
+    Switch between a color and another color (off by default)
+    """
+
+    def __init__(self, color, period=1.0, duty=0.5, count=None, off=RGBLed.LED_OFF):
+        """
+        Args:
+            color (tuple): on color
+            period (float): seconds per on / off cycle
+            duty (float): fraction of the period the LED is on
+            count (int): number of blinks, None blinks until stopped
+            off (tuple): off color, also left on the LED at the end
+        """
+        self.color = color
+        self.period = period
+        self.duty = duty
+        self.count = count
+        self.off = off
+        self.final = off
+
+    def frame(self, elapsed):
+        cycles, phase = divmod(elapsed / self.period, 1.0)
+        if self.count is not None and cycles >= self.count:
+            return None
+        return self.color if phase < self.duty else self.off
+
+
+class Fade(Animation):
+    """
+    Fade linearly from one color to another
+    """
+
+    def __init__(self, start, end, duration=1.0):
+        """
+        Args:
+            start (tuple): color to fade from
+            end (tuple): color to fade to, left on the LED at the end
+            duration (float): seconds the fade takes
+        """
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.final = end
+
+    def frame(self, elapsed):
+        if elapsed >= self.duration:
+            return None
+        return _mix(self.start, self.end, elapsed / self.duration)
+
+
+class Pulse(Animation):
+    """
+    Breathe a color smoothly up and down
+    """
+
+    def __init__(self, color, period=2.0, count=None, low=RGBLed.LED_OFF):
+        """
+        Args:
+            color (tuple): color at full brightness
+            period (float): seconds per breath
+            count (int): number of breaths, None pulses until stopped
+            low (tuple): color at the bottom of a breath, also left on the LED at the end
+        """
+        self.color = color
+        self.period = period
+        self.count = count
+        self.low = low
+        self.final = low
+
+    def frame(self, elapsed):
+        cycles, phase = divmod(elapsed / self.period, 1.0)
+        if self.count is not None and cycles >= self.count:
+            return None
+        return _mix(self.low, self.color, 0.5 - 0.5 * math.cos(2 * math.pi * phase))
+
+
+def _mix(start, end, fraction):
+    return tuple(int(round(a + (b - a) * fraction)) for a, b in zip(start, end))
+
+
+class _Running:
+    __slots__ = ('animation', 'started', 'done')
+
+    def __init__(self, animation, started, done):
+        self.animation = animation
+        self.started = started
+        self.done = done
+
+
+class LedAnimator:
+    """
+    Runs the animations of every LED from one timer.  Frames are only computed while an
+    animation runs, and RGBLed.set_color skips channels whose duty cycle did not change, so a
+    blink costs two PWM writes per cycle whatever the frame rate.
+    """
+
+    def __init__(self, timers=None, fps=FPS):
+        """
+        Args:
+            timers (TimerQueue): timer thread running the frames, a private one is created if
+                not given
+            fps (float): frames per second
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._timers = timers if timers is not None else TimerQueue("LED_Animation")
+        self.frame_time = 1.0 / fps
+        self.frames = 0
+        self._running = {}          # led -> _Running
+        self._next_frame = None     # handle of the scheduled frame, None while idle
+        self._lock = threading.Lock()
+
+    def play(self, led, animation, done=None):
+        """
+        Start an animation on a LED, replacing the one it is running
+
+        Args:
+            led (RGBLed): LED to animate
+            animation (Animation): animation to run
+            done (obj): called as done(led) from the timer thread when the animation ends by
+                itself
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._running[led] = _Running(animation, now, done)
+            if self._next_frame is None:
+                self._next_frame = self._timers.schedule(now, self._frame, now)
+
+    def blink(self, led, color, period=1.0, count=None, done=None):
+        """
+        Blink a LED, see Blink and play
+        """
+        self.play(led, Blink(color, period, count=count), done)
+
+    def fade(self, led, color, duration=1.0):
+        """
+        Fade a LED from its current color, see Fade
+        """
+        self.play(led, Fade(led.color, color, duration))
+
+    def pulse(self, led, color, period=2.0, count=None):
+        """
+        Pulse a LED, see Pulse
+        """
+        self.play(led, Pulse(color, period, count=count))
+
+    def stop(self, led, color=None):
+        """
+        Stop the animation of a LED
+
+        Args:
+            led (RGBLed): LED to stop
+            color (tuple): color to set, None leaves the LED at the last frame
+        """
+        with self._lock:
+            self._running.pop(led, None)
+            if color is not None:
+                led.set_color(color)
+
+    def _frame(self, due):
+        now = time.monotonic()
+        finished = []
+        with self._lock:
+            self.frames += 1
+            for led, running in list(self._running.items()):
+                color = running.animation.frame(now - running.started)
+                if color is None:
+                    del self._running[led]
+                    if running.animation.final is not None:
+                        led.set_color(running.animation.final)
+                    finished.append((led, running.done))
+                else:
+                    led.set_color(color)
+            if self._running:
+                # fixed rate, skipping frames that are already late
+                due += self.frame_time
+                if due < now:
+                    due = now + self.frame_time
+                self._next_frame = self._timers.schedule(due, self._frame, due)
+            else:
+                self._next_frame = None
+        for led, done in finished:
+            if done is not None:
+                done(led)
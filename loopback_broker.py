@@ -0,0 +1,272 @@
+import socket
+import struct
+import logging
+import threading
+from topic_trie import TopicTrie
+
+# MQTT 3.1.1 control packet types
+CONNECT         = 1
+CONNACK         = 2
+PUBLISH         = 3
+PUBACK          = 4
+SUBSCRIBE       = 8
+SUBACK          = 9
+UNSUBSCRIBE     = 10
+UNSUBACK        = 11
+PINGREQ         = 12
+PINGRESP        = 13
+DISCONNECT      = 14
+
+
+def _encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def _encode_string(value):
+    return struct.pack('!H', len(value)) + value
+
+
+def _packet(packet_type, flags, body):
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+class _Session:
+    """
+    A connected client
+    """
+
+    def __init__(self, broker, sock, address):
+        self.broker = broker
+        self.sock = sock
+        self.address = address
+        self.client_id = None
+        self.will = None
+        self.filters = set()
+        self._write_lock = threading.Lock()
+
+    def send(self, data):
+        with self._write_lock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                pass
+
+    def deliver(self, topic, payload, retain=False):
+        body = _encode_string(topic) + payload
+        self.send(_packet(PUBLISH, 0x01 if retain else 0, body))
+
+    def _read_exact(self, count):
+        data = bytearray()
+        while len(data) < count:
+            chunk = self.sock.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def read_packet(self):
+        header = self._read_exact(1)[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = self._read_exact(1)[0]
+            length += (byte & 0x7f) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return header >> 4, header & 0x0f, self._read_exact(length) if length else b''
+
+
+class LoopbackBroker:
+    """
+    Minimal in-process MQTT 3.1.1 broker listening on the loopback interface.  Supports what
+    GaragePi uses: QoS 0/1 publishes (delivered at QoS 0), wildcard subscriptions, retained
+    messages, keepalive pings and Last Will messages.  Meant for benchmarks and local testing,
+    not for production use.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        Args:
+            host (str): address to listen on
+            port (int): port to listen on, 0 picks a free port
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(16)
+        self.host, self.port = self._server.getsockname()
+
+        self._lock = threading.Lock()
+        self._router = TopicTrie()
+        self._sessions = set()
+        self._retained = {}
+        self._running = False
+        self._accept_thread = None
+        self.messages_routed = 0
+
+    def start(self):
+        """
+        Start accepting connections
+        """
+        self._running = True
+        self._accept_thread = threading.Thread(target=self._accept_loop, name="LoopbackBroker")
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+        return self
+
+    def stop(self):
+        """
+        Close all connections and stop the broker
+        """
+        self._running = False
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)     # wake up accept()
+        except OSError:
+            pass
+        self._server.close()
+        self.drop_connections()
+        if self._accept_thread is not None:
+            self._accept_thread.join()
+
+    def drop_connections(self):
+        """
+        Abruptly close every client connection, as if the network went down.  Last Will
+        messages are published.
+        """
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, sock, address)
+            t = threading.Thread(target=self._session_loop, args=(session,),
+                                 name="LoopbackBroker-%s" % address[1])
+            t.daemon = True
+            t.start()
+
+    def _session_loop(self, session):
+        with self._lock:
+            self._sessions.add(session)
+        clean = False
+        try:
+            while True:
+                packet_type, flags, body = session.read_packet()
+                if packet_type == CONNECT:
+                    self._on_connect(session, body)
+                elif packet_type == PUBLISH:
+                    self._on_publish(session, flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._on_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    session.send(_packet(PINGRESP, 0, b''))
+                elif packet_type == DISCONNECT:
+                    clean = True
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._sessions.discard(session)
+                for topic_filter in session.filters:
+                    self._router.remove(topic_filter, session)
+            session.sock.close()
+            if not clean and session.will is not None:
+                self._route(*session.will)
+
+    def _on_connect(self, session, body):
+        pos = 2 + struct.unpack('!H', body[:2])[0]     # protocol name
+        flags = body[pos + 1]
+        pos += 4                                        # level, flags, keepalive
+        length = struct.unpack('!H', body[pos:pos + 2])[0]
+        session.client_id = body[pos + 2:pos + 2 + length].decode('utf-8')
+        pos += 2 + length
+        if flags & 0x04:
+            length = struct.unpack('!H', body[pos:pos + 2])[0]
+            topic = body[pos + 2:pos + 2 + length].decode('utf-8')
+            pos += 2 + length
+            length = struct.unpack('!H', body[pos:pos + 2])[0]
+            payload = body[pos + 2:pos + 2 + length]
+            session.will = (topic, payload, bool(flags & 0x20))
+        session.send(_packet(CONNACK, 0, b'\x00\x00'))
+
+    def _on_publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + length].decode('utf-8')
+        pos = 2 + length
+        if qos:
+            mid = body[pos:pos + 2]
+            pos += 2
+            session.send(_packet(PUBACK, 0, mid))
+        self._route(topic, body[pos:], bool(flags & 0x01))
+
+    def _route(self, topic, payload, retain=False):
+        if retain:
+            with self._lock:
+                if payload:
+                    self._retained[topic] = payload
+                else:
+                    self._retained.pop(topic, None)
+        encoded = topic.encode('utf-8')
+        for session in set(self._router.match(topic)):
+            session.deliver(encoded, payload)
+        self.messages_routed += 1
+
+    def _on_subscribe(self, session, body):
+        mid, pos = body[:2], 2
+        granted = bytearray()
+        new = []
+        while pos < len(body):
+            length = struct.unpack('!H', body[pos:pos + 2])[0]
+            topic_filter = body[pos + 2:pos + 2 + length].decode('utf-8')
+            pos += 3 + length       # filter and requested qos
+            with self._lock:
+                if topic_filter not in session.filters:
+                    session.filters.add(topic_filter)
+                    self._router.add(topic_filter, session)
+            new.append(topic_filter)
+            granted.append(0)
+        session.send(_packet(SUBACK, 0, mid + bytes(granted)))
+
+        # deliver retained messages matching the new filters
+        matcher = TopicTrie()
+        for topic_filter in new:
+            matcher.add(topic_filter, True)
+        with self._lock:
+            retained = list(self._retained.items())
+        for topic, payload in retained:
+            if matcher.match(topic):
+                session.deliver(topic.encode('utf-8'), payload, retain=True)
+
+    def _on_unsubscribe(self, session, body):
+        mid, pos = body[:2], 2
+        while pos < len(body):
+            length = struct.unpack('!H', body[pos:pos + 2])[0]
+            topic_filter = body[pos + 2:pos + 2 + length].decode('utf-8')
+            pos += 2 + length
+            with self._lock:
+                if topic_filter in session.filters:
+                    session.filters.discard(topic_filter)
+                    self._router.remove(topic_filter, session)
+        session.send(_packet(UNSUBACK, 0, mid))
@@ -1,78 +1,121 @@
-import time
+import signal
 import logging
-import threading
 import RPi.GPIO as GPIO
 from MQTTComms import MQTTComms
+from offline_buffer import OfflineBuffer
+from tsdb import TimeSeriesStore
+from journal import Journal
+from door_state import STATE_CODES
+from publish_policy import PublishPolicy
 from dht22_sensor import dht_sensor
 from garage_controller import GarageDoor
+from pir_sensor import PIR as PIRSensor     # PIR is the topic in config
+from occupancy import Occupancy
+from gpio_edges import EdgePipeline
+from relay import RelayScheduler
 from utils import init_logger, import_credentials
-from threads import DroneThread
+from scheduler import PeriodicScheduler
 from led import RGBLed
+from led_animation import LedAnimator
+from telemetry import MetricsServer, publish_metrics
+from profiling import ProfileController
+from config import (LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL, LOG_ASYNC, LOG_MAX_BYTES,
+                    LOG_BACKUP_COUNT, LOG_RATE_LIMITS, MQTT_CREDENTIALS, BROKER_HOST,
+                    CONNECT_TIMEOUT, PUBLISH_QUEUE_SIZE, PUBLISH_HEARTBEAT, OFFLINE_BUFFER_PATH,
+                    DISPATCH_WORKERS, HISTORY_PATH, HISTORY_RETENTION, HISTORY_FLUSH_INTERVAL,
+                    JOURNAL_PATH, JOURNAL_RETENTION, DHT_POLL_INTERVAL, DHT_POLL_MAX_INTERVAL,
+                    DHT_MAX_AGE, DHT_WORKER_TIMEOUT, DHT_SUMMARY_INTERVAL, PIR_HOLD_TIME,
+                    PIR_MIN_PUBLISH_INTERVAL, PIR_COUNT_INTERVAL, LED_FPS, HEARTBEAT_INTERVAL,
+                    DOOR_TRAVEL_TIME, DOOR_CONFIRM_TIMEOUT, LATENCY_PUBLISH_INTERVAL,
+                    LATENCY_STATS_PATH_1, METRICS_HOST, METRICS_PORT, METRICS_PUBLISH_INTERVAL,
+                    PROFILE_PATH, PROFILE_TOP, CMD_1, STATE_1, AVAILABILITY_1, LATENCY_1, EVENTS_1,
+                    TEMP, HUMIDITY, PIR, PIR_COUNT, DHT_SUMMARY, DHT_GET, METRICS, PROFILE_SET,
+                    PROFILE_RESULT, DOOR1_CTRL, DOOR1_STATE, PIR_STATE, DHT22_DATA, LED_RED,
+                    LED_GREEN, LED_BLUE)
 
-# LOGGER
-LOG_FILE_PATH = "garagePi.log"
-CONSOLE_LEVEL = logging.DEBUG
-LOG_LEVEL = logging.DEBUG
-
-# MQTT
-MQTT_CREDENTIALS = 'credentials.txt'
-
-BROKER_HOST = '192.168.1.120'
-
-# MQTT Topics
-CMD_1 = 'hass/cover1/set'                       # Door1 Cmd topic
-CMD_2 = 'hass/cover2/set'                       # Door2 Cmd topic
-STATE_1 = 'hass/cover1/state'                   # Door1 State topic
-STATE_2 = 'hass/cover2/state'                   # Door2 state topic
-AVAILABILITY_1 = 'hass/cover1/availability'     # Door1 availability topic
-AVAILABILITY_2 = 'hass/cover2/availability'     # Door2 availability topic
-TEMP = 'hass/heat/val'                          # Temperature sensor topic
-HUMIDITY = 'hass/humidty/val'                   # Humidity sensor topic
-PIR = 'hass/pir/state'                          # PIR sensor topic
-
-# GPIO CONSTANTS
-DOOR1_CTRL      = 24            # output pin controlling door 1
-DOOR2_CTRL      = 8             # output pin controlling door 2
-DOOR1_STATE     = 23            # input pin for determining state of door 1
-DOOR2_STATE     = 25            # input pin for determining state of door 2
-PIR_STATE       = 26            # input pin for determining state of PIR sensor
-DHT22_DATA      = 27            # data pin for DHT22 Temp/Humidity sensor
-LED_RED         = 0             # output pin for Red RGB LED pin
-LED_GREEN       = 5             # output pin for Green RGB LED pin
-LED_BLUE        = 6             # output pin for Blue RGB LED pin
-
-init_logger(LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL)  # initialize logger
+init_logger(LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL, async_mode=LOG_ASYNC, max_bytes=LOG_MAX_BYTES,
+            backup_count=LOG_BACKUP_COUNT, rate_limits=LOG_RATE_LIMITS)  # initialize logger
 _LOGGER = logging.getLogger("Main")
 _LOGGER.info("Initializing GaragePi")
 
 username, password = import_credentials(MQTT_CREDENTIALS)   # get broker credentials
-mqttClient = MQTTComms(BROKER_HOST, 'GaragePi', [], username, password)  # setup MQTT Client object
+offline_buffer = OfflineBuffer(OFFLINE_BUFFER_PATH, collapse=(STATE_1, PIR, TEMP, HUMIDITY))
+mqttClient = MQTTComms(BROKER_HOST, 'GaragePi', [], username, password,
+                       publish_queue_size=PUBLISH_QUEUE_SIZE,
+                       offline_buffer=offline_buffer,
+                       dispatch_workers=DISPATCH_WORKERS,
+                       will_topic=AVAILABILITY_1,
+                       publish_policy=PublishPolicy(dedupe=True, heartbeat=PUBLISH_HEARTBEAT))  # setup MQTT Client object
+history = TimeSeriesStore(HISTORY_PATH, value_map=STATE_CODES, retention=HISTORY_RETENTION)
+mqttClient.add_publish_listener(history.record_message)    # keep every reading locally
 mqttClient.connect()
-time.sleep(3)
+if not mqttClient.wait_until_ready(CONNECT_TIMEOUT):
+    _LOGGER.error("Broker did not accept the connection within %d sec", CONNECT_TIMEOUT)
 
 GPIO.setmode(GPIO.BCM)
 
-main_thread = threading.currentThread()
+scheduler = PeriodicScheduler()    # runs every periodic task on one thread
 
-dht = dht_sensor(DHT22_DATA, mqttClient, TEMP, HUMIDITY)
-dht_thread = DroneThread(name="DHT_Sensor", target=dht.read_sensor, kwargs={'LoopDelay':5})
+dht = dht_sensor(DHT22_DATA, mqttClient, TEMP, HUMIDITY, heartbeat=PUBLISH_HEARTBEAT,
+                 worker_timeout=DHT_WORKER_TIMEOUT, summary_topic=DHT_SUMMARY, get_topic=DHT_GET,
+                 max_age=DHT_MAX_AGE)
 
 led = RGBLed(LED_RED, LED_GREEN, LED_BLUE)
 led.set_color(RGBLed.BLUE)
 
-door1 = GarageDoor(1, DOOR1_CTRL, DOOR1_STATE, mqttClient, CMD_1, STATE_1, led)
+edges = EdgePipeline()     # debounces every GPIO input on one timer thread
+relay = RelayScheduler()   # drives every relay pulse on one timer thread
+occupancy = Occupancy(mqttClient, PIR, edges.timers, hold=PIR_HOLD_TIME,
+                      min_interval=PIR_MIN_PUBLISH_INTERVAL, count_topic=PIR_COUNT,
+                      heartbeat=PUBLISH_HEARTBEAT)
+pir = PIRSensor(PIR_STATE, mqttClient, None, callback=occupancy.motion)
+animator = LedAnimator(edges.timers, LED_FPS)    # shows door motion on the LED
+journal = Journal(JOURNAL_PATH, retention=JOURNAL_RETENTION)   # door commands and states
+door1 = GarageDoor(1, DOOR1_CTRL, DOOR1_STATE, mqttClient, CMD_1, STATE_1, led, edges, relay=relay,
+                   travel_time=DOOR_TRAVEL_TIME, confirm_timeout=DOOR_CONFIRM_TIMEOUT,
+                   latency_path=LATENCY_STATS_PATH_1, latency_topic=LATENCY_1, event_topic=EVENTS_1,
+                   animator=animator, journal=journal)
+profiler = ProfileController(mqttClient, PROFILE_SET, PROFILE_RESULT, PROFILE_PATH, PROFILE_TOP)
+metrics_server = None
+if METRICS_PORT is not None:
+    metrics_server = MetricsServer(host=METRICS_HOST, port=METRICS_PORT).start()
+
+
+def heartbeat():
+    _LOGGER.debug("Main Loop Heart Beat")
+
 
 try:
-    dht_thread.start()  #start the DHT thread
+    dht.schedule(scheduler, DHT_POLL_INTERVAL, DHT_POLL_MAX_INTERVAL)
+    scheduler.every(DHT_SUMMARY_INTERVAL, dht.publish_summary, name="DHT_Summary",
+                    delay=DHT_SUMMARY_INTERVAL)
+    scheduler.every(HISTORY_FLUSH_INTERVAL, history.flush, name="History",
+                    delay=HISTORY_FLUSH_INTERVAL, blocking=True)
+    scheduler.every(PIR_COUNT_INTERVAL, occupancy.publish_counts, name="PIR_Counts",
+                    delay=PIR_COUNT_INTERVAL)
+    scheduler.every(HEARTBEAT_INTERVAL, heartbeat, name="Heartbeat")
+    scheduler.every(LATENCY_PUBLISH_INTERVAL, door1.publish_latency, name="Latency",
+                    delay=LATENCY_PUBLISH_INTERVAL)
+    if METRICS_PUBLISH_INTERVAL is not None:
+        scheduler.every(METRICS_PUBLISH_INTERVAL, publish_metrics, mqttClient, METRICS,
+                        name="Metrics", delay=METRICS_PUBLISH_INTERVAL)
     while True:
-        _LOGGER.debug("Main Loop Heart Beat")
-        time.sleep(10)
+        signal.pause()  # everything runs on the scheduler, wait for Ctrl-C
 except KeyboardInterrupt:
-    dht_thread.join()
-    _LOGGER.debug("Waiting for threads to join")    
+    _LOGGER.debug("Keyboard interrupt")
 finally:
+    _LOGGER.debug("Stopping scheduler")
+    scheduler.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    dht.close()
+    history.close()
+    journal.close()
     _LOGGER.debug("Disconnecting MQTT Client")
-    mqttClient.close()
+    try:
+        mqttClient.close()
+    finally:
+        offline_buffer.close()     # sync buffered messages even if the client close fails
     _LOGGER.debug("Cleaning up GPIO")
     GPIO.cleanup()
     _LOGGER.debug("Ending Main")
\ No newline at end of file
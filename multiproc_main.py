@@ -0,0 +1,331 @@
+import time
+import signal
+import logging
+import multiprocessing
+import RPi.GPIO as GPIO
+from MQTTComms import MQTTComms
+from offline_buffer import OfflineBuffer
+from tsdb import TimeSeriesStore
+from journal import Journal
+from door_state import STATE_CODES
+from publish_policy import PublishPolicy
+from dht22_sensor import dht_sensor
+from garage_controller import GarageDoor
+from pir_sensor import PIR as PIRSensor     # PIR is the topic in config
+from occupancy import Occupancy
+from gpio_edges import EdgePipeline
+from relay import RelayScheduler
+from utils import init_logger, import_credentials
+from scheduler import PeriodicScheduler
+from led import RGBLed
+from led_animation import LedAnimator
+from telemetry import REGISTRY, MetricsServer, publish_metrics
+from profiling import ProfileController
+from shared_state import SharedState
+from process_comms import QueueClient, ClientBridge
+from config import (LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL, LOG_ASYNC, LOG_MAX_BYTES,
+                    LOG_BACKUP_COUNT, LOG_RATE_LIMITS, MQTT_CREDENTIALS, BROKER_HOST,
+                    CONNECT_TIMEOUT, PUBLISH_QUEUE_SIZE, PUBLISH_HEARTBEAT, OFFLINE_BUFFER_PATH,
+                    DISPATCH_WORKERS, HISTORY_PATH, HISTORY_RETENTION, HISTORY_FLUSH_INTERVAL,
+                    JOURNAL_PATH, JOURNAL_RETENTION, DHT_POLL_INTERVAL, DHT_POLL_MAX_INTERVAL,
+                    DHT_MAX_AGE, DHT_WORKER_TIMEOUT, DHT_SUMMARY_INTERVAL, PIR_HOLD_TIME,
+                    PIR_MIN_PUBLISH_INTERVAL, PIR_COUNT_INTERVAL, LED_FPS, HEARTBEAT_INTERVAL,
+                    DOOR_TRAVEL_TIME, DOOR_CONFIRM_TIMEOUT, LATENCY_PUBLISH_INTERVAL,
+                    LATENCY_STATS_PATH_1, METRICS_HOST, METRICS_PORT, METRICS_PUBLISH_INTERVAL,
+                    PROFILE_PATH, PROFILE_TOP, PROCESS_HEARTBEAT_INTERVAL, PROCESS_WATCHDOG_TIMEOUT,
+                    PROCESS_INBOUND_QUEUE_SIZE, CMD_1, STATE_1, AVAILABILITY_1, LATENCY_1, EVENTS_1,
+                    TEMP, HUMIDITY, PIR, PIR_COUNT, DHT_SUMMARY, DHT_GET, METRICS, PROFILE_SET,
+                    PROFILE_RESULT, DOOR1_CTRL, DOOR1_STATE, PIR_STATE, DHT22_DATA, LED_RED,
+                    LED_GREEN, LED_BLUE)
+
+PROCESS_SENSOR = 'Sensor'           # DHT22 acquisition
+PROCESS_ACTUATION = 'Actuation'     # door, relay, LED and PIR GPIO
+
+# shared state field each worker process writes its heart beat to
+HEARTBEAT_FIELDS = {PROCESS_SENSOR: 'sensor_heartbeat',
+                    PROCESS_ACTUATION: 'actuation_heartbeat'}
+
+_LOGGER = logging.getLogger("Main")
+
+
+def _state_writer(state, topics):
+    """
+    Publish listener copying published values into the shared state
+
+    Args:
+        state (SharedState): shared state block
+        topics (dict): topic -> (field, function converting the message to the field value)
+    """
+    def listener(topic, msg):
+        entry = topics.get(topic)
+        if entry is not None:
+            field, convert = entry
+            state.update(**{field: convert(msg)})
+    return listener
+
+
+def _state_code(msg):
+    return STATE_CODES.get(msg, STATE_CODES['unknown'])
+
+
+def _heartbeat(state, field):
+    state.update(**{field: time.monotonic()})
+
+
+def _init_worker(name, state_name, state_lock, outbound, inbound):
+    """
+    Common setup of a worker process.  Log records go to the MQTT process, which writes them
+    with its own logging setup.
+
+    Returns:
+        state (SharedState): shared state block
+        client (QueueClient): MQTT client stand-in
+        scheduler (PeriodicScheduler): scheduler of the process's periodic tasks
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # the MQTT process stops the workers
+    client = QueueClient(name, outbound, inbound).start()
+    root = logging.getLogger('')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(client.log_handler())
+    root.setLevel(min(LOG_LEVEL, CONSOLE_LEVEL))
+    state = SharedState(name=state_name, lock=state_lock)
+    GPIO.setmode(GPIO.BCM)
+    scheduler = PeriodicScheduler(name=name + "_Scheduler")
+    scheduler.every(PROCESS_HEARTBEAT_INTERVAL, _heartbeat, state, HEARTBEAT_FIELDS[name],
+                    name="Heartbeat")
+    if METRICS_PUBLISH_INTERVAL is not None:
+        # the metrics endpoint only serves the MQTT process, workers publish theirs
+        scheduler.every(METRICS_PUBLISH_INTERVAL, publish_metrics, client,
+                        METRICS + '/' + name.lower(), name="Metrics", delay=METRICS_PUBLISH_INTERVAL)
+    return state, client, scheduler
+
+
+def sensor_process(state_name, state_lock, outbound, inbound):
+    """
+    Sensor acquisition process body.  Reads the DHT22 and publishes the readings.
+    """
+    state, client, scheduler = _init_worker(PROCESS_SENSOR, state_name, state_lock, outbound,
+                                            inbound)
+    readings = {TEMP: ('temperature', float), HUMIDITY: ('humidity', float)}
+    record = _state_writer(state, readings)
+
+    def on_publish(topic, msg):
+        record(topic, msg)
+        if topic in readings:
+            state.update(reading_time=time.time())
+
+    client.add_publish_listener(on_publish)
+    dht = dht_sensor(DHT22_DATA, client, TEMP, HUMIDITY, heartbeat=PUBLISH_HEARTBEAT,
+                     worker_timeout=DHT_WORKER_TIMEOUT, summary_topic=DHT_SUMMARY,
+                     get_topic=DHT_GET, max_age=DHT_MAX_AGE)
+    try:
+        dht.schedule(scheduler, DHT_POLL_INTERVAL, DHT_POLL_MAX_INTERVAL)
+        scheduler.every(DHT_SUMMARY_INTERVAL, dht.publish_summary, name="DHT_Summary",
+                        delay=DHT_SUMMARY_INTERVAL)
+        client.join()       # until the MQTT process asks the worker to stop
+    finally:
+        scheduler.stop()
+        dht.close()
+        client.close()
+        state.close()
+        GPIO.cleanup()
+
+
+def actuation_process(state_name, state_lock, outbound, inbound):
+    """
+    Actuation process body.  Owns the door, relay, LED and PIR GPIO.
+    """
+    state, client, scheduler = _init_worker(PROCESS_ACTUATION, state_name, state_lock, outbound,
+                                            inbound)
+    client.add_publish_listener(_state_writer(state, {STATE_1: ('door1_state', _state_code),
+                                                      PIR: ('occupancy', int)}))
+    led = RGBLed(LED_RED, LED_GREEN, LED_BLUE)
+    led.set_color(RGBLed.BLUE)
+    edges = EdgePipeline()     # debounces every GPIO input on one timer thread
+    relay = RelayScheduler()   # drives every relay pulse on one timer thread
+    occupancy = Occupancy(client, PIR, edges.timers, hold=PIR_HOLD_TIME,
+                          min_interval=PIR_MIN_PUBLISH_INTERVAL, count_topic=PIR_COUNT,
+                          heartbeat=PUBLISH_HEARTBEAT)
+    pir = PIRSensor(PIR_STATE, client, None, callback=occupancy.motion)
+    animator = LedAnimator(edges.timers, LED_FPS)
+    journal = Journal(JOURNAL_PATH, retention=JOURNAL_RETENTION)   # door commands and states
+    door1 = GarageDoor(1, DOOR1_CTRL, DOOR1_STATE, client, CMD_1, STATE_1, led, edges, relay=relay,
+                       travel_time=DOOR_TRAVEL_TIME, confirm_timeout=DOOR_CONFIRM_TIMEOUT,
+                       latency_path=LATENCY_STATS_PATH_1, latency_topic=LATENCY_1,
+                       event_topic=EVENTS_1, animator=animator, journal=journal)
+    try:
+        scheduler.every(PIR_COUNT_INTERVAL, occupancy.publish_counts, name="PIR_Counts",
+                        delay=PIR_COUNT_INTERVAL)
+        scheduler.every(LATENCY_PUBLISH_INTERVAL, door1.publish_latency, name="Latency",
+                        delay=LATENCY_PUBLISH_INTERVAL)
+        client.join()       # until the MQTT process asks the worker to stop
+    finally:
+        scheduler.stop()
+        journal.close()
+        client.close()
+        state.close()
+        GPIO.cleanup()
+
+
+WORKERS = {PROCESS_SENSOR: sensor_process,
+           PROCESS_ACTUATION: actuation_process}
+
+
+class Supervisor:
+    """
+    Starts the worker processes and restarts one that died or stopped sending heart beats
+    """
+
+    def __init__(self, context, state, state_lock, bridge):
+        """
+        Args:
+            context (multiprocessing.context): context creating the processes and queues
+            state (SharedState): shared state block holding the worker heart beats
+            state_lock (multiprocessing.Lock): lock serializing shared state writers
+            bridge (ClientBridge): bridge serving the workers' queues
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._context = context
+        self._state = state
+        self._state_lock = state_lock
+        self._bridge = bridge
+        self._stopping = False
+        self.processes = {}         # name -> (process, monotonic start time)
+        self._restarts = {name: REGISTRY.counter('process_restarts_total', 'Worker process restarts',
+                                                 process=name)
+                          for name in WORKERS}
+
+    def start(self, name):
+        """
+        Start a worker process with a new pair of queues
+        """
+        outbound = self._context.Queue()
+        inbound = self._context.Queue(PROCESS_INBOUND_QUEUE_SIZE)
+        self._bridge.attach(name, outbound, inbound)
+        process = self._context.Process(target=WORKERS[name], name=name,
+                                        args=(self._state.name, self._state_lock, outbound, inbound))
+        process.start()     # not a daemon, the sensor process starts its own DHT worker
+        self.processes[name] = (process, time.monotonic())
+        self.logger.info("Started %s process (pid %d)", name, process.pid)
+
+    def check(self):
+        """
+        Restart dead and stalled worker processes, meant as a periodic task
+        """
+        if self._stopping:
+            return
+        try:
+            state = self._state.read()
+        except TimeoutError as e:
+            self.logger.error("%s", e)
+            state = None
+        now = time.monotonic()
+        for name, (process, started) in list(self.processes.items()):
+            if process.exitcode is not None:
+                self.logger.error("%s process exited with code %s", name, process.exitcode)
+            elif state is not None and \
+                    now - max(state[HEARTBEAT_FIELDS[name]], started) > PROCESS_WATCHDOG_TIMEOUT:
+                self.logger.error("%s process stalled - restarting it", name)
+                process.kill()
+                process.join()
+            else:
+                continue
+            self._state.repair(process.pid)
+            self._restarts[name].inc()
+            self.start(name)
+
+    def stop(self, timeout=5):
+        """
+        Ask every worker to stop, killing the ones that do not stop in time
+        """
+        self._stopping = True
+        for name in self.processes:
+            self._bridge.request_stop(name)
+        for name, (process, _) in self.processes.items():
+            process.join(timeout)
+            if process.exitcode is None:
+                self.logger.error("%s process did not stop - killing it", name)
+                process.kill()
+                process.join()
+
+
+def main():
+    """
+    Multi-process entry point.  This process runs MQTT I/O, the history and the metrics
+    endpoint.  DHT22 acquisition and the door / LED / PIR GPIO run in worker processes with
+    their own interpreter and GIL, so bit-banging the sensor or a stalled worker does not hold
+    up the others.  Workers reach the broker through QueueClient, current device state is kept
+    in a SharedState block.
+    """
+    context = multiprocessing.get_context('spawn')     # no threads or GPIO state are inherited
+    state_lock = context.Lock()
+    state = SharedState(lock=state_lock)
+
+    username, password = import_credentials(MQTT_CREDENTIALS)   # get broker credentials
+    offline_buffer = OfflineBuffer(OFFLINE_BUFFER_PATH, collapse=(STATE_1, PIR, TEMP, HUMIDITY))
+    mqttClient = MQTTComms(BROKER_HOST, 'GaragePi', [], username, password,
+                           publish_queue_size=PUBLISH_QUEUE_SIZE,
+                           offline_buffer=offline_buffer,
+                           dispatch_workers=DISPATCH_WORKERS,
+                           will_topic=AVAILABILITY_1,
+                           publish_policy=PublishPolicy(dedupe=True, heartbeat=PUBLISH_HEARTBEAT))
+    history = TimeSeriesStore(HISTORY_PATH, value_map=STATE_CODES, retention=HISTORY_RETENTION)
+    mqttClient.add_publish_listener(history.record_message)    # keep every reading locally
+    bridge = ClientBridge(mqttClient)
+    mqttClient.connect()
+    if not mqttClient.wait_until_ready(CONNECT_TIMEOUT):
+        _LOGGER.error("Broker did not accept the connection within %d sec", CONNECT_TIMEOUT)
+
+    for field in state.fields:
+        REGISTRY.gauge('device_state', 'Shared device state', lambda field=field: state.get(field),
+                       field=field)
+    profiler = ProfileController(mqttClient, PROFILE_SET, PROFILE_RESULT, PROFILE_PATH, PROFILE_TOP)
+    metrics_server = None
+    if METRICS_PORT is not None:
+        metrics_server = MetricsServer(host=METRICS_HOST, port=METRICS_PORT).start()
+
+    supervisor = Supervisor(context, state, state_lock, bridge)
+    scheduler = PeriodicScheduler()
+
+    def connection():
+        state.update(mqtt_connected=int(mqttClient.connection_stats()['connected']))
+
+    try:
+        for name in WORKERS:
+            supervisor.start(name)
+        scheduler.every(PROCESS_HEARTBEAT_INTERVAL, supervisor.check, name="Watchdog",
+                        delay=PROCESS_HEARTBEAT_INTERVAL, blocking=True)
+        scheduler.every(PROCESS_HEARTBEAT_INTERVAL, connection, name="Connection")
+        scheduler.every(HISTORY_FLUSH_INTERVAL, history.flush, name="History",
+                        delay=HISTORY_FLUSH_INTERVAL, blocking=True)
+        scheduler.every(HEARTBEAT_INTERVAL, _LOGGER.debug, "Main Loop Heart Beat", name="Heartbeat")
+        if METRICS_PUBLISH_INTERVAL is not None:
+            scheduler.every(METRICS_PUBLISH_INTERVAL, publish_metrics, mqttClient, METRICS,
+                            name="Metrics", delay=METRICS_PUBLISH_INTERVAL)
+        while True:
+            signal.pause()  # everything runs on the scheduler and the workers, wait for Ctrl-C
+    except KeyboardInterrupt:
+        _LOGGER.debug("Keyboard interrupt")
+    finally:
+        _LOGGER.debug("Stopping worker processes")
+        scheduler.stop()
+        supervisor.stop()
+        bridge.stop(2)
+        if metrics_server is not None:
+            metrics_server.stop()
+        history.close()
+        _LOGGER.debug("Disconnecting MQTT Client")
+        try:
+            mqttClient.close()
+        finally:
+            offline_buffer.close()     # sync buffered messages even if the client close fails
+        state.close()
+        _LOGGER.debug("Ending Main")
+
+
+if __name__ == "__main__":
+    init_logger(LOG_FILE_PATH, CONSOLE_LEVEL, LOG_LEVEL, async_mode=LOG_ASYNC, max_bytes=LOG_MAX_BYTES,
+                backup_count=LOG_BACKUP_COUNT, rate_limits=LOG_RATE_LIMITS)  # initialize logger
+    _LOGGER.info("Initializing GaragePi (multi-process)")
+    main()
@@ -0,0 +1,114 @@
+import time
+import logging
+import threading
+from publish_policy import PublishPolicy
+from telemetry import REGISTRY
+
+HOLD_TIME = 120         # seconds the area stays occupied after the last motion
+MIN_INTERVAL = 10       # min seconds between occupancy publishes
+
+OCCUPIED = 1
+VACANT = 0
+
+
+class Occupancy:
+    """
+    Turns the edge stream of a PIR sensor into an occupancy signal.
+
+    Any motion marks the area occupied right away.  It only turns vacant once the sensor has
+    seen no motion for the hold time.  Occupancy changes are published through a publish
+    policy with a minimum interval, so a flapping signal is sent at most once per interval.
+    Motion events are also counted per interval.
+    """
+
+    def __init__(self, client, state_topic, timers, hold=HOLD_TIME, min_interval=MIN_INTERVAL,
+                 count_topic=None, heartbeat=None, metrics=REGISTRY):
+        """
+        Args:
+            client (MQTTComms): MQTT client
+            state_topic (str): topic the occupancy state is published on
+            timers (TimerQueue): timer thread running the hold timer
+            hold (float): seconds the area stays occupied after the last motion
+            min_interval (float): min seconds between occupancy publishes
+            count_topic (str): topic publish_counts() publishes the motion event count on
+            heartbeat (float): max seconds the state goes unpublished, the topic policy
+                replaces the client's default policy and its heartbeat
+            metrics (telemetry.Registry): registry occupancy records its metrics into
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._client = client
+        self._state_topic = state_topic
+        self._count_topic = count_topic
+        self._timers = timers
+        self.hold = hold
+        self.state = VACANT
+        self.last_motion = None     # monotonic time of the last motion
+        self.events = 0             # motion events since the last publish_counts()
+        self.total_events = 0
+        self._motion = False        # sensor currently reports motion
+        self._hold_timer = None
+        self._lock = threading.Lock()
+        self._m_events = metrics.counter('occupancy_motion_events_total', 'Motion events',
+                                         topic=state_topic)
+        metrics.gauge('occupancy_state', 'Occupied 1, vacant 0', lambda: self.state, topic=state_topic)
+
+        self._client.set_publish_policy(self._state_topic,
+                                        PublishPolicy(min_interval=min_interval, heartbeat=heartbeat))
+        if self._count_topic is not None:
+            # a count covers one interval, a repeated count would read as new motion
+            self._client.set_publish_policy(self._count_topic, None)
+        self._client.publish(self._state_topic, self.state)
+
+    def motion(self, level):
+        """
+        PIR sensor edge, meant as the PIR callback
+
+        Args:
+            level (int): sensor output, 1 while it detects motion
+        """
+        now = time.monotonic()
+        with self._lock:
+            if level:
+                if self._motion:
+                    return
+                self._motion = True
+                self.events += 1
+                self.total_events += 1
+                self._m_events.inc()
+                self.last_motion = now
+                if self._hold_timer is not None:
+                    self._hold_timer.cancel()
+                    self._hold_timer = None
+                self._set_state(OCCUPIED)
+            else:
+                self._motion = False
+                self.last_motion = now
+                if self._hold_timer is not None:
+                    self._hold_timer.cancel()
+                self._hold_timer = self._timers.call_later(self.hold, self._hold_expired)
+
+    def publish_counts(self):
+        """
+        Publish the number of motion events since the previous call and restart the count
+        """
+        with self._lock:
+            events, self.events = self.events, 0
+        if self._count_topic is not None:
+            self._client.publish(self._count_topic, events)
+
+    def _hold_expired(self):
+        with self._lock:
+            self._hold_timer = None
+            if self._motion:
+                return
+            self.logger.debug("No motion for %.0f sec", self.hold)
+            self._set_state(VACANT)
+
+    def _set_state(self, state):
+        """
+        Publish a state change.  Called with the lock held so changes are published in order.
+        """
+        if state == self.state:
+            return
+        self.state = state
+        self._client.publish(self._state_topic, self.state)
@@ -0,0 +1,185 @@
+import os
+import mmap
+import time
+import struct
+import logging
+import threading
+
+MAGIC = b'GPOB'
+VERSION = 1
+
+# header: magic, version, record size, capacity, head sequence, tail sequence
+_HEADER = struct.Struct('<4sHII QQ')
+HEADER_SIZE = 64
+# record: timestamp, topic length, payload length.  Topic and payload bytes follow.
+_RECORD = struct.Struct('<dHH')
+
+
+class OfflineBuffer:
+    """
+    Disk backed ring buffer of outbound MQTT messages that could not be sent because the
+    broker was not connected.
+
+    The buffer is a single memory mapped file holding a small header followed by 'capacity'
+    fixed size records.  Records are written in sequence order so the SD card only sees
+    sequential writes; once full the oldest record is overwritten.  The header is only
+    rewritten and the file only synced every flush_records messages or flush_interval seconds,
+    and before a replay, so a crash loses at most the messages of the last batch.  The buffer
+    survives a process restart.
+    """
+
+    def __init__(self, path, capacity=1024, record_size=256, collapse=False, flush_records=32,
+                 flush_interval=5.0):
+        """
+        Args:
+            path (str): path to the buffer file
+            capacity (int): number of records in the ring
+            record_size (int): size in bytes of a single record (topic + payload + 12 bytes)
+            collapse (bool, list): topics whose messages supersede each other during replay,
+                e.g. state topics.  True collapses every topic, False keeps every message.
+            flush_records (int): appended messages that trigger a sync to the file
+            flush_interval (float): max seconds an appended message waits for a sync
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.capacity = capacity
+        self.record_size = record_size
+        self.collapse = collapse
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.overwritten = 0
+        self._unflushed = 0
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+        size = HEADER_SIZE + capacity * record_size
+        new_file = not os.path.exists(path) or os.path.getsize(path) != size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        if new_file:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+
+        magic, version, rec_size, cap, self._head, self._tail = _HEADER.unpack_from(self._mm, 0)
+        if new_file or magic != MAGIC or version != VERSION or rec_size != record_size or cap != capacity:
+            self.logger.info("Initializing offline buffer: %s", path)
+            self._head = self._tail = 0
+            self._write_header()
+        elif len(self):
+            self.logger.info("Offline buffer holds %d messages from a previous run", len(self))
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def append(self, topic, msg):
+        """
+        Add a message to the end of the buffer
+
+        Args:
+            topic (str): topic to publish to
+            msg (int,str): msg to publish
+
+        Returns:
+            stored (bool): True if the message fit in a record
+        """
+        topic_bytes = topic.encode('utf-8')
+        payload = str(msg).encode('utf-8')
+        if _RECORD.size + len(topic_bytes) + len(payload) > self.record_size:
+            self.logger.error("Message too large for offline buffer {%s: %s}", topic, msg)
+            return False
+
+        with self._lock:
+            if self._tail - self._head >= self.capacity:
+                self._head += 1             # overwrite the oldest record
+                self.overwritten += 1
+            offset = self._offset(self._tail)
+            _RECORD.pack_into(self._mm, offset, time.time(), len(topic_bytes), len(payload))
+            start = offset + _RECORD.size
+            self._mm[start:start + len(topic_bytes)] = topic_bytes
+            start += len(topic_bytes)
+            self._mm[start:start + len(payload)] = payload
+            self._tail += 1
+            self._unflushed += 1
+            if self._unflushed >= self.flush_records or \
+               time.monotonic() - self._flushed >= self.flush_interval:
+                self._flush()
+        return True
+
+    def flush(self, due=False):
+        """
+        Write the header and sync the appended messages to the file.  Call periodically with
+        due=True so a message appended after a quiet period is synced within flush_interval.
+
+        Args:
+            due (bool): only sync if the last sync is at least flush_interval seconds old
+        """
+        with self._lock:
+            if not self._unflushed or self._mm.closed:
+                return
+            if not due or time.monotonic() - self._flushed >= self.flush_interval:
+                self._flush()
+
+    def peek(self):
+        """
+        Get the buffered messages in order, collapsing superseded messages
+
+        Returns:
+            messages (list): list of (topic, payload, timestamp) tuples
+        """
+        with self._lock:
+            if self._unflushed:
+                self._flush()       # keep what is about to be replayed if the replay fails
+            records = [self._read(seq) for seq in range(self._head, self._tail)]
+
+        # keep only the last message of each collapsible topic, in the position of that message
+        last = {}
+        for index, record in enumerate(records):
+            if self._collapses(record[0]):
+                last[record[0]] = index
+        return [record for index, record in enumerate(records)
+                if not self._collapses(record[0]) or last[record[0]] == index]
+
+    def clear(self):
+        """
+        Discard all buffered messages
+        """
+        with self._lock:
+            self._head = self._tail
+            self._flush()
+
+    def close(self):
+        """
+        Flush and close the buffer file, closing it again has no effect
+        """
+        with self._lock:
+            if self._mm.closed:
+                return
+            self._flush()
+            self._mm.close()
+            os.close(self._fd)
+
+    def _flush(self):
+        self._write_header()
+        self._mm.flush()
+        self._unflushed = 0
+        self._flushed = time.monotonic()
+
+    def _collapses(self, topic):
+        if isinstance(self.collapse, bool):
+            return self.collapse
+        return topic in self.collapse
+
+    def _offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * self.record_size
+
+    def _read(self, seq):
+        offset = self._offset(seq)
+        stamp, topic_len, payload_len = _RECORD.unpack_from(self._mm, offset)
+        start = offset + _RECORD.size
+        topic = self._mm[start:start + topic_len].decode('utf-8')
+        start += topic_len
+        payload = self._mm[start:start + payload_len].decode('utf-8')
+        return topic, payload, stamp
+
+    def _write_header(self):
+        _HEADER.pack_into(self._mm, 0, MAGIC, VERSION, self.record_size, self.capacity,
+                          self._head, self._tail)
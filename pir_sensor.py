@@ -1,28 +1,37 @@
+import logging
 import RPi.GPIO as GPIO
+from telemetry import REGISTRY
 
 class PIR:
     """
     Class to model PIR motion sensor
     """
-    def __init__(self, pin, client, state_topic):
+    def __init__(self, pin, client, state_topic, callback=None, metrics=REGISTRY):
         """
         Args:
             pin (int): RPI input pin for PIR sensor
             client (MQTTComms): MQTT client
+            state_topic (str): topic the raw sensor state is published on, None does not
+                publish the raw state
+            callback (obj): called as callback(state) on every sensor edge, e.g. Occupancy.motion
+            metrics (telemetry.Registry): registry the sensor records its edge count into
         """
         self._pin = pin
         self._client = client
         self._state_topic = state_topic
+        self._callback = callback
         self.logger = logging.getLogger(__class__.__name__)
 
         self.state = 0
+        self._m_edges = metrics.counter('pir_edges_total', 'PIR sensor edges', pin=pin)
 
         # initialize GPIO pin
         GPIO.setup(self._pin, GPIO.IN)
         GPIO.add_event_detect(self._pin, GPIO.BOTH, callback=self._update_state)
 
         # subscribe to the state topic
-        self._client.subscribe(self._state_topic)
+        if self._state_topic is not None:
+            self._client.subscribe(self._state_topic)
 
     def get_state(self):
         """
@@ -33,9 +42,16 @@ class PIR:
         """
         return self.state
 
-    def _update_state(self):
+    def _update_state(self, channel):
         """
         Update the state of when interrupt fires
+
+        Args:
+            channel (int): pin that fired, passed by RPi.GPIO
         """
         self.state = GPIO.input(self._pin)
-        self._client.publish(self._state_topic, self.state)
+        self._m_edges.inc()
+        if self._state_topic is not None:
+            self._client.publish(self._state_topic, self.state)
+        if self._callback is not None:
+            self._callback(self.state)
@@ -0,0 +1,237 @@
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+from topic_trie import TopicTrie
+
+# operations sent from a worker process to the MQTT process
+OP_PUBLISH = 'publish'
+OP_SUBSCRIBE = 'subscribe'
+OP_CALLBACK = 'callback'
+OP_POLICY = 'policy'
+OP_LOG = 'log'
+
+
+class ProxyMessage:
+    """
+    Received MQTT message passed to a worker process, with the attributes message callbacks use
+    """
+    __slots__ = ('topic', 'payload', 'timestamp')
+
+    def __init__(self, topic, payload, timestamp=None):
+        self.topic = topic
+        self.payload = payload
+        self.timestamp = timestamp
+
+
+class QueueClient:
+    """
+    Stand-in for MQTTComms in a worker process.
+
+    Publishes, subscriptions, message callbacks, publish policies and log records are sent over
+    the process's outbound queue to the MQTT process, where a ClientBridge applies them to the
+    real client.  Messages for the callbacks come back over the inbound queue and run on a
+    dispatch thread here.  Publish listeners run locally, in the publishing thread.  A None on
+    the inbound queue asks the process to stop, see join().
+    """
+
+    def __init__(self, name, outbound, inbound):
+        """
+        Args:
+            name (str): worker process name
+            outbound (multiprocessing.Queue): operations for the MQTT process
+            inbound (multiprocessing.Queue): messages for this process's callbacks
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = name
+        self._outbound = outbound
+        self._inbound = inbound
+        self._router = TopicTrie()
+        self._publish_listeners = []
+        self._thread = None
+
+    def start(self):
+        """
+        Start the thread running the message callbacks
+        """
+        self._thread = threading.Thread(target=self._dispatch, name=self.name + "_Dispatch")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def join(self):
+        """
+        Block until the MQTT process asks this process to stop
+        """
+        self._thread.join()
+
+    def close(self):
+        """
+        Send the operations still queued
+        """
+        self._outbound.close()
+        self._outbound.join_thread()
+
+    def log_handler(self):
+        """
+        Returns:
+            handler (logging.Handler): handler sending records to the MQTT process's logging
+        """
+        return _LogHandler(self._outbound, self.name)
+
+    def subscribe(self, topic):
+        self._outbound.put((OP_SUBSCRIBE, self.name, topic))
+
+    def add_message_callback(self, topic, callback):
+        """
+        Register a callback for a topic filter.  The callback runs on this process's dispatch
+        thread.
+        """
+        self._router.add(topic, callback)
+        self._outbound.put((OP_CALLBACK, self.name, topic))
+
+    def add_publish_listener(self, callback):
+        self._publish_listeners.append(callback)
+
+    def set_publish_policy(self, topic, policy):
+        self._outbound.put((OP_POLICY, self.name, topic, policy))
+
+    def publish(self, topic, msg, **kwargs):
+        """
+        Send a message to the MQTT process for publishing, see MQTTComms.publish
+        """
+        for listener in self._publish_listeners:
+            try:
+                listener(topic, msg)
+            except Exception as e:
+                self.logger.error("Publish listener for %s raised: %s", topic, e)
+        self._outbound.put((OP_PUBLISH, self.name, topic, msg, kwargs))
+
+    def _dispatch(self):
+        while True:
+            item = self._inbound.get()
+            if item is None:
+                return
+            message = ProxyMessage(*item)
+            for handler in self._router.match(message.topic):
+                try:
+                    handler(self, None, message)
+                except Exception as e:
+                    self.logger.error("Message callback for %s raised: %s", message.topic, e)
+
+
+class _LogHandler(logging.handlers.QueueHandler):
+    """
+    Sends records, formatted into plain strings, over a worker's outbound queue
+    """
+
+    def __init__(self, outbound, name):
+        super().__init__(outbound)
+        self.name = name
+
+    def enqueue(self, record):
+        self.queue.put((OP_LOG, self.name, record))
+
+
+class ClientBridge:
+    """
+    Applies the operations of the worker processes' QueueClients to the MQTT client, one thread
+    per worker so a burst from one worker never holds up another or paho's network thread.
+
+    Every worker has its own queue pair.  A worker killed while it held a queue lock would
+    block every other user of the queue, so a restarted worker gets new queues and is attached
+    again.
+    """
+
+    def __init__(self, client):
+        """
+        Args:
+            client (MQTTComms): MQTT client
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._client = client
+        self._channels = {}         # worker name -> (outbound, inbound, thread)
+        self._forwarded = set()     # (worker, topic filter) pairs already forwarded
+        self._lock = threading.Lock()
+        self.operations = 0
+
+    def attach(self, name, outbound, inbound):
+        """
+        Serve the queues of a worker, replacing the queues of an earlier instance of it
+
+        Args:
+            name (str): worker name
+            outbound (multiprocessing.Queue): operations from the worker
+            inbound (multiprocessing.Queue): messages for the worker's callbacks
+        """
+        thread = threading.Thread(target=self._run, args=(outbound,), name=name + "_Bridge")
+        thread.daemon = True
+        with self._lock:
+            old = self._channels.get(name)
+            self._channels[name] = (outbound, inbound, thread)
+        thread.start()
+        if old is not None:
+            old[0].put(None)        # end the reader of the old queue
+
+    def request_stop(self, name):
+        """
+        Ask a worker to stop.  It sends what it has queued and exits.
+        """
+        with self._lock:
+            channel = self._channels.get(name)
+        if channel is not None:
+            channel[1].put(None)
+
+    def stop(self, timeout=None):
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            channel[0].put(None)        # ends the reader thread of the outbound queue
+        for channel in channels:
+            channel[2].join(timeout)
+
+    def _run(self, outbound):
+        while True:
+            try:
+                op = outbound.get()
+            except (EOFError, OSError):
+                return
+            if op is None:
+                return
+            self.operations += 1
+            try:
+                self._apply(op)
+            except Exception as e:
+                self.logger.error("Operation %s from %s failed: %s", op[0], op[1], e)
+
+    def _apply(self, op):
+        kind, name = op[:2]
+        if kind == OP_LOG:
+            record = op[2]
+            logging.getLogger(record.name).handle(record)
+        elif kind == OP_PUBLISH:
+            self._client.publish(op[2], op[3], **op[4])
+        elif kind == OP_SUBSCRIBE:
+            self._client.subscribe(op[2])
+        elif kind == OP_POLICY:
+            self._client.set_publish_policy(op[2], op[3])
+        elif kind == OP_CALLBACK:
+            # a restarted worker registers its callbacks again, forward each filter once
+            if (name, op[2]) not in self._forwarded:
+                self._forwarded.add((name, op[2]))
+                self._client.add_message_callback(op[2], self._forwarder(name))
+        else:
+            self.logger.error("Unknown operation %s from %s", kind, name)
+
+    def _forwarder(self, name):
+        def forward(client, userdata, message):
+            with self._lock:
+                inbound = self._channels[name][1]      # the queue of the current instance
+            stamp = getattr(message, 'timestamp', None) or time.monotonic()
+            try:
+                inbound.put_nowait((message.topic, message.payload, stamp))
+            except queue.Full:
+                self.logger.error("%s inbound queue full - dropped message on %s", name,
+                                  message.topic)
+        return forward
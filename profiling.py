@@ -0,0 +1,310 @@
+"""
+On-demand profiling.
+
+The message_callback decorators, DroneThread and PeriodicScheduler check the module level
+`enabled` flag before every call and only time the call while it is set, so the hooks cost one
+global lookup while profiling is off.  ProfileController switches the timing on together with a
+sampling profiler for a number of seconds when asked over MQTT, writes the sampled stacks to a
+collapsed stack file (the input format of flamegraph.pl and speedscope) and publishes a summary.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import collections
+from stats import RunningStats
+
+PROFILE_SECONDS = 30        # default profiling run length
+MAX_SECONDS = 600           # longest profiling run accepted over MQTT
+INTERVAL = 0.005            # seconds between stack samples
+MIN_INTERVAL = 0.001        # shortest sample interval accepted over MQTT
+TOP = 15                    # functions listed in the published summary
+
+enabled = False             # time hooked calls, read by the hooks on every call
+
+_timings = {}               # hook name -> RunningStats
+_lock = threading.Lock()
+
+
+def timed(name, func, *args, **kwargs):
+    """
+    Call a function and record its run time under a name
+
+    Args:
+        name (str): name the run time is recorded under
+        func (obj): function to call
+        args, kwargs: passed to the function
+
+    Returns:
+        the function's return value
+    """
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def record(name, seconds):
+    """
+    Record the run time of a hooked call
+
+    Args:
+        name (str): handler or task name
+        seconds (float): run time
+    """
+    # handlers run concurrently on the dispatcher workers, RunningStats is not thread safe.
+    # Only called while profiling is enabled, so the lock costs nothing otherwise.
+    with _lock:
+        stats = _timings.get(name)
+        if stats is None:
+            stats = _timings[name] = RunningStats()
+        stats.add(seconds)
+
+
+def timings(reset=False):
+    """
+    Get the run time statistics of the hooked calls
+
+    Args:
+        reset (bool): clear the statistics
+
+    Returns:
+        timings (dict): name -> count, min, max, mean and last run time
+    """
+    with _lock:
+        result = {name: stats.snapshot() for name, stats in _timings.items()}
+        if reset:
+            _timings.clear()
+    return result
+
+
+class SamplingProfiler:
+    """
+    Wall clock sampling profiler.  A thread snapshots the stack of every other thread at a fixed
+    interval through sys._current_frames() and counts identical stacks, so the profiled threads
+    are never traced and run at full speed.  Threads blocked in a wait are sampled too.
+    """
+
+    def __init__(self, interval=INTERVAL):
+        """
+        Args:
+            interval (float): seconds between samples
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.interval = interval
+        self.stacks = collections.Counter()     # 'thread;outer;...;inner' -> samples
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, done=None):
+        """
+        Start sampling in the background
+
+        Args:
+            seconds (float): seconds to sample
+            done (obj): called as done(profiler) from the sampling thread when it finishes
+        """
+        if self.running:
+            ErrorString = "Profiler is already running"
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+        self.stacks.clear()
+        self.samples = 0
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(seconds, done), name="Profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        End sampling early, the done callback still runs
+        """
+        self._stop_event.set()
+
+    def write_collapsed(self, path):
+        """
+        Write the sampled stacks in collapsed stack format, one 'frame;frame;... count' line per
+        distinct stack
+
+        Args:
+            path (str): output file
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+    def top(self, count=TOP):
+        """
+        Get the functions seen most often
+
+        Args:
+            count (int): number of functions
+
+        Returns:
+            top (list): dicts with the function, the samples it was running in ('self') and
+                the samples it was on the stack in ('total'), by self samples
+        """
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(';')[1:]       # drop the thread name
+            if not frames:
+                continue
+            own[frames[-1]] += samples
+            for frame in set(frames):
+                total[frame] += samples
+        return [{'function': frame, 'self': samples, 'total': total[frame]}
+                for frame, samples in own.most_common(count)]
+
+    def _run(self, seconds, done):
+        me = threading.get_ident()
+        self.started = time.time()
+        start = time.monotonic()
+        deadline = start + seconds
+        try:
+            while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('%s (%s:%d)' % (code.co_name,
+                                                     os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+        except Exception as e:
+            self.logger.error("Profiler sampling failed: %s", e)
+        finally:
+            # the done callback turns the handler timing off, it must run however sampling ended
+            self.duration = time.monotonic() - start
+            if done is not None:
+                try:
+                    done(self)
+                except Exception as e:
+                    self.logger.error("Profiler done callback raised: %s", e)
+
+
+class ProfileController:
+    """
+    Starts profiling runs requested over MQTT.
+
+    A message on the control topic starts a run: a number of seconds, or a JSON object with
+    'seconds', 'interval' and 'top'.  'stop' ends a run early.  While a run is active every
+    hooked handler and periodic task is timed.  At the end the sampled stacks are written to
+    profile-<time>.folded in the profile directory and a JSON summary with the top functions
+    and the handler timings is published on the result topic.
+    """
+
+    def __init__(self, client, control_topic, result_topic, directory, top=TOP):
+        """
+        Args:
+            client (MQTTComms): MQTT client
+            control_topic (str): topic starting and stopping profiling runs
+            result_topic (str): topic the run summary is published on
+            directory (str): directory the collapsed stack files are written to
+            top (int): default number of functions in the summary
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._client = client
+        self.result_topic = result_topic
+        self.directory = directory
+        self.top = top
+        self._profiler = None
+        self._lock = threading.Lock()
+
+        self._client.set_publish_policy(self.result_topic, None)
+        self._client.subscribe(control_topic)
+        self._client.add_message_callback(control_topic, self.process_control)
+
+    def start(self, seconds=PROFILE_SECONDS, interval=INTERVAL, top=None):
+        """
+        Start a profiling run
+
+        Args:
+            seconds (float): run length
+            interval (float): seconds between stack samples, at least MIN_INTERVAL
+            top (int): number of functions in the summary, defaults to the controller's
+
+        Returns:
+            started (bool): False if a run is already active
+        """
+        global enabled
+        with self._lock:
+            if self._profiler is not None and self._profiler.running:
+                self.logger.info("Profiling run already active")
+                return False
+            seconds = min(float(seconds), MAX_SECONDS)
+            interval = max(MIN_INTERVAL, float(interval))     # also replaces NaN
+            top = int(top) if top else self.top
+            self.logger.info("Profiling for %.0f sec", seconds)
+            timings(reset=True)
+            enabled = True
+            self._profiler = SamplingProfiler(interval)
+            self._profiler.start(seconds, lambda profiler: self._finished(profiler, top))
+            return True
+
+    def stop(self):
+        """
+        End the active profiling run early
+        """
+        with self._lock:
+            if self._profiler is not None:
+                self._profiler.stop()
+
+    def process_control(self, client, userdata, message):
+        """
+        Control topic message callback
+        """
+        payload = message.payload
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        payload = payload.strip()
+        if payload.lower() == 'stop':
+            self.stop()
+            return
+        try:
+            request = json.loads(payload) if payload else {}
+            if not isinstance(request, dict):
+                request = {'seconds': request}
+            self.start(request.get('seconds', PROFILE_SECONDS), request.get('interval', INTERVAL),
+                       request.get('top'))
+        except (TypeError, ValueError) as e:
+            self.logger.error("Invalid profiling request %r: %s", payload, e)
+
+    def _finished(self, profiler, top):
+        global enabled
+        enabled = False
+        path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, 'profile-%s.folded' %
+                                time.strftime('%Y%m%d-%H%M%S', time.localtime(profiler.started)))
+            profiler.write_collapsed(path)
+        except OSError as e:
+            self.logger.error("Unable to write profile: %s", e)
+            path = None
+        summary = {'started': profiler.started,
+                   'duration': profiler.duration,
+                   'samples': profiler.samples,
+                   'interval': profiler.interval,
+                   'file': path,
+                   'top': profiler.top(top),
+                   'timings': timings(),
+                   }
+        self.logger.info("Profiling done - %d samples written to %s", profiler.samples, path)
+        self._client.publish(self.result_topic, json.dumps(summary))
@@ -0,0 +1,167 @@
+import time
+import threading
+
+
+class PublishPolicy:
+    """
+    Rules deciding when a value published on a topic is actually sent
+    """
+
+    def __init__(self, dedupe=True, deadband=None, min_interval=None, heartbeat=None):
+        """
+        Args:
+            dedupe (bool): suppress a message equal to the last one sent
+            deadband (float): suppress numeric values within this distance of the last value sent
+            min_interval (float): min seconds between messages.  A change arriving sooner is
+                held back and sent once the interval has elapsed.
+            heartbeat (float): max seconds of silence.  The last value is sent again when the
+                topic was quiet this long.
+        """
+        self.dedupe = dedupe
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+
+
+class _Entry:
+    __slots__ = ('value', 'sent', 'pending', 'suppressed')
+
+    def __init__(self):
+        self.value = None       # last value sent
+        self.sent = None        # monotonic time the last value was sent
+        self.pending = None     # (value,) held back by min_interval
+        self.suppressed = 0
+
+
+class LastValueCache:
+    """
+    Remembers the last value sent on every topic and applies per topic PublishPolicy rules so
+    devices get change-only publishing without tracking previous values themselves.
+    """
+
+    def __init__(self, default_policy=None):
+        """
+        Args:
+            default_policy (PublishPolicy): policy for topics without their own policy, None
+                sends every message
+        """
+        self.default_policy = default_policy
+        self._policies = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def set_policy(self, topic, policy):
+        """
+        Set the policy of a topic
+
+        Args:
+            topic (str): topic the policy applies to
+            policy (PublishPolicy): policy, None sends every message
+        """
+        with self._lock:
+            self._policies[topic] = policy
+
+    def should_publish(self, topic, msg, now=None, force=False):
+        """
+        Check a message against the topic's policy.  If the message should be sent it is
+        recorded as the topic's last value.
+
+        Args:
+            topic (str): topic to publish to
+            msg (int,str): msg to publish
+            now (float): monotonic time, defaults to time.monotonic()
+            force (bool): send the message whatever the policy says
+
+        Returns:
+            publish (bool): True if the message should be sent now
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            policy = self._policies.get(topic, self.default_policy)
+            entry = self._entries.get(topic)
+            if entry is None:
+                entry = self._entries[topic] = _Entry()
+            if force or policy is None or entry.sent is None:
+                return self._record(entry, msg, now)
+
+            if not self._changed(policy, entry.value, msg):
+                entry.pending = None        # a held back change was reverted
+                if policy.heartbeat is not None and now - entry.sent >= policy.heartbeat:
+                    return self._record(entry, msg, now)
+                entry.suppressed += 1
+                return False
+            if policy.min_interval is not None and now - entry.sent < policy.min_interval:
+                entry.pending = (msg,)
+                entry.suppressed += 1
+                return False
+            return self._record(entry, msg, now)
+
+    def due(self, now=None):
+        """
+        Get the messages that are due because a min_interval elapsed or a heartbeat expired.
+        The returned messages are recorded as sent.
+
+        Args:
+            now (float): monotonic time, defaults to time.monotonic()
+
+        Returns:
+            messages (list): list of (topic, msg) tuples to send
+        """
+        now = time.monotonic() if now is None else now
+        messages = []
+        with self._lock:
+            for topic, entry in self._entries.items():
+                policy = self._policies.get(topic, self.default_policy)
+                if policy is None or entry.sent is None:
+                    continue
+                if entry.pending is not None:
+                    if policy.min_interval is None or now - entry.sent >= policy.min_interval:
+                        self._record(entry, entry.pending[0], now)
+                        messages.append((topic, entry.value))
+                elif policy.heartbeat is not None and now - entry.sent >= policy.heartbeat:
+                    self._record(entry, entry.value, now)
+                    messages.append((topic, entry.value))
+        return messages
+
+    def get(self, topic):
+        """
+        Get the last value sent on a topic
+
+        Args:
+            topic (str): topic
+
+        Returns:
+            value: last value sent, None if nothing was sent yet
+        """
+        with self._lock:
+            entry = self._entries.get(topic)
+            return entry.value if entry is not None else None
+
+    def stats(self):
+        """
+        Get the number of suppressed messages per topic
+
+        Returns:
+            stats (dict): topic -> suppressed message count
+        """
+        with self._lock:
+            return {topic: entry.suppressed for topic, entry in self._entries.items()}
+
+    @staticmethod
+    def _changed(policy, old, new):
+        if policy.deadband is not None:
+            try:
+                # round away float noise so e.g. 72.3 - 72.2 counts as a 0.1 step
+                return round(abs(float(new) - float(old)), 9) >= policy.deadband
+            except (TypeError, ValueError):
+                pass    # not numeric, fall back to an equality check
+        if policy.dedupe or policy.deadband is not None:
+            return new != old
+        return True
+
+    @staticmethod
+    def _record(entry, msg, now):
+        entry.value = msg
+        entry.sent = now
+        entry.pending = None
+        return True
@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+import collections
+from stats import RunningStats
+
+# Overflow policies
+OVERFLOW_BLOCK          = 'block'           # caller waits for space in the queue
+OVERFLOW_DROP_OLDEST    = 'drop_oldest'     # discard the oldest queued message to make room
+OVERFLOW_DROP_NEWEST    = 'drop_newest'     # discard the message being published
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class PublishQueue:
+    """
+    Bounded FIFO of outbound MQTT messages.  Publishers put messages on the queue and return
+    right away, a single sender thread drains it.  Tracks queue depth, dropped messages and
+    the enqueue-to-send latency of every message.
+    """
+
+    def __init__(self, maxsize=100, overflow=OVERFLOW_BLOCK):
+        """
+        Args:
+            maxsize (int): maximum number of queued messages
+            overflow (str): policy to apply when the queue is full (see OVERFLOW_POLICIES)
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if maxsize < 1:
+            ErrorString = "maxsize must be at least 1 (got %s)" % maxsize
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+        if overflow not in OVERFLOW_POLICIES:
+            ErrorString = "Unknown overflow policy: %s" % overflow
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.max_depth = 0
+        self.latency = RunningStats()       # enqueue-to-send latency (seconds)
+
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def put(self, topic, msg, timeout=None, **kwargs):
+        """
+        Queue a message for publishing
+
+        Args:
+            topic (str): topic to publish to
+            msg (int,str): msg to publish
+            timeout (float): max seconds to wait for space when the policy is OVERFLOW_BLOCK
+
+        Keyword Args:
+            passed through to the sender with the message
+
+        Returns:
+            queued (bool): True if the message was queued
+        """
+        item = (topic, msg, kwargs, time.monotonic())
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    self.logger.debug("Publish queue full - dropping newest {%s: %s}", topic, msg)
+                    return False
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    old = self._items.popleft()
+                    self.dropped += 1
+                    self.logger.debug("Publish queue full - dropping oldest {%s: %s}", old[0], old[1])
+                else:
+                    if not self._cond.wait_for(lambda: self._closed or len(self._items) < self.maxsize,
+                                               timeout):
+                        self.dropped += 1
+                        self.logger.debug("Timed out waiting for publish queue {%s: %s}", topic, msg)
+                        return False
+                    if self._closed:
+                        return False
+            self._items.append(item)
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Remove the next message from the queue.  Blocks until a message is available or the
+        queue is closed.
+
+        Args:
+            timeout (float): max seconds to wait for a message
+
+        Returns:
+            item (tuple): (topic, msg, kwargs, enqueue time) or None if the queue is closed and
+                empty or the timeout expired
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or self._items, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def task_done(self, item):
+        """
+        Record that a message returned by get() has been handed to the client
+
+        Args:
+            item (tuple): item returned by get()
+        """
+        self.latency.add(time.monotonic() - item[3])
+
+    def close(self):
+        """
+        Stop accepting messages and wake up any waiting threads.  Messages already queued are
+        still returned by get().
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Get queue statistics
+
+        Returns:
+            stats (dict): depth, max depth, dropped count and enqueue-to-send latency
+        """
+        return {'depth': self.depth,
+                'max_depth': self.max_depth,
+                'maxsize': self.maxsize,
+                'overflow': self.overflow,
+                'dropped': self.dropped,
+                'latency': self.latency.snapshot(),
+                }
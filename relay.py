@@ -0,0 +1,90 @@
+import time
+import logging
+import threading
+import RPi.GPIO as GPIO
+from timers import TimerQueue
+from stats import RunningStats
+
+PULSE_TIME = 0.5        # seconds the relay is held closed
+LOCKOUT = 1.5           # min seconds between the start of two pulses on one pin
+
+
+class _RelayState:
+    __slots__ = ('locked_until', 'pulses', 'rejected', 'drift')
+
+    def __init__(self):
+        self.locked_until = 0.0
+        self.pulses = 0
+        self.rejected = 0
+        self.drift = RunningStats()     # seconds each edge ran after its scheduled time
+
+
+class RelayScheduler:
+    """
+    Drives relay pulses from a single timer thread.  pulse() schedules the HIGH and LOW
+    transitions and returns right away, so a pulse never ties up the calling thread and pulses
+    on different pins overlap freely.  Each pin has a lockout window during which further
+    pulses are rejected.
+    """
+
+    def __init__(self, timers=None):
+        """
+        Args:
+            timers (TimerQueue): timer thread driving the relay edges, a private one is created
+                if not given
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._timers = timers if timers is not None else TimerQueue("Relay")
+        self._relays = {}
+        self._lock = threading.Lock()
+
+    def pulse(self, pin, duration=PULSE_TIME, lockout=LOCKOUT, callback=None):
+        """
+        Close a relay for a given time
+
+        Args:
+            pin (int): GPIO output pin driving the relay
+            duration (float): seconds to hold the pin HIGH
+            lockout (float): seconds from the start of this pulse during which further pulses
+                on the pin are rejected
+            callback (obj): called as callback(pin) from the timer thread once the pin is LOW again
+
+        Returns:
+            accepted (bool): False if the pin is inside its lockout window
+        """
+        now = time.monotonic()
+        with self._lock:
+            relay = self._relays.get(pin)
+            if relay is None:
+                relay = self._relays[pin] = _RelayState()
+            if now < relay.locked_until:
+                relay.rejected += 1
+                self.logger.debug("Pulse on pin %d rejected - locked out for %.2f sec", pin,
+                                  relay.locked_until - now)
+                return False
+            relay.locked_until = now + max(lockout, duration)
+            relay.pulses += 1
+
+        self._timers.schedule(now, self._edge, pin, GPIO.HIGH, now, relay, None)
+        self._timers.schedule(now + duration, self._edge, pin, GPIO.LOW, now + duration, relay, callback)
+        return True
+
+    def stats(self):
+        """
+        Get pulse statistics
+
+        Returns:
+            stats (dict): pin -> pulses, rejected pulses and edge drift statistics
+        """
+        with self._lock:
+            relays = list(self._relays.items())
+        return {pin: {'pulses': relay.pulses,
+                      'rejected': relay.rejected,
+                      'drift': relay.drift.snapshot()}
+                for pin, relay in relays}
+
+    def _edge(self, pin, level, scheduled, relay, callback):
+        GPIO.output(pin, level)
+        relay.drift.add(time.monotonic() - scheduled)
+        if callback is not None:
+            callback(pin)
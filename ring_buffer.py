@@ -0,0 +1,121 @@
+import time
+from array import array
+
+
+class RingBuffer:
+    """
+    Fixed size ring of timestamped float samples.  Storage is two preallocated arrays, so
+    appending never allocates and old samples are overwritten once the ring is full.
+    """
+
+    def __init__(self, size):
+        """
+        Args:
+            size (int): number of samples kept
+        """
+        self.size = size
+        self._values = array('d', bytes(8 * size))
+        self._times = array('d', bytes(8 * size))
+        self._head = 0          # index the next sample is written to
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, now=None):
+        """
+        Add a sample, overwriting the oldest one if the ring is full
+
+        Args:
+            value (float): sample value
+            now (float): sample time, defaults to time.monotonic()
+        """
+        self._values[self._head] = value
+        self._times[self._head] = time.monotonic() if now is None else now
+        self._head = (self._head + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def last(self, n=None):
+        """
+        Get the most recent samples, oldest first
+
+        Args:
+            n (int): number of samples, defaults to all of them
+
+        Returns:
+            values (array): sample values
+        """
+        n = self._count if n is None else min(n, self._count)
+        return self._slice(self._values, n)
+
+    def since(self, start):
+        """
+        Get the samples taken at or after a given time, oldest first
+
+        Args:
+            start (float): time.monotonic() time of the first sample to include
+
+        Returns:
+            values (array): sample values
+        """
+        times = self._slice(self._times, self._count)
+        # samples are appended in time order, count back from the newest one
+        n = 0
+        for t in reversed(times):
+            if t < start:
+                break
+            n += 1
+        return self._slice(self._values, n)
+
+    def _slice(self, data, n):
+        """
+        The n newest entries of one of the arrays, oldest first, as one contiguous array
+        """
+        if n <= 0:
+            return array('d')
+        start = (self._head - n) % self.size
+        if start + n <= self.size:
+            return data[start:start + n]
+        return data[start:] + data[:self._head]
+
+
+def window_stats(values):
+    """
+    Summarize a window of samples
+
+    Args:
+        values (array): sample values
+
+    Returns:
+        stats (dict): count, min, max, mean and median, None values if the window is empty
+    """
+    if not values:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'median': None}
+    return {'count': len(values),
+            'min': min(values),
+            'max': max(values),
+            'mean': sum(values) / len(values),
+            'median': median(values),
+            }
+
+
+def median(values):
+    """
+    Median of a window of samples
+
+    Args:
+        values (array): sample values, must not be empty
+
+    Returns:
+        median (float)
+    """
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2.0
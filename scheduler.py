@@ -0,0 +1,284 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timers import TimerQueue
+from stats import RunningStats
+from telemetry import REGISTRY
+import profiling
+
+BLOCKING_WORKERS = 2        # threads running blocking tasks
+SLOW_TASK = 0.5             # seconds a task may hold the scheduler thread before it is logged
+
+
+class PeriodicTask:
+    """
+    A function run at a fixed rate by a PeriodicScheduler
+    """
+
+    def __init__(self, scheduler, name, period, callback, args, blocking=False, metrics=REGISTRY):
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.args = args
+        self.blocking = blocking    # runs off the scheduler thread
+        self.due = None             # monotonic time of the next run
+        self.runs = 0
+        self.overruns = 0           # runs skipped because an earlier run was late or too slow
+        self.errors = 0
+        self.jitter = RunningStats()    # seconds each run started after its due time
+        self.runtime = RunningStats()   # seconds each run took
+        self.cancelled = False
+        self._scheduler = scheduler
+        self._handle = None
+        self._active = False        # the callback is running
+        self._rerun = False         # run_now() was called while the task was running
+        self._m_runtime = metrics.histogram('task_run_seconds', 'Periodic task run time', task=name)
+        self._m_jitter = metrics.histogram('task_jitter_seconds', 'Periodic task start delay',
+                                           task=name)
+        self._m_overruns = metrics.counter('task_overruns_total', 'Periodic task runs skipped',
+                                           task=name)
+        self._m_errors = metrics.counter('task_errors_total', 'Periodic task exceptions', task=name)
+
+    def cancel(self):
+        """
+        Stop running the task.  A run in progress finishes.
+        """
+        self.cancelled = True
+        if self._handle is not None:
+            self._handle.cancel()
+        self._scheduler._remove(self)
+
+    def set_period(self, period):
+        """
+        Change the time between runs.  If the task is waiting and the new period makes its next
+        run due earlier, the wait is shortened.
+
+        Args:
+            period (float): seconds between runs
+        """
+        if period == self.period:
+            return
+        self._scheduler._set_period(self, period)
+
+    def run_now(self):
+        """
+        Run the task as soon as the scheduler thread is free, or right after the current run if
+        it is running.  The fixed rate restarts from this run.
+        """
+        self._scheduler._reschedule(self, time.monotonic())
+
+    def stats(self):
+        """
+        Get the task statistics
+
+        Returns:
+            stats (dict): period, runs, overruns, errors, jitter and run time statistics
+        """
+        return {'period': self.period,
+                'runs': self.runs,
+                'overruns': self.overruns,
+                'errors': self.errors,
+                'jitter': self.jitter.snapshot(),
+                'runtime': self.runtime.snapshot(),
+                }
+
+
+class AdaptivePeriod:
+    """
+    Picks a polling period from how fast a signal changes.  The period drops to the minimum as
+    soon as the signal moves fast and grows back towards the maximum while it is steady.
+    """
+
+    def __init__(self, minimum, maximum, factor=1.5):
+        """
+        Args:
+            minimum (float): shortest period in seconds
+            maximum (float): longest period in seconds
+            factor (float): growth of the period per steady reading
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.period = minimum
+
+    def update(self, activity):
+        """
+        Update the period after a reading
+
+        Args:
+            activity (float): rate of change relative to the rate that needs the fastest
+                polling, 1 or more polls at the minimum period, below 0.5 counts as steady
+
+        Returns:
+            period (float): seconds until the next reading
+        """
+        if activity >= 1:
+            self.period = self.minimum
+        elif activity < 0.5:
+            self.period = min(self.period * self.factor, self.maximum)
+        return self.period
+
+
+class PeriodicScheduler:
+    """
+    Runs periodic tasks from a single thread, so adding a task does not add a thread.
+
+    Tasks run at a fixed rate: each run is due one period after the previous due time, not
+    after the previous run finished, so the time a task takes does not add up as drift.  If a
+    run starts so late that whole periods went by, the missed runs are skipped and counted as
+    overruns instead of being run back to back.
+
+    Tasks share the thread and must return quickly, a slow task delays the others and shows up
+    in their jitter.  A task that can block, on a sensor read or on disk or network I/O, is
+    created with blocking=True and runs on a small worker pool instead.  The scheduler thread
+    only starts it there.  A task taking longer than SLOW_TASK on the scheduler thread is logged.
+    """
+
+    def __init__(self, timers=None, name="Scheduler", blocking_workers=BLOCKING_WORKERS,
+                 metrics=REGISTRY):
+        """
+        Args:
+            timers (TimerQueue): timer thread running the tasks, a private one is created if not
+                given
+            name (str): name of the private timer thread
+            blocking_workers (int): threads running blocking tasks, started when first needed
+            metrics (telemetry.Registry): registry the task run times are recorded into
+        """
+        self._metrics = metrics
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._own_timers = timers is None
+        self._timers = timers if timers is not None else TimerQueue(name)
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(blocking_workers, thread_name_prefix=name + "_Blocking")
+
+    def every(self, period, callback, *args, name=None, delay=0.0, blocking=False):
+        """
+        Run a function periodically
+
+        Args:
+            period (float): seconds between runs
+            callback (obj): function to run
+            args: arguments passed to the function
+            name (str): task name used in the statistics, defaults to the function name
+            delay (float): seconds until the first run
+            blocking (bool): the function may block, run it on the worker pool
+
+        Returns:
+            task (PeriodicTask)
+        """
+        task = PeriodicTask(self, name or getattr(callback, '__name__', repr(callback)), period,
+                            callback, args, blocking, self._metrics)
+        with self._lock:
+            self._tasks.append(task)
+        task.due = time.monotonic() + delay
+        task._handle = self._timers.schedule(task.due, self._run, task)
+        return task
+
+    def stats(self):
+        """
+        Get statistics for every task
+
+        Returns:
+            stats (dict): task name -> task statistics
+        """
+        with self._lock:
+            tasks = list(self._tasks)
+        return {task.name: task.stats() for task in tasks}
+
+    def stop(self, timeout=None):
+        """
+        Cancel every task and stop the scheduler thread if it is private.  Returns as soon as a
+        task in progress on the scheduler thread finishes, a blocking task still running on the
+        worker pool is not waited for.
+
+        Args:
+            timeout (float): max seconds to wait for the thread
+        """
+        with self._lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        self._pool.shutdown(wait=False)
+        if self._own_timers:
+            self._timers.stop(timeout)
+
+    def _set_period(self, task, period):
+        with self._lock:
+            old, task.period = task.period, period
+            if task._active or task.cancelled:
+                return      # the new period applies when the run finishes
+            due = task.due - old + period
+            if due < task.due:
+                self._schedule(task, max(due, time.monotonic()))
+            else:
+                task.due = due
+
+    def _reschedule(self, task, due):
+        with self._lock:
+            if task.cancelled:
+                return
+            if task._active:
+                task._rerun = True
+                return
+            self._schedule(task, due)
+
+    def _schedule(self, task, due):
+        if task._handle is not None:
+            task._handle.cancel()
+        task.due = due
+        task._handle = self._timers.schedule(due, self._run, task)
+
+    def _remove(self, task):
+        with self._lock:
+            if task in self._tasks:
+                self._tasks.remove(task)
+
+    def _run(self, task):
+        with self._lock:
+            if task.cancelled:
+                return
+            task._active = True
+        if task.blocking:
+            try:
+                self._pool.submit(self._execute, task)
+            except RuntimeError:
+                task._active = False    # the pool was shut down by stop()
+            return
+        self._execute(task)
+
+    def _execute(self, task):
+        start = time.monotonic()
+        task.jitter.add(start - task.due)
+        task._m_jitter.observe(start - task.due)
+        try:
+            task.callback(*task.args)
+        except Exception as e:
+            task.errors += 1
+            task._m_errors.inc()
+            self.logger.error("Task %s raised: %s", task.name, e)
+        end = time.monotonic()
+        task.runs += 1
+        task.runtime.add(end - start)
+        task._m_runtime.observe(end - start)
+        if profiling.enabled:
+            profiling.record('task:' + task.name, end - start)
+        if not task.blocking and end - start > SLOW_TASK:
+            self.logger.warning("Task %s held the scheduler thread for %.2f sec, it should be "
+                                "created with blocking=True", task.name, end - start)
+
+        with self._lock:
+            task._active = False
+            due = task.due + task.period
+            if task._rerun:
+                task._rerun = False
+                due = end
+            elif due <= end:
+                missed = int((end - due) // task.period) + 1
+                task.overruns += missed
+                task._m_overruns.inc(missed)
+                due += missed * task.period
+                self.logger.debug("Task %s overran, skipped %d run(s)", task.name, missed)
+            if not task.cancelled:
+                self._schedule(task, due)
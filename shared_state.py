@@ -0,0 +1,179 @@
+import os
+import time
+import struct
+import logging
+import platform
+from multiprocessing import shared_memory
+
+# block header: sequence counter, odd while writing, and pid of the process writing
+HEADER = struct.Struct('<QI4x')
+WRITE_TIMEOUT = 1.0             # seconds a reader waits for a write in progress
+# CPUs whose store order lets readers skip the lock, see SharedState
+ORDERED_MACHINES = ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+# fields of the GaragePi device state block, (name, struct format)
+DEVICE_FIELDS = (('door1_state', 'b'),          # door_state.STATE_CODES
+                 ('occupancy', 'b'),            # occupancy.OCCUPIED / VACANT
+                 ('mqtt_connected', 'b'),
+                 ('temperature', 'f'),          # last published temperature, F
+                 ('humidity', 'f'),             # last published humidity, %
+                 ('reading_time', 'd'),         # time.time() of the last reading
+                 ('sensor_heartbeat', 'd'),     # time.monotonic() of the sensor process heartbeat
+                 ('actuation_heartbeat', 'd'),  # time.monotonic() of the actuation process heartbeat
+                 )
+
+
+class SharedState:
+    """
+    Fixed layout record in a shared memory block, readable by any process without a lock.
+
+    Writers are serialized by a multiprocessing lock and bump a sequence counter before and
+    after changing the record (a seqlock).  A reader copies the record and retries if the
+    counter was odd or changed meanwhile, so it never sees a half written record and never
+    blocks a writer.  Writes must be short, a reader spins while one is in progress.
+
+    The lock-free read relies on the counter and record stores becoming visible to other
+    processes in program order, which x86 guarantees.  Python issues no memory barriers, so
+    on a weakly ordered CPU such as the Pi's ARM cores reads take the lock too.
+
+    The writer records its pid in the block while it holds the lock, so repair() can tell a
+    lock left behind by a dead writer from one a live writer holds.
+    """
+
+    def __init__(self, fields=DEVICE_FIELDS, name=None, lock=None, locked_reads=None):
+        """
+        Create a block, or attach to an existing one
+
+        Args:
+            fields (tuple): (name, struct format) of every field
+            name (str): shared memory name of an existing block, None creates a new block
+            lock (multiprocessing.Lock): lock serializing writers across processes, required to
+                write, and to read on CPUs without ordered stores
+            locked_reads (bool): read under the lock, None decides from the CPU architecture
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.fields = tuple(field for field, fmt in fields)
+        self._record = struct.Struct('<' + ''.join(fmt for field, fmt in fields))
+        self._lock = lock
+        if locked_reads is None:
+            locked_reads = platform.machine().lower() not in ORDERED_MACHINES
+        self.locked_reads = locked_reads
+        if locked_reads and lock is None:
+            ErrorString = "SharedState needs the lock to read on %s" % platform.machine()
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner,
+                                               size=HEADER.size + self._record.size)
+        self.name = self._shm.name
+        self._buf = self._shm.buf
+        if self._owner:
+            self._buf[:HEADER.size + self._record.size] = bytes(HEADER.size + self._record.size)
+
+    def read(self):
+        """
+        Get a consistent copy of the record
+
+        Returns:
+            state (dict): field name -> value
+        """
+        return dict(zip(self.fields, self._read()))
+
+    def get(self, field):
+        """
+        Args:
+            field (str): field name
+
+        Returns:
+            value of the field
+        """
+        return self._read()[self.fields.index(field)]
+
+    def update(self, **values):
+        """
+        Change some fields of the record
+
+        Args:
+            values: field name -> new value
+        """
+        self._check_writable()
+        with self._lock:
+            record = list(self._record.unpack_from(self._buf, HEADER.size))
+            for field, value in values.items():
+                record[self.fields.index(field)] = value
+            seq = HEADER.unpack_from(self._buf, 0)[0]
+            seq += seq & 1          # a writer died mid-write, the record is rewritten whole
+            HEADER.pack_into(self._buf, 0, seq + 1, os.getpid())
+            self._record.pack_into(self._buf, HEADER.size, *record)
+            HEADER.pack_into(self._buf, 0, seq + 2, 0)
+
+    def repair(self, pid):
+        """
+        Make the block usable again after a writer process died, possibly holding the lock in
+        the middle of a write.  Only call this once the dead process is gone.
+
+        Args:
+            pid (int): pid of the dead process
+
+        Returns:
+            repaired (bool): False if the lock is held by another, live, writer
+        """
+        self._check_writable()
+        if not self._lock.acquire(timeout=WRITE_TIMEOUT):
+            writer = HEADER.unpack_from(self._buf, 0)[1]
+            if writer != pid:
+                self.logger.error("State lock held by pid %s, not by the dead process %s - "
+                                  "leaving it", writer, pid)
+                return False
+            self.logger.error("Releasing the state lock held by the dead process %s", pid)
+            self._lock.release()
+            self._lock.acquire()
+        try:
+            seq = HEADER.unpack_from(self._buf, 0)[0]
+            if seq & 1:
+                HEADER.pack_into(self._buf, 0, seq + 1, 0)
+        finally:
+            self._lock.release()
+        return True
+
+    def close(self):
+        """
+        Detach from the block, the process that created it also removes it
+        """
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def _check_writable(self):
+        if self._lock is None:
+            ErrorString = "SharedState attached without a lock is read only"
+            self.logger.error(ErrorString)
+            raise Exception(ErrorString)
+
+    def _read(self):
+        size = self._record.size
+        if self.locked_reads:
+            if not self._lock.acquire(timeout=WRITE_TIMEOUT):
+                raise TimeoutError("State lock not released, the writer may have died")
+            try:
+                if HEADER.unpack_from(self._buf, 0)[0] & 1:
+                    raise TimeoutError("State write did not finish, the writer died")
+                return self._record.unpack_from(self._buf, HEADER.size)
+            finally:
+                self._lock.release()
+        deadline = None
+        while True:
+            before = HEADER.unpack_from(self._buf, 0)[0]
+            if before & 1:
+                # a write is in progress, let the writer finish
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + WRITE_TIMEOUT
+                elif now > deadline:
+                    raise TimeoutError("State write did not finish, the writer may have died")
+                time.sleep(0)
+                continue
+            data = bytes(self._buf[HEADER.size:HEADER.size + size])
+            if HEADER.unpack_from(self._buf, 0)[0] == before:
+                return self._record.unpack(data)
@@ -0,0 +1,105 @@
+from ring_buffer import RingBuffer, window_stats, median
+
+WINDOW = 60             # samples kept per channel
+MEDIAN_SAMPLES = 5      # samples the median filter runs over
+ALPHA = 0.3             # EMA smoothing factor, 1 disables smoothing
+OUTLIER_LIMIT = 4.0     # max deviation from the window median in scaled MADs
+MIN_DEVIATION = 0.5     # deviations below this are never outliers, guards a flat window
+MAX_REJECTS = 3         # consecutive outliers accepted as a real step change
+
+
+class SignalFilter:
+    """
+    Filters a noisy sensor channel.
+
+    Every sample is first checked against a valid range and against the median of the recent
+    window: a sample further from the median than OUTLIER_LIMIT scaled median absolute
+    deviations is rejected.  Several outliers in a row are taken as a real step change and
+    accepted.  Accepted samples go into a ring buffer, and the filtered value is an EMA of the
+    median of the newest few samples.
+    """
+
+    def __init__(self, window=WINDOW, median_samples=MEDIAN_SAMPLES, alpha=ALPHA,
+                 outlier_limit=OUTLIER_LIMIT, min_deviation=MIN_DEVIATION, valid_range=None,
+                 max_rejects=MAX_REJECTS):
+        """
+        Args:
+            window (int): samples kept for outlier detection and window statistics
+            median_samples (int): samples the median filter runs over
+            alpha (float): EMA smoothing factor, 0-1.  Higher follows the signal faster.
+            outlier_limit (float): max deviation from the window median in scaled MADs
+            min_deviation (float): deviations below this are never outliers
+            valid_range (tuple): (min, max) a sample must be within, None accepts any value
+            max_rejects (int): consecutive outliers accepted as a real step change
+        """
+        self.median_samples = median_samples
+        self.alpha = alpha
+        self.outlier_limit = outlier_limit
+        self.min_deviation = min_deviation
+        self.valid_range = valid_range
+        self.max_rejects = max_rejects
+        self.value = None           # latest filtered value
+        self.accepted = 0
+        self.rejected = 0
+        self._samples = RingBuffer(window)
+        self._rejects = 0           # consecutive outliers
+
+    def add(self, value, now=None):
+        """
+        Add a raw sample
+
+        Args:
+            value (float): raw sample
+            now (float): sample time, defaults to time.monotonic()
+
+        Returns:
+            filtered (float): new filtered value, None if the sample was rejected
+        """
+        if self.valid_range is not None and not self.valid_range[0] <= value <= self.valid_range[1]:
+            self.rejected += 1
+            return None
+        if self._is_outlier(value):
+            self._rejects += 1
+            if self._rejects < self.max_rejects:
+                self.rejected += 1
+                return None
+            # the signal really moved, restart the window at the new level
+            self._samples.clear()
+            self.value = None
+        self._rejects = 0
+        self.accepted += 1
+        self._samples.append(value, now)
+
+        smoothed = median(self._samples.last(self.median_samples))
+        if self.value is None:
+            self.value = smoothed
+        else:
+            self.value += self.alpha * (smoothed - self.value)
+        return self.value
+
+    def stats(self, since=None):
+        """
+        Summarize the accepted samples in the window
+
+        Args:
+            since (float): only include samples taken at or after this time.monotonic() time
+
+        Returns:
+            stats (dict): count, min, max, mean and median of the raw samples, the filtered
+                value and the accepted / rejected sample counts
+        """
+        values = self._samples.last() if since is None else self._samples.since(since)
+        stats = window_stats(values)
+        stats['value'] = self.value
+        stats['accepted'] = self.accepted
+        stats['rejected'] = self.rejected
+        return stats
+
+    def _is_outlier(self, value):
+        values = self._samples.last()
+        if len(values) < self.median_samples:
+            return False        # not enough history to judge
+        center = median(values)
+        mad = median([abs(v - center) for v in values])
+        limit = max(self.outlier_limit * 1.4826 * mad, self.min_deviation)
+        return abs(value - center) > limit
@@ -0,0 +1,202 @@
+import bisect
+import threading
+
+
+class RunningStats:
+    """
+    Thread safe accumulator for count/min/max/mean of a stream of samples
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all accumulated samples
+        """
+        with self._lock:
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+            self.last = None
+
+    def add(self, value):
+        """
+        Add a sample
+
+        Args:
+            value (float): sample value
+        """
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.last = value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def snapshot(self):
+        """
+        Get a copy of the current statistics
+
+        Returns:
+            stats (dict): count, min, max, mean and last sample
+        """
+        with self._lock:
+            return {'count': self.count,
+                    'min': self.min,
+                    'max': self.max,
+                    'mean': self.total / self.count if self.count else None,
+                    'last': self.last,
+                    }
+
+
+# bucket upper bounds in seconds, roughly 1-2-5 steps from 1 ms to 2 minutes
+LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0,
+                  15.0, 20.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """
+    Thread safe fixed bucket histogram.  Memory use does not grow with the number of samples,
+    percentiles are estimated as the upper bound of the bucket the rank falls in.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        """
+        Args:
+            bounds (tuple): sorted bucket upper bounds, samples above the last bound go to an
+                overflow bucket
+        """
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Rebuild a histogram from the output of snapshot()
+
+        Args:
+            snapshot (dict): histogram snapshot
+
+        Returns:
+            histogram (Histogram)
+        """
+        hist = cls([bound for bound, count in snapshot['buckets'][:-1]])
+        hist.counts = [count for bound, count in snapshot['buckets']]
+        hist.count = snapshot['count']
+        hist.total = snapshot['sum']
+        hist.min = snapshot['min']
+        hist.max = snapshot['max']
+        return hist
+
+    def reset(self):
+        """
+        Clear all accumulated samples
+        """
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def add(self, value):
+        """
+        Add a sample
+
+        Args:
+            value (float): sample value
+        """
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, p):
+        """
+        Estimate a percentile
+
+        Args:
+            p (float): percentile, 0-100
+
+        Returns:
+            value (float): upper bound of the bucket holding the percentile, capped at the max
+                sample.  None if there are no samples.
+        """
+        with self._lock:
+            return self._percentile(p)
+
+    def snapshot(self):
+        """
+        Get a copy of the current histogram
+
+        Returns:
+            stats (dict): count, sum, min, max, mean, estimated p50/p95/p99 and the bucket
+                counts as [upper bound, count] pairs, the overflow bucket has a bound of None
+        """
+        with self._lock:
+            return {'count': self.count,
+                    'sum': self.total,
+                    'min': self.min,
+                    'max': self.max,
+                    'mean': self.total / self.count if self.count else None,
+                    'p50': self._percentile(50),
+                    'p95': self._percentile(95),
+                    'p99': self._percentile(99),
+                    'buckets': [[bound, count] for bound, count in
+                                zip(self.bounds + (None,), self.counts)],
+                    }
+
+    def _percentile(self, p):
+        if not self.count:
+            return None
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == len(self.bounds):
+                    return self.max
+                return min(self.bounds[index], self.max)
+        return self.max
+
+
+def summarize(samples):
+    """
+    Summarize a list of samples
+
+    Args:
+        samples (list): sample values
+
+    Returns:
+        summary (dict): count, mean, min, 50th/95th/99th percentile (nearest rank) and max
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[int(round(p / 100.0 * (len(ordered) - 1)))]
+
+    return {'count': len(ordered),
+            'mean': sum(ordered) / len(ordered),
+            'min': ordered[0],
+            'p50': rank(50),
+            'p95': rank(95),
+            'p99': rank(99),
+            'max': ordered[-1],
+            }
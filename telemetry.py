@@ -0,0 +1,334 @@
+"""
+Runtime metrics registry with Prometheus text exposition.
+
+Counters and histograms accumulate into a cell owned by the recording thread, so recording
+takes no lock: each thread only ever writes its own cell and a scrape sums the cells.  Gauges
+are either set directly or computed by a function at scrape time, which costs nothing until
+somebody looks.
+"""
+import json
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from stats import LATENCY_BOUNDS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+
+class _PerThread(_Metric):
+    """
+    Base of metrics that accumulate into one cell per recording thread
+    """
+
+    def __init__(self, name, help, labels):
+        super().__init__(name, help, labels)
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()       # only taken when a thread records for the first time
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = self._new_cell()
+            with self._lock:
+                self._cells.append(cell)
+            return cell
+
+
+class Counter(_PerThread):
+    """
+    Monotonically increasing count
+    """
+    kind = 'counter'
+
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, amount=1):
+        """
+        Args:
+            amount (float): amount to add
+        """
+        self._cell()[0] += amount
+
+    def value(self):
+        with self._lock:
+            return sum(cell[0] for cell in self._cells)
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, set directly or computed by a function at scrape time
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, fn=None):
+        super().__init__(name, help, labels)
+        self._fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        if self._fn is not None:
+            return self._fn()
+        return self._value
+
+
+class Histogram(_PerThread):
+    """
+    Fixed bucket distribution of observed values
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        super().__init__(name, help, labels)
+
+    def _new_cell(self):
+        return [0] * (len(self.bounds) + 1) + [0.0]     # bucket counts, overflow, sum
+
+    def observe(self, value):
+        """
+        Args:
+            value (float): observed value, e.g. seconds
+        """
+        cell = self._cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def value(self):
+        """
+        Returns:
+            counts (list): per bucket counts, the last entry is the overflow bucket
+            total (float): sum of the observed values
+        """
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        with self._lock:
+            cells = list(self._cells)
+        for cell in cells:
+            for i in range(len(counts)):
+                counts[i] += cell[i]
+            total += cell[-1]
+        return counts, total
+
+
+class Registry:
+    """
+    Collection of metrics.  Asking for a metric that already exists with the same name and
+    labels returns the existing one, so instances of a class can share their metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}          # (name, labels) -> metric
+        self._lock = threading.Lock()
+
+    def counter(self, name, help='', **labels):
+        """
+        Get or create a counter
+
+        Args:
+            name (str): metric name
+            help (str): metric description
+            labels: label values of this series
+
+        Returns:
+            counter (Counter)
+        """
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', fn=None, **labels):
+        """
+        Get or create a gauge
+
+        Args:
+            name (str): metric name
+            help (str): metric description
+            fn (obj): function returning the value at scrape time, replaces an existing one
+            labels: label values of this series
+
+        Returns:
+            gauge (Gauge)
+        """
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge._fn = fn
+        return gauge
+
+    def histogram(self, name, help='', bounds=LATENCY_BOUNDS, **labels):
+        """
+        Get or create a histogram
+
+        Args:
+            name (str): metric name
+            help (str): metric description
+            bounds (tuple): bucket upper bounds
+            labels: label values of this series
+
+        Returns:
+            histogram (Histogram)
+        """
+        return self._get(Histogram, name, help, labels, bounds=bounds)
+
+    def unregister(self, metric):
+        with self._lock:
+            self._metrics.pop((metric.name, _label_key(metric.labels)), None)
+
+    def render(self):
+        """
+        Render every metric in Prometheus text format
+
+        Returns:
+            text (str)
+        """
+        lines = []
+        seen = set()
+        for metric in self._sorted():
+            if metric.name not in seen:
+                seen.add(metric.name)
+                lines.append('# HELP %s %s' % (metric.name, metric.help))
+                lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            try:
+                value = metric.value()
+            except Exception as e:
+                logging.getLogger(self.__class__.__name__).error("Metric %s failed: %s",
+                                                                 metric.name, e)
+                continue
+            if metric.kind == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.bounds + ('+Inf',), counts):
+                    cumulative += count
+                    labels = dict(metric.labels, le=str(bound))
+                    lines.append('%s_bucket%s %d' % (metric.name, _format_labels(labels), cumulative))
+                lines.append('%s_sum%s %r' % (metric.name, _format_labels(metric.labels), total))
+                lines.append('%s_count%s %d' % (metric.name, _format_labels(metric.labels), cumulative))
+            else:
+                lines.append('%s%s %r' % (metric.name, _format_labels(metric.labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        Get the current value of every metric, histograms as count and sum
+
+        Returns:
+            snapshot (dict): 'name{labels}' -> value
+        """
+        snapshot = {}
+        for metric in self._sorted():
+            try:
+                value = metric.value()
+            except Exception:
+                continue
+            key = metric.name + _format_labels(metric.labels)
+            if metric.kind == 'histogram':
+                counts, total = value
+                snapshot[key] = {'count': sum(counts), 'sum': total}
+            else:
+                snapshot[key] = value
+        return snapshot
+
+    def _sorted(self):
+        with self._lock:
+            return [self._metrics[key] for key in sorted(self._metrics)]
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, _label_key(labels))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise Exception("Metric %s already registered as a %s" % (name, metric.kind))
+            return metric
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+# registry the GaragePi classes record into
+REGISTRY = Registry()
+REGISTRY.gauge('process_threads', 'Live threads', threading.active_count)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # scrapes are not worth a log line
+
+
+class MetricsServer:
+    """
+    HTTP endpoint serving a registry in Prometheus text format on /metrics
+    """
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9100):
+        """
+        Args:
+            registry (Registry): metrics to serve
+            host (str): address to listen on, 127.0.0.1 only serves the Pi itself
+            port (int): port to listen on, 0 picks a free port
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.registry = registry
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="Metrics_HTTP")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def publish_metrics(client, topic, registry=REGISTRY):
+    """
+    Publish a JSON snapshot of a registry over MQTT.  The topic is exempted from the client's
+    default publish policy, a snapshot is never dropped as a duplicate or repeated as a heartbeat.
+
+    Args:
+        client (MQTTComms): MQTT client
+        topic (str): topic to publish on
+        registry (Registry): metrics to publish
+    """
+    client.set_publish_policy(topic, None)
+    client.publish(topic, json.dumps(registry.snapshot()))
@@ -0,0 +1,45 @@
+import asyncio
+from async_mqtt import AsyncMQTTComms
+from loopback_broker import LoopbackBroker
+
+
+def test_reconnects_after_the_broker_drops_the_connection():
+    broker = LoopbackBroker().start()
+
+    async def run():
+        client = AsyncMQTTComms(broker.host, 'reconnect-test', port=broker.port,
+                                reconnect_delay=0.1, reconnect_max_delay=0.2)
+        assert await client.connect(5)
+        assert await client.publish('t', 'before', qos=1)
+        waiting = client._loop.create_future()
+        client._pending[-1] = waiting       # a publish the broker never acknowledges
+        broker.drop_connections()
+        assert await asyncio.wait_for(waiting, 5) is False
+        await asyncio.sleep(0.2)
+        assert await client.wait_until_ready(5)
+        assert await client.publish('t', 'after', qos=1)
+        await client.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        broker.stop()
+
+
+def test_connects_once_the_broker_comes_up():
+    broker = LoopbackBroker()
+    port = broker.port
+    broker.stop()               # nothing listens on the port yet
+
+    async def run():
+        client = AsyncMQTTComms('127.0.0.1', 'late-broker-test', port=port,
+                                reconnect_delay=0.1, reconnect_max_delay=0.2)
+        assert not await client.connect(0.5)
+        late = LoopbackBroker(port=port).start()
+        try:
+            assert await client.wait_until_ready(5)
+            await client.close()
+        finally:
+            late.stop()
+
+    asyncio.run(run())
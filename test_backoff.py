@@ -0,0 +1,17 @@
+from backoff import Backoff
+
+
+def test_delays_grow_to_the_maximum():
+    backoff = Backoff(initial=1.0, maximum=8.0)
+    steps = [backoff.next_delay() for _ in range(6)]
+    assert 0.5 <= steps[0] <= 1.0
+    assert all(4.0 <= d <= 8.0 for d in steps[3:])
+
+
+def test_long_outage_does_not_overflow():
+    backoff = Backoff(initial=30.0, maximum=60.0)
+    for _ in range(5000):
+        delay = backoff.next_delay()
+    assert 30.0 <= delay <= 60.0
+    backoff.reset()
+    assert backoff.next_delay() <= 30.0
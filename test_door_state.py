@@ -0,0 +1,98 @@
+from door_state import (DoorStateMachine, OPEN, CLOSED, OPENING, CLOSING, UNKNOWN,
+                        INTENT_OPEN, INTENT_CLOSE)
+
+
+class ManualTimers:
+    """
+    Timer queue whose timers only fire when the test says so
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def call_later(self, delay, callback, *args):
+        timer = ManualTimer(self, callback, args)
+        self.pending.append(timer)
+        return timer
+
+    def fire(self):
+        timers, self.pending = self.pending, []
+        for timer in timers:
+            timer.callback(*timer.args)
+
+
+class ManualTimer:
+    def __init__(self, timers, callback, args):
+        self.timers = timers
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        if self in self.timers.pending:
+            self.timers.pending.remove(self)
+
+
+def make_door(closed=True, accept=True):
+    pulses = []
+    states = []
+
+    def pulse():
+        pulses.append(True)
+        return accept
+
+    timers = ManualTimers()
+    door = DoorStateMachine(closed, pulse, timers, on_state=states.append, travel_time=10)
+    return door, timers, pulses, states
+
+
+def test_open_then_travel_completes():
+    door, timers, pulses, states = make_door(closed=True)
+    assert door.command(INTENT_OPEN) is True
+    assert door.state == OPENING
+    timers.fire()
+    assert door.state == OPEN
+    assert states == [OPENING, OPEN]
+    assert len(pulses) == 1
+
+
+def test_repeated_commands_collapse():
+    door, timers, pulses, _ = make_door(closed=False)
+    assert door.command(INTENT_OPEN) is False       # already open
+    assert door.command(INTENT_CLOSE) is True
+    assert door.command(INTENT_CLOSE) is None       # waits for the door to settle
+    assert door.command(INTENT_OPEN) is None        # replaces the waiting close
+    door.sensor(True)                               # reached the closed position
+    assert door.state == OPENING
+    assert len(pulses) == 2
+    assert door.collapsed == 2
+
+
+def test_close_that_never_reaches_the_sensor_is_unknown():
+    door, timers, pulses, _ = make_door(closed=False)
+    door.command(INTENT_CLOSE)
+    timers.fire()
+    assert door.state == UNKNOWN
+    assert door.command(INTENT_CLOSE) is True       # direction comes from the intent
+    assert door.state == CLOSING
+
+
+def test_rejected_pulse_is_retried():
+    door, timers, pulses, _ = make_door(closed=True, accept=False)
+    assert door.command(INTENT_OPEN) is None
+    assert door.state == CLOSED
+    timers.fire()
+    assert len(pulses) == 2
+    assert door.intent == INTENT_OPEN
+
+
+def test_restore_against_the_sensor():
+    door, timers, _, _ = make_door(closed=False)
+    assert door.restore(CLOSING, elapsed=4)
+    assert door.state == CLOSING
+    door, timers, _, _ = make_door(closed=False)
+    assert door.restore(CLOSING, elapsed=30)
+    assert door.state == UNKNOWN
+    door, _, _, _ = make_door(closed=True)
+    assert not door.restore(OPEN, elapsed=1)
+    door, _, _, _ = make_door(closed=False)
+    assert not door.restore(CLOSED, elapsed=1)
@@ -0,0 +1,79 @@
+import time
+from door_state import OPEN, CLOSED, CLOSING, INTENT_OPEN, INTENT_CLOSE
+from journal import Journal, EVENT_DONE, EVENT_FAILED
+from tsdb import SegmentLog
+
+
+def test_recover_command_in_flight_after_restart(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.state(1, OPEN)
+    command_id = journal.command(1, INTENT_CLOSE)
+    journal.pulse(1, command_id)
+    journal.state(1, CLOSING, command_id)
+    journal.close()             # the process dies before the door is closed
+
+    journal = Journal(str(tmp_path))
+    record = journal.recover(1)
+    assert record.state == CLOSING
+    assert record.command_id == command_id
+    assert record.intent == INTENT_CLOSE
+    assert record.pulsed
+    journal.close()
+
+
+def test_recover_finished_and_unpulsed_commands(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.state(1, CLOSED)
+    command_id = journal.command(1, INTENT_OPEN)
+    journal.pulse(1, command_id)
+    journal.state(1, OPEN, command_id)
+    journal.end(1, command_id, EVENT_DONE)
+    record = journal.recover(1)
+    assert record.state == OPEN
+    assert record.command_id is None
+
+    command_id = journal.command(1, INTENT_CLOSE)
+    record = journal.recover(1)
+    assert record.command_id == command_id
+    assert not record.pulsed
+    assert journal.recover(2) is None
+    journal.close()
+
+
+def test_recover_horizon_drops_old_commands(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.state(1, OPEN)
+    journal.command(1, INTENT_CLOSE)
+    time.sleep(0.05)
+    assert journal.recover(1, horizon=0.01).command_id is None
+    assert journal.recover(1, horizon=60).command_id is not None
+    journal.close()
+
+
+def test_command_ids_continue_after_reopen(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path), capacity=2)
+    first = journal.command(1, INTENT_OPEN)
+    journal.end(1, first, EVENT_FAILED)
+    for _ in range(5):          # fills segments without commands after the last one
+        journal.state(1, OPEN)
+    journal.close()
+
+    def scan(self):
+        raise AssertionError("the last command id is read from the segment header")
+    monkeypatch.setattr(SegmentLog, 'reversed', scan)
+    journal = Journal(str(tmp_path), capacity=2)
+    assert journal.command(1, INTENT_CLOSE) == first + 1
+    journal.close()
+
+
+def test_query_by_door_and_time(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.state(1, OPEN)
+    journal.state(2, CLOSED)
+    middle = time.time()
+    journal.command(2, INTENT_OPEN)
+    assert [e['state'] for e in journal.query(door=1)] == [OPEN]
+    events = journal.query(start=middle)
+    assert [(e['door'], e['event'], e['intent']) for e in events] == [(2, 'command', INTENT_OPEN)]
+    assert len(journal.query(end=middle)) == 2
+    journal.close()
@@ -0,0 +1,36 @@
+from publish_policy import PublishPolicy, LastValueCache
+from occupancy import Occupancy, OCCUPIED
+
+
+class CachingClient:
+    """
+    Records what a client with a default publish policy would send
+    """
+
+    def __init__(self, policy):
+        self.cache = LastValueCache(policy)
+        self.sent = []
+
+    def set_publish_policy(self, topic, policy):
+        self.cache.set_policy(topic, policy)
+
+    def publish(self, topic, msg, force=False):
+        if self.cache.should_publish(topic, msg, now=0, force=force):
+            self.sent.append((topic, msg))
+
+
+class NoTimers:
+    def call_later(self, delay, callback, *args):
+        raise AssertionError("no hold timer expected")
+
+
+def test_counts_are_never_repeated_or_suppressed():
+    client = CachingClient(PublishPolicy(dedupe=True, heartbeat=300))
+    occupancy = Occupancy(client, 'pir', NoTimers(), count_topic='pir/count', heartbeat=300)
+    occupancy.motion(1)
+    assert occupancy.state == OCCUPIED
+    occupancy.publish_counts()
+    occupancy.publish_counts()
+    occupancy.publish_counts()
+    assert [msg for topic, msg in client.sent if topic == 'pir/count'] == [1, 0, 0]
+    assert ('pir/count', 0) not in client.cache.due(now=1000)
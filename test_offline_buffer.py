@@ -0,0 +1,76 @@
+import os
+import time
+from offline_buffer import OfflineBuffer, HEADER_SIZE
+
+
+def test_keeps_every_message_by_default(tmp_path):
+    buf = OfflineBuffer(str(tmp_path / 'buf'), capacity=8)
+    for msg in ('a', 'b', 'c'):
+        buf.append('garagepi/door/1/event', msg)
+    assert [m[1] for m in buf.peek()] == ['a', 'b', 'c']
+    buf.close()
+
+
+def test_collapses_only_listed_topics(tmp_path):
+    buf = OfflineBuffer(str(tmp_path / 'buf'), capacity=8, collapse=('state',))
+    buf.append('state', 'open')
+    buf.append('event', 'e1')
+    buf.append('state', 'closing')
+    buf.append('event', 'e2')
+    buf.append('state', 'closed')
+    assert [(m[0], m[1]) for m in buf.peek()] == [('event', 'e1'), ('event', 'e2'),
+                                                  ('state', 'closed')]
+    buf.close()
+
+
+def test_overwrites_oldest_when_full(tmp_path):
+    buf = OfflineBuffer(str(tmp_path / 'buf'), capacity=3)
+    for msg in range(5):
+        buf.append('t', msg)
+    assert [m[1] for m in buf.peek()] == ['2', '3', '4']
+    assert buf.overwritten == 2
+    buf.close()
+
+
+def test_survives_reopen_after_close(tmp_path):
+    path = str(tmp_path / 'buf')
+    buf = OfflineBuffer(path, capacity=8, flush_records=100, flush_interval=3600)
+    buf.append('t', 'kept')
+    buf.close()
+    buf = OfflineBuffer(path, capacity=8)
+    assert [m[1] for m in buf.peek()] == ['kept']
+    buf.clear()
+    buf.close()
+    assert len(OfflineBuffer(path, capacity=8)) == 0
+
+
+def test_header_is_synced_in_batches(tmp_path):
+    path = str(tmp_path / 'buf')
+    buf = OfflineBuffer(path, capacity=8, flush_records=3, flush_interval=3600)
+
+    def header():
+        with open(path, 'rb') as f:
+            return f.read(HEADER_SIZE)
+
+    start = header()
+    buf.append('t', 1)
+    buf.append('t', 2)
+    assert header() == start        # not rewritten before the batch is complete
+    buf.append('t', 3)
+    assert header() != start
+    buf.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 8 * buf.record_size
+
+
+def test_due_flush_syncs_a_quiet_buffer(tmp_path):
+    path = str(tmp_path / 'buf')
+    buf = OfflineBuffer(path, capacity=8, flush_records=100, flush_interval=0.05)
+    buf.append('t', 1)
+    buf.append('t', 2)
+    buf.flush(due=True)             # the buffer was synced when it was opened
+    assert len(OfflineBuffer(path, capacity=8)) == 0
+    time.sleep(0.05)
+    buf.flush(due=True)
+    assert len(OfflineBuffer(path, capacity=8)) == 2
+    buf.close()
+    buf.close()
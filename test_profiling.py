@@ -0,0 +1,62 @@
+import json
+import time
+import types
+import profiling
+from profiling import ProfileController
+
+
+class RecordingClient:
+    def __init__(self):
+        self.published = []
+
+    def set_publish_policy(self, topic, policy):
+        pass
+
+    def subscribe(self, topic):
+        pass
+
+    def add_message_callback(self, topic, callback):
+        pass
+
+    def publish(self, topic, msg, **kwargs):
+        self.published.append((topic, msg))
+
+
+def request(controller, payload):
+    controller.process_control(None, None, types.SimpleNamespace(payload=payload.encode()))
+
+
+def wait_for(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not client.published and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return client.published
+
+
+def test_run_publishes_a_summary(tmp_path):
+    client = RecordingClient()
+    controller = ProfileController(client, 'ctl', 'result', str(tmp_path))
+    request(controller, '{"seconds": 0.2, "interval": "0.01", "top": "3"}')
+    topic, msg = wait_for(client)[0]
+    summary = json.loads(msg)
+    assert topic == 'result'
+    assert summary['interval'] == 0.01
+    assert summary['samples'] > 0
+    assert not profiling.enabled
+
+
+def test_interval_is_clamped(tmp_path):
+    client = RecordingClient()
+    controller = ProfileController(client, 'ctl', 'result', str(tmp_path))
+    request(controller, '{"seconds": 0.1, "interval": 0}')
+    assert json.loads(wait_for(client)[0][1])['interval'] == profiling.MIN_INTERVAL
+
+
+def test_invalid_interval_does_not_start_a_run(tmp_path):
+    client = RecordingClient()
+    controller = ProfileController(client, 'ctl', 'result', str(tmp_path))
+    request(controller, '{"seconds": 1, "interval": null}')
+    request(controller, '{"seconds": 1, "interval": "fast"}')
+    assert not profiling.enabled
+    assert controller.start(0.1, 0.01)
+    assert wait_for(client)
@@ -0,0 +1,44 @@
+from publish_policy import PublishPolicy, LastValueCache
+
+
+def test_dedupe_and_heartbeat():
+    cache = LastValueCache(PublishPolicy(dedupe=True, heartbeat=10))
+    assert cache.should_publish('t', 'open', now=0)
+    assert not cache.should_publish('t', 'open', now=5)
+    assert cache.should_publish('t', 'open', now=10)      # heartbeat due
+    assert cache.should_publish('t', 'closed', now=11)
+
+
+def test_deadband_keeps_heartbeat():
+    cache = LastValueCache(PublishPolicy(dedupe=True, heartbeat=300))
+    cache.set_policy('temp', PublishPolicy(deadband=0.1, heartbeat=300))
+    assert cache.should_publish('temp', 70.0, now=0)
+    assert not cache.should_publish('temp', 70.05, now=100)
+    assert cache.should_publish('temp', 70.2, now=200)
+    assert cache.due(now=400) == []
+    assert cache.due(now=500) == [('temp', 70.2)]
+
+
+def test_min_interval_holds_back_the_latest_change():
+    cache = LastValueCache()
+    cache.set_policy('pir', PublishPolicy(min_interval=5))
+    assert cache.should_publish('pir', 'ON', now=0)
+    assert not cache.should_publish('pir', 'OFF', now=1)
+    assert not cache.should_publish('pir', 'ON', now=2)
+    assert not cache.should_publish('pir', 'OFF', now=3)
+    assert cache.due(now=4) == []
+    assert cache.due(now=5) == [('pir', 'OFF')]
+
+
+def test_no_policy_sends_everything():
+    cache = LastValueCache()
+    assert cache.should_publish('t', 1, now=0)
+    assert cache.should_publish('t', 1, now=0)
+
+
+def test_none_policy_exempts_a_topic_from_the_default():
+    cache = LastValueCache(PublishPolicy(dedupe=True, heartbeat=300))
+    cache.set_policy('report', None)
+    assert cache.should_publish('report', '{}', now=0)
+    assert cache.should_publish('report', '{}', now=1)      # identical reports are all sent
+    assert cache.due(now=1000) == []                        # and never repeated
@@ -0,0 +1,39 @@
+import time
+import threading
+from scheduler import PeriodicScheduler, PeriodicTask
+from telemetry import Registry
+
+
+def test_blocking_task_does_not_delay_others():
+    scheduler = PeriodicScheduler(metrics=Registry())
+    beats = []
+    release = threading.Event()
+    slow = scheduler.every(0.05, release.wait, 5, name="slow", blocking=True)
+    fast = scheduler.every(0.05, lambda: beats.append(time.monotonic()), name="fast")
+    try:
+        time.sleep(0.5)
+        assert slow.runs == 0       # still blocked in its first run
+        assert fast.runs >= 5
+        assert max(b - a for a, b in zip(beats, beats[1:])) < 0.2
+    finally:
+        release.set()
+        scheduler.stop()
+
+
+def test_fixed_rate_and_overruns():
+    scheduler = PeriodicScheduler(metrics=Registry())
+    task = scheduler.every(0.05, time.sleep, 0.12, name="overrun")
+    time.sleep(0.5)
+    scheduler.stop()
+    assert task.runs >= 2
+    assert task.overruns >= task.runs - 1
+
+
+def test_task_metrics_are_created_with_the_task():
+    registry = Registry()
+    scheduler = PeriodicScheduler(metrics=registry)
+    task = scheduler.every(60, lambda: None, name="quiet", delay=60)
+    scheduler.stop()
+    assert isinstance(task, PeriodicTask)
+    assert 'task_run_seconds' in registry.render()
+    assert 'task="quiet"' in registry.render()
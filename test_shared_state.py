@@ -0,0 +1,65 @@
+import multiprocessing
+import pytest
+import shared_state
+from shared_state import SharedState, HEADER
+
+FIELDS = (('door', 'b'), ('temperature', 'f'), ('heartbeat', 'd'))
+
+
+@pytest.fixture(params=[False, True], ids=['seqlock', 'locked'])
+def state(request, monkeypatch):
+    monkeypatch.setattr(shared_state, 'WRITE_TIMEOUT', 0.1)
+    state = SharedState(FIELDS, lock=multiprocessing.Lock(), locked_reads=request.param)
+    yield state
+    state.close()
+
+
+def test_update_and_read(state):
+    state.update(door=3, heartbeat=12.5)
+    assert state.read() == {'door': 3, 'temperature': 0.0, 'heartbeat': 12.5}
+    state.update(temperature=70.5)
+    assert state.get('door') == 3
+    assert state.get('temperature') == 70.5
+
+
+def test_attach_by_name(state):
+    state.update(door=1)
+    other = SharedState(FIELDS, name=state.name, lock=state._lock, locked_reads=state.locked_reads)
+    assert other.get('door') == 1
+    other.update(door=2)
+    assert state.get('door') == 2
+    other.close()
+
+
+def _die_mid_write(state, pid):
+    # what a writer killed between the two sequence counter stores leaves behind
+    state._lock.acquire()
+    seq = HEADER.unpack_from(state._buf, 0)[0]
+    HEADER.pack_into(state._buf, 0, seq + 1, pid)
+
+
+def test_dead_writer_times_out_reads_until_repaired(state):
+    state.update(door=1)
+    _die_mid_write(state, 4242)
+    with pytest.raises(TimeoutError):
+        state.read()
+    assert state.repair(4242)
+    assert state.read()['door'] == 1
+    state.update(door=0)
+    assert state.get('door') == 0
+
+
+def test_repair_leaves_a_live_writers_lock(state):
+    _die_mid_write(state, 4242)
+    assert not state.repair(1111)       # the lock is not the dead process's
+    assert not state._lock.acquire(timeout=0.01)
+    assert state.repair(4242)
+
+
+def test_read_only_attach_needs_the_lock_for_locked_reads(state):
+    with pytest.raises(Exception):
+        SharedState(FIELDS, name=state.name, locked_reads=True)
+    reader = SharedState(FIELDS, name=state.name, locked_reads=False)
+    with pytest.raises(Exception):
+        reader.update(door=1)
+    reader.close()
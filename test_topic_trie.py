@@ -0,0 +1,43 @@
+import pytest
+from topic_trie import TopicTrie, validate_filter, filter_covers, covering_filters
+
+
+def test_match_wildcards():
+    trie = TopicTrie()
+    trie.add('garagepi/door/1/cmd', 'exact')
+    trie.add('garagepi/door/+/cmd', 'single')
+    trie.add('garagepi/#', 'multi')
+    trie.add('#', 'all')
+    assert sorted(trie.match('garagepi/door/1/cmd')) == ['all', 'exact', 'multi', 'single']
+    assert sorted(trie.match('garagepi/door/2/cmd')) == ['all', 'multi', 'single']
+    assert sorted(trie.match('garagepi')) == ['all', 'multi']
+    assert trie.match('$SYS/broker/uptime') == []
+
+
+def test_remove_prunes_filters():
+    trie = TopicTrie()
+    trie.add('a/b', 1)
+    trie.add('a/b', 2)
+    trie.add('a/+', 3)
+    trie.remove('a/b', 1)
+    assert sorted(trie.match('a/b')) == [2, 3]
+    trie.remove('a/b')
+    assert trie.filters() == ['a/+']
+    trie.remove('a/+', 3)
+    assert trie.filters() == []
+    assert trie.match('a/b') == []
+
+
+def test_validate_filter():
+    validate_filter('a/+/b/#')
+    for bad in ('a/#/b', 'a/b#', 'a/b+'):
+        with pytest.raises(ValueError):
+            validate_filter(bad)
+
+
+def test_covering_filters():
+    assert filter_covers('a/#', 'a/b/c')
+    assert filter_covers('a/+', 'a/b')
+    assert not filter_covers('a/+', 'a/b/c')
+    assert not filter_covers('#', '$SYS/x')
+    assert covering_filters(['a/b', 'a/+', 'c/d', 'a/+/e', 'a/#']) == ['a/#', 'c/d']
@@ -0,0 +1,54 @@
+import struct
+from tsdb import TimeSeriesStore, SegmentLog
+
+RECORD = struct.Struct('<dI')
+
+
+def test_query_time_range(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), retention=None)
+    for i in range(100):
+        store.record('temp', float(i), when=1000.0 + i)
+    assert store.query('temp', 1010, 1013) == [(1010.0, 10.0), (1011.0, 11.0), (1012.0, 12.0)]
+    assert store.query('humidity') == []
+    store.close()
+
+
+def test_clock_step_back_keeps_time_order(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), retention=None, capacity=4)
+    for i in range(6):
+        store.record('temp', float(i), when=2000.0 + i)
+    store.flush()
+    # the clock steps back an hour, e.g. NTP correcting the time after boot
+    for i in range(6, 12):
+        store.record('temp', float(i), when=2000.0 - 3600 + i)
+    store.flush()
+    samples = store.query('temp')
+    assert [v for t, v in samples] == [float(i) for i in range(12)]
+    times = [t for t, v in samples]
+    assert times == sorted(times)
+    assert store.query('temp', 2005, 2006) == [(t, v) for t, v in samples if t == 2005.0]
+    assert len(store.query('temp', 2005)) == 7
+    store.close()
+
+
+def test_clamped_log_reopens_in_order(tmp_path):
+    log = SegmentLog(str(tmp_path), RECORD, 'x', b'TEST', capacity=2, retention=None)
+    log.append([(10.0, 1), (11.0, 2), (12.0, 3)])
+    log.append([(5.0, 4), (6.0, 5)])
+    assert log.clamped == 2
+    log.close()
+    log = SegmentLog(str(tmp_path), RECORD, 'x', b'TEST', capacity=2, retention=None)
+    assert [r[1] for r in log.range()] == [1, 2, 3, 4, 5]
+    assert [r[1] for r in log.reversed()] == [5, 4, 3, 2, 1]
+    assert log.last_time == 12.0
+    log.close()
+
+
+def test_expire_counts_back_from_the_newest_record(tmp_path):
+    log = SegmentLog(str(tmp_path), RECORD, 'x', b'TEST', capacity=2, retention=100)
+    log.append([(1000.0, 1), (1001.0, 2), (1050.0, 3), (1051.0, 4)])
+    log.expire()        # nothing is older than 100 sec before the newest record
+    assert len(log.segments) == 2
+    log.append([(1140.0, 5)])     # starts a segment, expires the one older than 1040
+    assert [r[1] for r in log.range()] == [3, 4, 5]
+    log.close()
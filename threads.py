@@ -1,5 +1,7 @@
 import threading
 import time
+from telemetry import REGISTRY
+import profiling
 
 
 class StoppableThread(threading.Thread):
@@ -25,7 +27,8 @@ class StoppableThread(threading.Thread):
 
 class DroneThread(StoppableThread):
     """
-    Stoppable thread that runs a target function in a loop
+    Stoppable thread that runs a target function in a loop.  New periodic jobs should use
+    scheduler.PeriodicScheduler, which runs every job from one thread.
     """
 
     def __init__(self, group=None, target=None, name=None,
@@ -37,6 +40,20 @@ class DroneThread(StoppableThread):
         
     def run(self):
         if self.target:
+            runtime = REGISTRY.histogram('thread_loop_seconds', 'DroneThread target run time',
+                                         thread=self.name)
+            due = time.monotonic()
             while not self._stop_event.is_set():
+                start = time.monotonic()
                 self.target(*self.args, **self.kwargs)   # run the target function
-                time.sleep(self._loopdelay)
+                elapsed = time.monotonic() - start
+                runtime.observe(elapsed)
+                if profiling.enabled:
+                    profiling.record('thread:' + self.name, elapsed)
+                # fixed rate: the next run is due one delay after this one was due, skipping
+                # runs that are already late.  The wait returns as soon as stop() is called.
+                due += self._loopdelay
+                now = time.monotonic()
+                if due < now and self._loopdelay > 0:
+                    due += (now - due) // self._loopdelay * self._loopdelay + self._loopdelay
+                self._stop_event.wait(max(0, due - now))
@@ -0,0 +1,113 @@
+import time
+import heapq
+import logging
+import threading
+import itertools
+
+
+class TimerHandle:
+    """
+    Handle to a scheduled callback, used to cancel it
+    """
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when            # monotonic time the callback is due
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """
+    Runs callbacks at scheduled times from a single thread backed by a heap, so any number of
+    pending timers costs one thread.  Callbacks must be short, a slow callback delays every
+    timer behind it.
+    """
+
+    def __init__(self, name="Timer"):
+        """
+        Args:
+            name (str): name of the timer thread
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._heap = []
+        self._seq = itertools.count()       # tie breaker keeps FIFO order for equal deadlines
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, when, callback, *args):
+        """
+        Run a callback at a given time
+
+        Args:
+            when (float): time.monotonic() time to run the callback at
+            callback (obj): function to call
+            args: arguments passed to the callback
+
+        Returns:
+            handle (TimerHandle)
+        """
+        handle = TimerHandle(when, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._seq), handle))
+            if self._heap[0][2] is handle:
+                self._cond.notify()     # new earliest deadline
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run a callback after a delay
+
+        Args:
+            delay (float): seconds from now
+            callback (obj): function to call
+            args: arguments passed to the callback
+
+        Returns:
+            handle (TimerHandle)
+        """
+        return self.schedule(time.monotonic() + delay, callback, *args)
+
+    def stop(self, timeout=None):
+        """
+        Stop the timer thread.  Pending callbacks are discarded.
+
+        Args:
+            timeout (float): max seconds to wait for the thread
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    if self._heap:
+                        delay = self._heap[0][0] - time.monotonic()
+                        if delay <= 0:
+                            handle = heapq.heappop(self._heap)[2]
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                self.logger.error("Timer callback %s raised: %s", handle.callback, e)
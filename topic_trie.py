@@ -0,0 +1,188 @@
+import threading
+
+WILDCARD_SINGLE = '+'
+WILDCARD_MULTI = '#'
+
+
+class _Node:
+    __slots__ = ('children', 'handlers')
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class TopicTrie:
+    """
+    Maps MQTT topic filters to handlers.  Filters may contain the '+' and '#' wildcards.
+    Looking up the handlers for a topic takes time proportional to the topic depth rather
+    than the number of registered filters.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._lock = threading.Lock()
+
+    def add(self, topic_filter, handler):
+        """
+        Register a handler for a topic filter
+
+        Args:
+            topic_filter (str): MQTT topic filter
+            handler (obj): handler to return for matching topics
+        """
+        validate_filter(topic_filter)
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split('/'):
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _Node()
+                node = child
+            node.handlers.append(handler)
+
+    def remove(self, topic_filter, handler=None):
+        """
+        Remove a handler (or all handlers) registered for a topic filter
+
+        Args:
+            topic_filter (str): MQTT topic filter
+            handler (obj): handler to remove, None removes every handler of the filter
+        """
+        with self._lock:
+            path = [self._root]
+            levels = topic_filter.split('/')
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return
+                path.append(node)
+            node = path[-1]
+            if handler is None:
+                node.handlers = []
+            elif handler in node.handlers:
+                node.handlers.remove(handler)
+            # prune empty branches
+            for level, parent in zip(reversed(levels), reversed(path[:-1])):
+                child = parent.children[level]
+                if child.handlers or child.children:
+                    break
+                del parent.children[level]
+
+    def match(self, topic):
+        """
+        Get the handlers of every filter that matches a topic
+
+        Args:
+            topic (str): topic of a received message
+
+        Returns:
+            handlers (list): matching handlers
+        """
+        levels = topic.split('/')
+        handlers = []
+        nodes = [self._root]
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # wildcards do not match topics starting with '$' (e.g. $SYS)
+                wild = not (depth == 0 and level.startswith('$'))
+                if wild:
+                    multi = node.children.get(WILDCARD_MULTI)
+                    if multi is not None:
+                        handlers.extend(multi.handlers)
+                    single = node.children.get(WILDCARD_SINGLE)
+                    if single is not None:
+                        next_nodes.append(single)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return handlers
+        for node in nodes:
+            handlers.extend(node.handlers)
+            # 'a/#' also matches 'a'
+            multi = node.children.get(WILDCARD_MULTI)
+            if multi is not None:
+                handlers.extend(multi.handlers)
+        return handlers
+
+    def filters(self):
+        """
+        Get every filter that has a handler registered
+
+        Returns:
+            filters (list): topic filters
+        """
+        result = []
+        with self._lock:
+            stack = [(self._root, [])]
+            while stack:
+                node, levels = stack.pop()
+                if node.handlers and levels:
+                    result.append('/'.join(levels))
+                for level, child in node.children.items():
+                    stack.append((child, levels + [level]))
+        return result
+
+
+def validate_filter(topic_filter):
+    """
+    Check that a topic filter uses the wildcards correctly
+
+    Args:
+        topic_filter (str): MQTT topic filter
+    """
+    levels = topic_filter.split('/')
+    for i, level in enumerate(levels):
+        if WILDCARD_MULTI in level and (level != WILDCARD_MULTI or i != len(levels) - 1):
+            raise ValueError("Invalid topic filter: %s ('#' must be the last level)" % topic_filter)
+        if WILDCARD_SINGLE in level and level != WILDCARD_SINGLE:
+            raise ValueError("Invalid topic filter: %s ('+' must occupy a whole level)" % topic_filter)
+
+
+def filter_covers(outer, inner):
+    """
+    Check whether every topic matched by one filter is also matched by another
+
+    Args:
+        outer (str): candidate covering filter
+        inner (str): filter to test
+
+    Returns:
+        covers (bool): True if 'outer' matches everything 'inner' matches
+    """
+    outer_levels = outer.split('/')
+    inner_levels = inner.split('/')
+    if inner.startswith('$') and outer_levels[0] in (WILDCARD_SINGLE, WILDCARD_MULTI):
+        return False
+    for i, level in enumerate(outer_levels):
+        if level == WILDCARD_MULTI:
+            return True
+        if i >= len(inner_levels):
+            return False
+        inner_level = inner_levels[i]
+        if inner_level == WILDCARD_MULTI:
+            return False
+        if level == WILDCARD_SINGLE:
+            continue
+        if level != inner_level:
+            return False
+    return len(outer_levels) == len(inner_levels)
+
+
+def covering_filters(filters):
+    """
+    Reduce a set of filters to the smallest subset that still matches every topic the full
+    set matches, by dropping filters covered by another filter.
+
+    Args:
+        filters (iterable): topic filters
+
+    Returns:
+        filters (list): covering filters, sorted
+    """
+    filters = set(filters)
+    return sorted(f for f in filters
+                  if not any(other != f and filter_covers(other, f) for other in filters))
@@ -0,0 +1,480 @@
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+
+SEGMENT_VERSION = 1
+# magic, version, record size, count, first time, last time, mark
+SEGMENT_HEADER = struct.Struct('<4sHHIddQ')
+HEADER_SIZE = 64
+
+SEGMENT_RECORDS = 65536         # records per segment file
+SEGMENT_DURATION = 86400        # max seconds of data per segment file
+RETENTION = 30 * 86400          # seconds of history kept
+FLUSH_RECORDS = 256             # buffered records that trigger a flush
+
+# time, series id, value
+SAMPLE = struct.Struct('<dHf')
+
+
+class Segment:
+    """
+    Memory mapped, append-only file of fixed width records.
+
+    The first field of every record must be a float time and records must be appended in time
+    order.  The header holds the record count and the first and last record time, so a reader
+    can skip a whole segment from the header and find a time in it by binary search.  The count
+    is only updated after the records it covers were written, a crash during a write leaves the
+    segment at its previous length.  The header also keeps a mark, a counter the owner of the
+    segment can store alongside the records, e.g. the last id it handed out.
+    """
+
+    def __init__(self, path, record, capacity=SEGMENT_RECORDS, magic=b'GPTS', mark=0):
+        """
+        Open a segment, creating it if the file does not exist
+
+        Args:
+            path (str): segment file
+            record (struct.Struct): record layout, the first field is the record time
+            capacity (int): max records of a new segment, existing segments keep their size
+            magic (bytes): 4 byte file type marker
+            mark (int): header mark of a new segment
+        """
+        self.path = path
+        self.record = record
+        self._magic = magic
+        exists = os.path.exists(path)
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(HEADER_SIZE + capacity * record.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.capacity = (len(self._map) - HEADER_SIZE) // record.size
+
+        if exists:
+            file_magic, version, size, self.count, self.first_time, self.last_time, self.mark = \
+                SEGMENT_HEADER.unpack_from(self._map, 0)
+            if file_magic != magic or version != SEGMENT_VERSION or size != record.size:
+                self.close()
+                raise ValueError("%s is not a compatible segment file" % path)
+        else:
+            self.count = 0
+            self.first_time = 0.0
+            self.last_time = 0.0
+            self.mark = mark
+            self._write_header()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, records, mark=None):
+        """
+        Append records with a single write to the mapped file
+
+        Args:
+            records (list): record tuples in time order
+            mark (int): new header mark, written with the record count, None keeps the mark
+
+        Returns:
+            written (int): number of records written, less than given if the segment filled up
+        """
+        records = records[:self.capacity - self.count]
+        if not records:
+            return 0
+        if mark is not None:
+            self.mark = mark
+        data = b''.join(self.record.pack(*r) for r in records)
+        offset = HEADER_SIZE + self.count * self.record.size
+        self._map[offset:offset + len(data)] = data
+        if not self.count:
+            self.first_time = records[0][0]
+        self.last_time = records[-1][0]
+        self.count += len(records)
+        self._write_header()
+        return len(records)
+
+    def find(self, when):
+        """
+        Binary search for a time
+
+        Args:
+            when (float): time to look for
+
+        Returns:
+            index (int): index of the first record at or after the time
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(mid) < when:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start=None, end=None):
+        """
+        Iterate the records in a time range
+
+        Args:
+            start (float): first time to include, None starts at the first record
+            end (float): first time to exclude, None runs to the last record
+
+        Yields:
+            record (tuple)
+        """
+        first = 0 if start is None else self.find(start)
+        last = self.count if end is None else self.find(end)
+        size = self.record.size
+        for offset in range(HEADER_SIZE + first * size, HEADER_SIZE + last * size, size):
+            yield self.record.unpack_from(self._map, offset)
+
+    def reversed(self):
+        """
+        Iterate the records from the newest to the oldest
+
+        Yields:
+            record (tuple)
+        """
+        size = self.record.size
+        for offset in range(HEADER_SIZE + (self.count - 1) * size, HEADER_SIZE - 1, -size):
+            yield self.record.unpack_from(self._map, offset)
+
+    def flush(self):
+        """
+        Write the mapped pages to the file
+        """
+        self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _time(self, index):
+        return struct.unpack_from('<d', self._map, HEADER_SIZE + index * self.record.size)[0]
+
+    def _write_header(self):
+        SEGMENT_HEADER.pack_into(self._map, 0, self._magic, SEGMENT_VERSION, self.record.size,
+                                 self.count, self.first_time, self.last_time, self.mark)
+
+
+class SegmentLog:
+    """
+    Time ordered sequence of Segment files in a directory.  A new segment is started when the
+    current one is full or covers more than the segment duration, segments older than the
+    retention are deleted.
+
+    A Pi has no real time clock, time.time() steps at boot and on NTP sync.  A record older
+    than the last one written is stored at the last written time, so the segments and the
+    records in them stay in time order for the binary search.
+    """
+
+    def __init__(self, directory, record, prefix, magic, capacity=SEGMENT_RECORDS,
+                 duration=SEGMENT_DURATION, retention=RETENTION):
+        """
+        Args:
+            directory (str): directory holding the segment files
+            record (struct.Struct): record layout, the first field is the record time
+            prefix (str): segment file name prefix
+            magic (bytes): 4 byte file type marker
+            capacity (int): records per segment
+            duration (float): max seconds of data per segment
+            retention (float): seconds of data kept, None keeps everything
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.directory = directory
+        self.record = record
+        self.prefix = prefix
+        self.magic = magic
+        self.capacity = capacity
+        self.duration = duration
+        self.retention = retention
+        self.clamped = 0            # records moved forward to keep the log in time order
+        os.makedirs(directory, exist_ok=True)
+        self.segments = []
+        for name in sorted(os.listdir(directory)):
+            if name.startswith(prefix + '-') and name.endswith('.seg'):
+                try:
+                    self.segments.append(Segment(os.path.join(directory, name), record,
+                                                 capacity, magic))
+                except ValueError as e:
+                    self.logger.error("Skipping segment: %s", e)
+
+    def append(self, records, mark=None):
+        """
+        Append time ordered records, starting new segments as needed
+
+        Args:
+            records (list): record tuples
+            mark (int): new mark, stored in the header of the segments written
+        """
+        last = self.last_time
+        ordered = []
+        for record in records:
+            if last is not None and record[0] < last:
+                self.logger.debug("Record %.3f sec older than the last one, stored at the last "
+                                  "time", last - record[0])
+                record = (last,) + tuple(record[1:])
+                self.clamped += 1
+            last = record[0]
+            ordered.append(record)
+        records = ordered
+        touched = set()
+        while records:
+            segment = self._current(records[0][0])
+            written = segment.append(records, mark)
+            touched.add(segment)
+            records = records[written:]
+        for segment in touched:
+            segment.flush()
+
+    def range(self, start=None, end=None):
+        """
+        Iterate the records in a time range across segments
+
+        Args:
+            start (float): first time to include
+            end (float): first time to exclude
+
+        Yields:
+            record (tuple)
+        """
+        for segment in list(self.segments):
+            if not len(segment):
+                continue
+            if start is not None and segment.last_time < start:
+                continue
+            if end is not None and segment.first_time >= end:
+                break
+            for record in segment.range(start, end):
+                yield record
+
+    def reversed(self):
+        """
+        Iterate every record from the newest to the oldest, reading only as far back as the
+        caller iterates
+
+        Yields:
+            record (tuple)
+        """
+        for segment in reversed(list(self.segments)):
+            for record in segment.reversed():
+                yield record
+
+    @property
+    def mark(self):
+        """
+        Mark of the newest segment, new segments start with the mark of the one before them
+        """
+        return self.segments[-1].mark if self.segments else 0
+
+    @property
+    def last_time(self):
+        """
+        Time of the newest record, None if the log is empty
+        """
+        for segment in reversed(self.segments):
+            if len(segment):
+                return segment.last_time
+        return None
+
+    def expire(self, now=None):
+        """
+        Delete segments whose newest record is older than the retention
+
+        Args:
+            now (float): time the retention counts back from, defaults to the newest record
+                time so a clock step can't expire the whole history
+        """
+        if self.retention is None:
+            return
+        if now is None:
+            now = self.last_time
+            if now is None:
+                return
+        cutoff = now - self.retention
+        while len(self.segments) > 1 and self.segments[0].last_time < cutoff:
+            segment = self.segments.pop(0)
+            segment.close()
+            os.remove(segment.path)
+            self.logger.debug("Removed expired segment %s", segment.path)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def _current(self, when):
+        if self.segments:
+            segment = self.segments[-1]
+            if not segment.full and (not len(segment) or when - segment.first_time < self.duration):
+                return segment
+        # names sort in time order, a segment starting in the same millisecond takes the next name
+        stamp = int(when * 1000)
+        if self.segments:
+            last = os.path.basename(self.segments[-1].path)[len(self.prefix) + 1:-len('.seg')]
+            stamp = max(stamp, int(last) + 1)
+        path = os.path.join(self.directory, '%s-%015d.seg' % (self.prefix, stamp))
+        segment = Segment(path, self.record, self.capacity, self.magic, self.mark)
+        self.segments.append(segment)
+        self.expire(when)
+        return segment
+
+
+class TimeSeriesStore:
+    """
+    On-device history of sensor readings and door states.
+
+    Samples are (time, series, value) records in a SegmentLog.  Writes are buffered in memory
+    and written as one batch once FLUSH_RECORDS samples are waiting or flush() is called, so the
+    SD card sees few large sequential writes.  Series names are mapped to small ids kept in a
+    JSON file next to the segments.
+    """
+
+    def __init__(self, directory, flush_records=FLUSH_RECORDS, value_map=None, **kwargs):
+        """
+        Args:
+            directory (str): directory holding the store
+            flush_records (int): buffered samples that trigger a flush
+            value_map (dict): numeric values for non numeric messages passed to record_message,
+                e.g. door states
+
+        Keyword Args:
+            passed to SegmentLog (capacity, duration, retention)
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.flush_records = flush_records
+        self.value_map = value_map or {}
+        self._log = SegmentLog(directory, SAMPLE, 'ts', b'GPTS', **kwargs)
+        self._series_path = os.path.join(directory, 'series.json')
+        self._series = {}
+        if os.path.exists(self._series_path):
+            with open(self._series_path) as f:
+                self._series = json.load(f)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def record(self, series, value, when=None):
+        """
+        Buffer a sample
+
+        Args:
+            series (str): series name, e.g. the MQTT topic
+            value (float): sample value
+            when (float): time.time() of the sample, defaults to now
+        """
+        with self._lock:
+            series_id = self._series_id(series)
+            self._buffer.append((time.time() if when is None else when, series_id, value))
+            full = len(self._buffer) >= self.flush_records
+        if full:
+            self.flush()
+
+    def record_message(self, topic, msg):
+        """
+        Buffer a published MQTT message.  Numeric messages are stored as is, others through
+        the value map, anything else is ignored.  Meant as an MQTTComms publish listener.
+
+        Args:
+            topic (str): topic the message was published on
+            msg (int,float,str): message
+        """
+        try:
+            value = float(msg)
+        except (TypeError, ValueError):
+            value = self.value_map.get(msg)
+            if value is None:
+                return
+        self.record(topic, value)
+
+    def flush(self):
+        """
+        Write the buffered samples
+        """
+        with self._flush_lock:
+            self._write_buffer()
+
+    def query(self, series, start=None, end=None):
+        """
+        Get raw samples of a series
+
+        Args:
+            series (str): series name
+            start (float): first time.time() to include
+            end (float): first time.time() to exclude
+
+        Returns:
+            samples (list): (time, value) tuples in time order
+        """
+        series_id = self._series.get(series)
+        if series_id is None:
+            return []
+        with self._flush_lock:
+            self._write_buffer()
+            return [(t, v) for t, sid, v in self._log.range(start, end) if sid == series_id]
+
+    def downsample(self, series, start, end, step):
+        """
+        Get a series aggregated into fixed time buckets
+
+        Args:
+            series (str): series name
+            start (float): first time.time() to include
+            end (float): first time.time() to exclude
+            step (float): bucket width in seconds
+
+        Returns:
+            buckets (list): (bucket start, count, min, max, mean) tuples for non empty buckets
+        """
+        buckets = {}
+        for t, value in self.query(series, start, end):
+            index = int((t - start) // step)
+            bucket = buckets.get(index)
+            if bucket is None:
+                buckets[index] = [1, value, value, value]
+            else:
+                bucket[0] += 1
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+        return [(start + index * step, count, low, high, total / count)
+                for index, (count, low, high, total) in sorted(buckets.items())]
+
+    def series(self):
+        """
+        Returns:
+            names (list): names of the stored series
+        """
+        return sorted(self._series)
+
+    def close(self):
+        with self._flush_lock:
+            self._write_buffer()
+            self._log.close()
+
+    def _write_buffer(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            batch.sort(key=lambda r: r[0])
+            self._log.append(batch)
+
+    def _series_id(self, series):
+        series_id = self._series.get(series)
+        if series_id is None:
+            series_id = self._series[series] = len(self._series)
+            tmp = self._series_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self._series, f)
+            os.replace(tmp, self._series_path)
+        return series_id
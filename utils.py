@@ -1,16 +1,42 @@
+import queue
+import atexit
 import logging, logging.handlers
+from async_logging import (DeferredQueueHandler, BufferedRotatingFileHandler, AsyncLogWriter,
+                           RateLimitFilter, QUEUE_SIZE)
 
 LOG_LEVEL = logging.DEBUG
 CONSOLE_LEVEL = logging.DEBUG
+MAX_BYTES = 1024 * 1024     # log file size that triggers a rotation
+BACKUP_COUNT = 5            # rotated log files kept
 
+FILE_FORMAT = '%(asctime)s %(threadName)-10s %(name)-12s %(levelname)-8s %(message)s'
+CONSOLE_FORMAT = '%(name)-12s: %(levelname)-8s %(message)s'
+DATE_FORMAT = '%m-%d-%y %H:%M:%S'
 
-def init_logger(fullpath, console_level=CONSOLE_LEVEL, log_level=LOG_LEVEL):
+
+def init_logger(fullpath, console_level=CONSOLE_LEVEL, log_level=LOG_LEVEL, async_mode=False,
+                max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, rate_limits=None):
     """
     Setup the logger object
 
     Args:
         fullpath (str): full path to the log file
+        console_level (int): lowest level written to the console
+        log_level (int): lowest level written to the log file
+        async_mode (bool): calling threads only queue records, a background thread formats
+            them and writes them to the file and console in batches
+        max_bytes (int): log file size that triggers a rotation
+        backup_count (int): rotated log files kept
+        rate_limits (dict): async mode only, logger name -> (records per second, burst) for
+            high volume DEBUG sources
+
+    Returns:
+        writer (AsyncLogWriter): background writer in async mode, None otherwise
     """
+    if async_mode:
+        return _init_async_logger(fullpath, console_level, log_level, max_bytes, backup_count,
+                                  rate_limits)
+
     logging.basicConfig(level=LOG_LEVEL,
                     format='%(asctime)s %(threadName)-10s %(name)-12s %(levelname)-8s %(message)s',
                     datefmt='%m-%d-%y %H:%M:%S',
@@ -21,7 +47,7 @@ def init_logger(fullpath, console_level=CONSOLE_LEVEL, log_level=LOG_LEVEL):
     _logger.setLevel(log_level)
     
     log_handler = logging.handlers.RotatingFileHandler(filename=fullpath, 
-        maxBytes=50, backupCount=10)
+        maxBytes=max_bytes, backupCount=backup_count)
     log_handler.setLevel(log_level)
     _logger.addHandler(log_handler)
     
@@ -37,6 +63,37 @@ def init_logger(fullpath, console_level=CONSOLE_LEVEL, log_level=LOG_LEVEL):
     logging.debug("Creating log file")
 
 
+def _init_async_logger(fullpath, console_level, log_level, max_bytes, backup_count, rate_limits):
+    """
+    Route every record through a queue to an AsyncLogWriter.  The log file is appended to and
+    rotated once it reaches max_bytes.
+    """
+    file_handler = BufferedRotatingFileHandler(filename=fullpath, maxBytes=max_bytes,
+                                               backupCount=backup_count)
+    file_handler.setLevel(log_level)
+    file_handler.setFormatter(logging.Formatter(FILE_FORMAT, DATE_FORMAT))
+    console = logging.StreamHandler()
+    console.setLevel(console_level)
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DeferredQueueHandler(log_queue)
+    if rate_limits:
+        queue_handler.addFilter(RateLimitFilter(rate_limits))
+
+    root = logging.getLogger('')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(min(log_level, console_level))
+
+    writer = AsyncLogWriter(log_queue, [file_handler, console])
+    writer.start()
+    atexit.register(writer.stop, 2)     # write out whatever is still queued
+    logging.debug("Creating log file")
+    return writer
+
+
 def import_credentials(filepath):
     """
     reads a text file with the stored MQTT credentials and returns the username and password